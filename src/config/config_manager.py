@@ -13,18 +13,61 @@ DEFAULT_CONFIG = {  #config["directory_settings"]["temp_directory"] is set on ru
         "file_type": "opus",
         "file_extension": ".opus",
         "default_cover_size": "1200",
-        "yt_dlp_path": "{program_dir}/yt-dlp"
+        "yt_dlp_path": "{program_dir}/yt-dlp",
+        "engine": "binary",
+        "download_timeout_minutes": 120,
+        "use_download_archive": True
     },
     "directory_settings":{
         "keep_perms_consistent": True,
         "music_file_perms": 664,
         "music_directory_perms": 775,
         "group": "None",
-        "auto_update": True
+        "auto_update": True,
+        "scratch_directory": "",
+        "ram_scratch_directory": "/dev/shm"
+    },
+    "queue_settings": {
+        "max_workers": 2,
+        "track_workers": 4,
+        "playlist_workers": 3,
+        "keep_finished_hours": 24,
+        "status_update_seconds": 5
+    },
+    "process_settings": {
+        "transcode_slots": 0,
+        "remux_slots": 0,
+        "probe_slots": 0,
+        "nice": 10,
+        "ionice": True
+    },
+    "maintenance_settings": {
+        "update_interval_hours": 6,
+        "swap_wait_minutes": 30,
+        "permissions_sweep_hours": 24
+    },
+    "http_settings": {
+        "limit_per_host": 4,
+        "request_timeout": 10
+    },
+    "cache_settings": {
+        "info_ttl_minutes": 180,
+        "info_max_entries": 200,
+        "musicbrainz_ttl_days": 30,
+        "musicbrainz_negative_ttl_hours": 24,
+        "cover_store_max_mb": 256,
+        "cover_url_max_mb": 20
+    },
+    "library_settings": {
+        "watcher": "auto",
+        "debounce_seconds": 2,
+        "poll_interval_minutes": 10
     },
     "musicbrainz": {
         "app_name": "YourMusicBot",
-        "contact_email": "tempemail1732218732931@gmail.com"
+        "contact_email": "tempemail1732218732931@gmail.com",
+        "requests_per_second": 1.0,
+        "burst": 1
     },
     "dev":{
         "debug": False
@@ -11,6 +11,15 @@ from utils.metadata import *
 from utils.discord_helpers import *
 from utils.metadata import *
 from utils.file_handling import *
+from utils.job_queue import worker_pool
+from utils.http_client import http_client
+from utils.library_index import library_index
+from utils.library_watcher import library_watcher
+from utils.library_catalog import library_catalog
+from utils.known_lists import known_artists, known_tags
+from utils.progress import ProgressTracker
+from utils.maintenance import scheduler
+from utils.workspace import clear_stale_workspaces
 
 MUSIC_DIRECTORY = config["download_settings"]["music_directory"]
 FILE_EXTENSION = config["download_settings"]["file_extension"]
@@ -24,6 +33,26 @@ class MyBot(commands.Bot):
         self.tree.add_command(ReplaceGroup())
         self.tree.add_command(ListGroup())
         await self.tree.sync()  # Sync with current command tree
+        clear_stale_workspaces()    #scratch files of jobs interrupted by a crash/restart
+        # Start draining the job queue (includes jobs left over from before a restart)
+        worker_pool.register("download", run_download_job)
+        worker_pool.register("thumbnail", run_thumbnail_job)
+        worker_pool.register("timestamps", run_timestamps_job)
+        worker_pool.start()
+        scheduler.start()   #periodic updates and other maintenance
+        # Bring the library index up to date in the background and keep it in sync with outside changes.
+        # Lookups list directories until the first refresh is done
+        library_watcher.start()
+        # Files changed outside the bot get the configured permissions too (in a thread, batches can be large)
+        library_watcher.add_listener(
+            lambda paths: asyncio.to_thread(apply_directory_permissions, paths, recursive=False))
+        asyncio.create_task(scheduler.run_now("permissions sweep"))
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            await http_client.close()   #the shared HTTP session lives on the bot's event loop
 
 # Enable necessary intents
 intents = discord.Intents.default()
@@ -73,55 +102,124 @@ async def download(interaction: discord.Interaction, link: str, type: str = "Son
     timestamps = None
     if addtimestamps: #addtimestamps true, ask user for timestamps before downloading
         timestamps = await ask_for_something(interaction,"timestamps")  # Prompt user for timestamps
-    # Download the audio in a separate thread
-    audio_file,error_str,output_name = await download_audio(interaction, link, type, title, artist, tags, album, addtimestamps, usedatabase, excludetracknumsforplaylist)
+
+    #resolve defaults and confirm with the user, then hand off to the job queue
+    download_args, error_str = await prepare_download(interaction, link, type, title, artist, tags, album)
     if error_str:
         await safe_send(interaction,f"❗Failed to download audio. Error:\n{error_str}")
         return
+    download_args.update({
+        "addtimestamps": addtimestamps,
+        "usedatabase": usedatabase,
+        "excludetracknumsforplaylist": excludetracknumsforplaylist,
+        "timestamps": timestamps,
+        "artist": artist
+    })
+    #the same request from someone else is already queued/running: share that job instead of doing the work twice
+    dedupe_key = download_dedupe_key(download_args)
+    existing_job = worker_pool.queue.find_active("download", dedupe_key)
+    if existing_job is not None:
+        await safe_send(interaction, f"🔁The same download is already queued (job {existing_job}), it will be in the library once it finishes")
+        return
+    download_args["dedupe_key"] = dedupe_key
+    job_id, position = worker_pool.submit("download", download_args, interaction)
+    await safe_send(interaction, queued_message("Download", job_id, position))
+    return
 
-    if usedatabase: #run replace_thumbnail here
-        if type == "playlist":
-            playlist = True
-        else:
-            playlist = False
-        #replace_thumbnail(title,playlist=True,cover_URL=None, album=None, artist=None, strict=True, releasetype = None, size=None)
-        output_str, error_str = await replace_thumbnail(output_name,playlist,None,album,artist, True, None, None)
+def queued_message(what: str, job_id: int, position: int) -> str:
+    """Message sent to the user after a job is queued"""
+    if position <= 1:
+        return f"📥{what} queued (job {job_id}), starting shortly"
+    return f"📥{what} queued (job {job_id}), position {position} in queue"
+
+async def update_library(*paths):
+    """Refresh the library index and permissions (if enabled) of the paths a job wrote. Directories are updated recursively"""
+    paths = [path for path in paths if path]
+    await asyncio.to_thread(library_index.refresh_paths, paths)
+    await asyncio.to_thread(apply_directory_permissions, paths)
+
+async def run_download_job(job: dict, interaction: Optional[discord.Interaction]) -> Optional[str]:
+    """Job handler for "download" jobs. interaction is None if the job was resumed after a restart
+    
+    :return: None on success, else error str"""
+    args = job["args"]
+    type = args["type"]
+    addtimestamps = args["addtimestamps"]
+    timestamps = args["timestamps"]
+    async def send(content, **kwargs):
+        await send_job_message(bot, job, interaction, content, **kwargs)
+
+    #one status message, edited as progress comes in
+    status = JobStatusMessage(bot, job, interaction)
+    progress = ProgressTracker(status.update, args["output_name"])
+    audio_file,error_str,output_name = await download_audio(args["video_url"], type, args["output_name"], args["artist_name"],
+        args["tags_str"], args["album"], addtimestamps, args["usedatabase"], args["excludetracknumsforplaylist"], progress,
+        args.get("overwrite", False))
+    #only replaces the status line if one was shown (nothing is posted if it finished before the first update was due)
+    await progress.finish(f"❗{args['output_name']}: download failed" if error_str else f"✅{args['output_name']}: download finished")
+    if error_str:
+        await send(f"❗Failed to download audio. Error:\n{error_str}")
+        return error_str
+
+    if type == "playlist":
+        if args["usedatabase"]: #run replace_thumbnail here
+            #replace_thumbnail(title,playlist=True,cover_URL=None, album=None, artist=None, strict=True, releasetype = None, size=None)
+            output_str, error_str = await replace_thumbnail(output_name,True,None,args["album"],args["artist"], True, None, None)
+            if(output_str):
+                await send(output_str)
+            if(error_str):
+                await send(error_str)
+        await send("🎊Audio downloaded without chapters:\ntype = Playlist",ephemeral=False)
+        await update_library(os.path.join(MUSIC_DIRECTORY, output_name))
+        return None
+
+    #cover and chapters are collected in a plan, then written to the file once
+    plan = MetadataPlan(audio_file)
+    if args["usedatabase"]:
+        output_str, error_str = await replace_thumbnail(output_name,False,None,args["album"],args["artist"], True, None, None, plan=plan)
         if(output_str):
-            await safe_send(interaction,output_str)
+            await send(output_str)
         if(error_str):
-            await safe_send(interaction,error_str)
+            await send(error_str)
 
+    chapters = None
     #if timestamps exist, then user entered timestamps, so use those
-    if timestamps and (type != "playlist"): 
-        success, error_str = await apply_timestamps_to_file(timestamps,audio_file)
-        if(success == False):
-            await safe_send(interaction,f"❗Failed to apply chapters: {error_str}")
-            return    
-                
-    if(type != "playlist"):
-        timestamp_file,error_str = await extract_chapters(audio_file)    #get timestamps (either user or embedded in video)
+    if timestamps:
+        chapters = parse_timestamps(timestamps)
+        if not chapters:
+            await send("❗Failed to apply chapters: No valid timestamps found.")
+            return "No valid timestamps found."
+        plan.set_chapters(chapters)
     else:
-        timestamp_file,error_str=None,"type = Playlist"
-
-    #Prompt user for timestamps if no timestamp file and user didnt enter False for adding timestamps
-    if (timestamp_file == None) and (addtimestamps != False) and (type != "playlist"):
-        #prompt user defined templates 
-        if (await ask_confirmation(interaction, "Would you like to add timestamps?")):
-            timestamps = await ask_for_something(interaction,"timestamps")  # Prompt user for timestamps
-            success, error_str = await apply_timestamps_to_file(timestamps,audio_file)
-            if(success == False):
-                await safe_send(interaction,f"❗Failed to apply chapters: {error_str}")   
-                return
-            timestamp_file,error_str = await extract_chapters(audio_file)    #convert user provided timestamps to .txt
-    
+        chapters,error_str = await read_chapters(audio_file)    #chapters embedded from the video
+        #Prompt user for timestamps if no chapters and user didnt enter False for adding timestamps
+        #only possible while the interaction that queued the job is still around
+        if (not chapters) and (addtimestamps != False) and interaction:
+            if (await ask_confirmation(interaction, "Would you like to add timestamps?")):
+                timestamps = await ask_for_something(interaction,"timestamps")  # Prompt user for timestamps
+                chapters = parse_timestamps(timestamps) if timestamps else []
+                if not chapters:
+                    await send("❗Failed to apply chapters: No valid timestamps found.")
+                    return "No valid timestamps found."
+                plan.set_chapters(chapters)
+
+    success, error_str = await plan.commit()
+    if not success:
+        await send(f"❗Failed to write metadata: {error_str}")
+        return error_str
+
+    timestamp_file = None
+    if chapters:
+        #musicolet .txt comes straight from the chapters, no need to probe the file again
+        timestamp_file,error_str = write_chapter_file(chapters, audio_file.replace(f"{FILE_EXTENSION}", ".txt"))
+
     if timestamp_file:
-        # Chapters were extracted using extract_chapters()
-        await interaction.followup.send("🎊Chapters saved! Uploading file...", file=discord.File(timestamp_file),ephemeral=False)
+        await send("🎊Chapters saved! Uploading file...", file=discord.File(timestamp_file),ephemeral=False)
     else:
-        await safe_send(interaction,f"🎊Audio downloaded without chapters:\n{error_str}",ephemeral=False)
+        await send(f"🎊Audio downloaded without chapters:\n{error_str}",ephemeral=False)
     
-    apply_directory_permissions()    #update perms if enabled
-    return
+    await update_library(audio_file, timestamp_file)
+    return None
 
 """Replace commands"""
 class ReplaceGroup(app_commands.Group):
@@ -136,8 +234,11 @@ class ReplaceGroup(app_commands.Group):
         else:
             audio_file = find_file_case_insensitive(MUSIC_DIRECTORY, f"{title}")
         if not audio_file:    #check if file exists
-            tree = save_music_tree()
-            await interaction.followup.send("❗File does not exist. Available songs:",file=discord.File(tree))
+            #show close matches, or the first page of the library if nothing matches
+            matches = await asyncio.to_thread(library_catalog.format_page, title)
+            if matches.startswith("❗"):
+                matches = await asyncio.to_thread(library_catalog.format_page)
+            await interaction.followup.send(f"❗File does not exist. Available songs:\n{matches}"[:2000])
             return None
         return audio_file
 
@@ -159,32 +260,13 @@ class ReplaceGroup(app_commands.Group):
             if audio_file == None:
                 return
             
-            if remove:
-                success, error_str = await apply_timestamps_to_file(None,audio_file,remove)
-                if(success):
-                    chapter_file = audio_file.replace(f"{FILE_EXTENSION}", ".txt")
-                    if os.path.exists(chapter_file):
-                        os.remove(chapter_file)
-                    await interaction.followup.send("🎊Chapters removed successfully!")
-                else:
-                    await safe_send(interaction,f"❗Failed to remove chapters: {error_str}")  
-                    return          
-            else:
+            timestamps = None
+            if not remove:
                 timestamps = await ask_for_something(interaction, "timestamps")  # Prompt user for timestamps
-                success, error_str = await apply_timestamps_to_file(timestamps,audio_file,remove)
-                if(success):
-                    timestamp_file, err = await extract_chapters(audio_file)    #convert user provided timestamps to .txt
-                    if timestamp_file:
-                        # Extract chapters using musicolet_timestamp_converter.py
-                        await interaction.followup.send("🎊Chapters saved! Uploading file...", file=discord.File(timestamp_file))
-                    else:   
-                        await safe_send(interaction,f"❗No timestamp file generated: {err}")
-                        return
-                else:
-                    await safe_send(interaction,f"❗Failed to apply chapters: {error_str}")            
+            job_id, position = worker_pool.submit("timestamps", {"audio_file": audio_file, "timestamps": timestamps, "remove": remove}, interaction)
+            await safe_send(interaction, queued_message("Timestamp replacement", job_id, position))
         except Exception as e:
             await safe_send(interaction,f"❌Error: {str(e)}")
-        apply_directory_permissions()    #update perms if enabled
         return
         
     @app_commands.command(name="thumbnail", description="Replace thumbnail on an already existing audio file")
@@ -231,41 +313,101 @@ class ReplaceGroup(app_commands.Group):
             if cover_url == None:
                 return
         
-        #replace_thumbnail(title,playlist=True,cover_URL=None, album=None, artist=None, strict=True, releasetype = None, size=None)
-        output_str, error_str = await replace_thumbnail(title,playlist,cover_url,album,artist,strict,releasetype,size)
-
-        if(output_str):
-            await safe_send(interaction,output_str)
-        if(error_str):
-            await safe_send(interaction,error_str)
-
-        apply_directory_permissions()    #update perms if enabled
+        thumbnail_args = {"title": title, "playlist": playlist, "cover_url": cover_url, "album": album, "artist": artist,
+                          "strict": strict, "releasetype": releasetype, "size": size}
+        job_id, position = worker_pool.submit("thumbnail", thumbnail_args, interaction)
+        await safe_send(interaction, queued_message("Thumbnail replacement", job_id, position))
         return
 
+async def run_timestamps_job(job: dict, interaction: Optional[discord.Interaction]) -> Optional[str]:
+    """Job handler for "timestamps" jobs (/replace timestamps)
+
+    :return: None on success, else error str"""
+    args = job["args"]
+    audio_file = args["audio_file"]
+    async def send(content, **kwargs):
+        await send_job_message(bot, job, interaction, content, **kwargs)
+
+    if args["remove"]:
+        success, error_str = await apply_timestamps_to_file(None,audio_file,True)
+        if(success):
+            chapter_file = audio_file.replace(f"{FILE_EXTENSION}", ".txt")
+            if os.path.exists(chapter_file):
+                os.remove(chapter_file)
+            await send("🎊Chapters removed successfully!")
+        else:
+            await send(f"❗Failed to remove chapters: {error_str}")  
+            return error_str
+    else:
+        success, error_str = await apply_timestamps_to_file(args["timestamps"],audio_file,False)
+        if(success):
+            timestamp_file, err = await extract_chapters(audio_file)    #convert user provided timestamps to .txt
+            if timestamp_file:
+                await send("🎊Chapters saved! Uploading file...", file=discord.File(timestamp_file))
+            else:   
+                await send(f"❗No timestamp file generated: {err}")
+                return err
+        else:
+            await send(f"❗Failed to apply chapters: {error_str}")
+            return error_str
+    await update_library(audio_file, audio_file.replace(f"{FILE_EXTENSION}", ".txt"))
+    return None
+
+async def run_thumbnail_job(job: dict, interaction: Optional[discord.Interaction]) -> Optional[str]:
+    """Job handler for "thumbnail" jobs (/replace thumbnail)
+
+    :return: None on success, else error str"""
+    args = job["args"]
+    #replace_thumbnail(title,playlist=True,cover_URL=None, album=None, artist=None, strict=True, releasetype = None, size=None)
+    output_str, error_str = await replace_thumbnail(args["title"],args["playlist"],args["cover_url"],args["album"],
+        args["artist"],args["strict"],args["releasetype"],args["size"])
+
+    if(output_str):
+        await send_job_message(bot, job, interaction, output_str)
+    if(error_str):
+        await send_job_message(bot, job, interaction, error_str)
+
+    name = args["title"] or args["album"]
+    path = find_file_case_insensitive(MUSIC_DIRECTORY, name if args["playlist"] else f"{name}{FILE_EXTENSION}")
+    await update_library(path)
+    return None if output_str else error_str
+
 """List commands"""
 class ListGroup(app_commands.Group):
     def __init__(self):
         super().__init__(name="list", description="List related commands")
 
-    @app_commands.command(name="music", description="list all music files")
-    async def list_music(self, interaction: discord.Interaction):
-        """function to list all music"""
+    @app_commands.command(name="music", description="list music files")
+    async def list_music(self, interaction: discord.Interaction, query: str = None, prefix: str = None,
+        page: int = 1, file: bool = False):
+        """
+        function to list music, a page at a time
+
+        :param query: only show paths containing this. Case insensitive
+        :param prefix: only show paths starting with this, eg: a playlist folder. Case insensitive
+        :param page: page number
+        :param file: True: send the whole library as tree.txt instead
+        """
         if not await check_whitelist(interaction): return   #check for whitelist
-        tree = save_music_tree()
-        await interaction.response.send_message(file=discord.File(tree),ephemeral=True)
+        if file:
+            tree = await asyncio.to_thread(save_music_tree)
+            await interaction.response.send_message(file=discord.File(tree),ephemeral=True)
+            return
+        message = await asyncio.to_thread(library_catalog.format_page, query, prefix, page)
+        await interaction.response.send_message(message[:2000],ephemeral=True)
         return
 
     @app_commands.command(name="artists", description="list all authors in use")
     async def list_artists(self, interaction: discord.Interaction):
         """function to list all authors that are stored"""
         if not await check_whitelist(interaction): return   #check for whitelist
-        await interaction.response.send_message(f"List of authors: {get_entries_from_json('artists.json')}",ephemeral=True)
+        await interaction.response.send_message(f"List of authors: {known_artists.entries()}",ephemeral=True)
 
     @app_commands.command(name="tags", description="list all tags in use")
     async def list_tags(self, interaction: discord.Interaction):
         """function to list all tags that are stored"""
         if not await check_whitelist(interaction): return   #check for whitelist
-        await interaction.response.send_message(f"List of tags: {get_entries_from_json('tags.json')}",ephemeral=True)
+        await interaction.response.send_message(f"List of tags: {known_tags.entries()}",ephemeral=True)
 
 @bot.tree.command(name="help", description="Shows a paginated help menu")
 async def help_command(interaction: discord.Interaction):
@@ -334,7 +476,6 @@ async def help_command(interaction: discord.Interaction):
 @bot.event
 async def on_ready():
     # Remove the command group additions and sync from here
-    apply_directory_permissions()
     print(f"Logged in as {bot.user}")
 
 update_files()
@@ -1,53 +1,113 @@
 import asyncio
-import discord
 import os
 import re
-import json
-import grp
-import sys
-
-async def run_command(command, verbose=False):
-    """Run a command asynchronously and optionally stream its output in real-time.
-    If verbose=True, then output will print to console
-    
-    :return: returncode, stdout_lines, stderr_lines
+import signal
+from collections import deque
+
+READ_CHUNK_SIZE = 65536
+KEEP_LINES = 200    #lines of output kept per stream (only the last ones, older lines are dropped)
+KILL_GRACE_SECONDS = 5
+TIMEOUT_RETURNCODE = -1
+LINE_END = re.compile(rb"[\r\n]")
+
+def _kill_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def _stop_process(process):
+    """SIGTERM the process group, SIGKILL it if it doesn't exit within KILL_GRACE_SECONDS"""
+    if process.returncode is not None:
+        return
+    _kill_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        _kill_group(process, signal.SIGKILL)
+        await process.wait()
+
+async def run_process(argv: list, verbose: bool = False, on_line=None, timeout: float = None,
+                      capture_stdout: bool = False, keep_lines: int = KEEP_LINES) -> tuple[int, str, str]:
+    """Run a program (no shell, arguments are passed as is) and optionally stream its output in real-time.
+    The program runs in its own process group: on timeout or cancellation the whole group (eg: ffmpeg started
+    by yt-dlp) is terminated.
+
+    :param argv: program and arguments, eg: ["ffprobe", "-i", path]
+    :param verbose: print output to console
+    :param on_line: optional callback, called with every stdout/stderr line as it arrives (eg: progress.ProgressTracker.ytdlp_line).
+        Carriage returns count as line ends, so progress bars redrawn in place arrive as separate lines
+    :param timeout: seconds before the program is killed
+    :param capture_stdout: return all of stdout (eg: JSON output). Otherwise only the last keep_lines lines are kept
+    :param keep_lines: lines kept of stderr (and stdout, unless capture_stdout)
+    :return: returncode (TIMEOUT_RETURNCODE on timeout), stdout, stderr (last keep_lines lines)
     """
-    process = await asyncio.create_subprocess_shell(
-        command,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
+    argv = [str(arg) for arg in argv]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True  #own process group, so children can be killed with it
+        )
+    except OSError as e:
+        return 127, "", f"Failed to start {argv[0]}: {e}"
 
-    stdout_lines = []
-    stderr_lines = []
+    stdout_data = bytearray()
+    stdout_lines = deque(maxlen=keep_lines)
+    stderr_lines = deque(maxlen=keep_lines)
 
-    async def read_stream(stream, line_list):
+    def _handle_line(line: bytes, line_list):
+        decoded_line = line.decode(errors="replace").strip()
+        if not decoded_line:
+            return
+        if verbose:
+            print(decoded_line)  # Only print if verbose is True
+        if on_line:
+            on_line(decoded_line)
+        line_list.append(decoded_line)
+
+    async def read_stream(stream, line_list, capture=None):
         buffer = bytearray()
         while True:
-            chunk = await stream.read(1024)  # read in 1024 byte chunks
+            chunk = await stream.read(READ_CHUNK_SIZE)
             if not chunk:
                 break
+            if capture is not None:
+                capture.extend(chunk)
+                if not verbose and not on_line:
+                    continue    #no need to split lines nobody looks at
             buffer.extend(chunk)
-            # Process complete lines from the buffer
-            while b'\n' in buffer:
-                line, sep, buffer = buffer.partition(b'\n')
-                decoded_line = line.decode().strip()
-                if verbose:
-                    print(decoded_line)  # Only print if verbose is True
-                line_list.append(decoded_line)
+            # Process complete lines from the buffer, the last part is an unfinished line
+            *lines, rest = LINE_END.split(buffer)
+            for line in lines:
+                _handle_line(line, line_list)
+            buffer = bytearray(rest)
         # Process any remaining data in the buffer
         if buffer:
-            decoded_line = buffer.decode().strip()
-            if decoded_line:
-                if verbose:
-                    print(decoded_line)
-                line_list.append(decoded_line)
-
-    # Read both stdout and stderr concurrently
-    await asyncio.gather(
-        read_stream(process.stdout, stdout_lines),
-        read_stream(process.stderr, stderr_lines)
-    )
-
-    returncode = await process.wait()  # Wait for process to finish
-    return returncode, "\n".join(stdout_lines), "\n".join(stderr_lines)
\ No newline at end of file
+            _handle_line(buffer, line_list)
+
+    async def communicate():
+        # Read both stdout and stderr concurrently
+        await asyncio.gather(
+            read_stream(process.stdout, stdout_lines, stdout_data if capture_stdout else None),
+            read_stream(process.stderr, stderr_lines)
+        )
+        return await process.wait()  # Wait for process to finish
+
+    runner = asyncio.ensure_future(communicate())
+    try:
+        returncode = await asyncio.wait_for(asyncio.shield(runner), timeout)
+    except asyncio.TimeoutError:
+        print(f"{argv[0]} timed out after {timeout}s, stopping it")
+        await _stop_process(process)
+        await runner
+        stderr_lines.append(f"Timed out after {timeout}s")
+        returncode = TIMEOUT_RETURNCODE
+    except asyncio.CancelledError:
+        await _stop_process(process)
+        runner.cancel()
+        raise
+
+    stdout = stdout_data.decode(errors="replace") if capture_stdout else "\n".join(stdout_lines)
+    return returncode, stdout, "\n".join(stderr_lines)
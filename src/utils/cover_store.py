@@ -0,0 +1,135 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import aiohttp
+from config.config_manager import config
+from utils.http_client import http_client
+from typing import Optional
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+COVER_STORE_MAX_MB = config["cache_settings"]["cover_store_max_mb"]
+MISSING_TTL_HOURS = config["cache_settings"]["musicbrainz_negative_ttl_hours"]
+COVER_URL_MAX_MB = config["cache_settings"]["cover_url_max_mb"]
+IMAGE_CONTENT_TYPES = ("image/", "application/octet-stream")    #octet-stream: servers that don't say, checked below
+IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"RIFF")  #JPEG, PNG, GIF, WebP
+
+def _looks_like_image(data: bytes) -> bool:
+    return data.startswith(IMAGE_SIGNATURES) and (not data.startswith(b"RIFF") or data[8:12] == b"WEBP")
+
+class CoverStore:
+    """
+    Content addressed store for cover art, shared by every track/album.
+    Images are saved once as covers/{sha256}.img. Keys point at an image:
+    * "caa:{entity}:{mbid}:{size}" for Cover Art Archive images
+    * "url:{sha1 of url}" for user supplied URLs/attachments
+    A key can also be marked missing (eg: CAA has no art for that MBID) for MISSING_TTL_HOURS.
+    Least recently used images are evicted once the store is over max_bytes.
+    """
+    def __init__(self, directory: str, max_bytes: int, missing_ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.missing_ttl_seconds = missing_ttl_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, hash TEXT, stored_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self._conn.commit()
+
+    def path_for_hash(self, image_hash: str) -> str:
+        return os.path.join(self.directory, f"{image_hash}.img")
+
+    def _touch(self, image_hash: str):
+        self._conn.execute("UPDATE images SET last_used=? WHERE hash=?", (time.time(), image_hash))
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """:return: stored image for key, None if not stored"""
+        row = self._conn.execute("SELECT hash FROM keys WHERE key=?", (key,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        try:
+            with open(self.path_for_hash(row[0]), "rb") as f:
+                data = f.read()
+        except OSError:
+            self._conn.execute("DELETE FROM keys WHERE hash=?", (row[0],))
+            self._conn.execute("DELETE FROM images WHERE hash=?", (row[0],))
+            self._conn.commit()
+            return None
+        self._touch(row[0])
+        return data
+
+    def is_known_missing(self, key: str) -> bool:
+        row = self._conn.execute("SELECT hash, stored_at FROM keys WHERE key=?", (key,)).fetchone()
+        return row is not None and row[0] is None and time.time() - row[1] < self.missing_ttl_seconds
+
+    def mark_missing(self, key: str):
+        self._conn.execute("INSERT OR REPLACE INTO keys VALUES (?, NULL, ?)", (key, time.time()))
+        self._conn.commit()
+
+    def put(self, data: bytes, key: str = None) -> str:
+        """Store an image (only written if these bytes aren't stored yet), optionally under key
+
+        :return: path of the stored image
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self.path_for_hash(image_hash)
+        if not os.path.exists(path):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        self._conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?)", (image_hash, len(data), time.time()))
+        if key is not None:
+            self._conn.execute("INSERT OR REPLACE INTO keys VALUES (?, ?, ?)", (key, image_hash, time.time()))
+        self._conn.commit()
+        self.evict(keep=image_hash)
+        return path
+
+    async def fetch_url(self, url: str) -> tuple[Optional[bytes], Optional[str]]:
+        """Get an image from a URL, downloading it only if it isn't stored yet.
+        Responses over COVER_URL_MAX_MB and ones that aren't images are rejected, not stored
+
+        :return: image data (None on error), error str
+        """
+        key = "url:" + hashlib.sha1(url.encode()).hexdigest()
+        data = self.get(key)
+        if data is not None:
+            return data, None
+        try:
+            status, content_type, data = await http_client.get_limited(url, COVER_URL_MAX_MB * 1024 * 1024,
+                                                                       accept=IMAGE_CONTENT_TYPES)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return None, str(e) or type(e).__name__
+        if status != 200:
+            return None, f"HTTP {status}"
+        if not content_type.startswith(IMAGE_CONTENT_TYPES):
+            return None, f"Not an image ({content_type})"
+        if data is None:
+            return None, f"Image is larger than {COVER_URL_MAX_MB}MB"
+        if not _looks_like_image(data):
+            return None, "Not an image (unknown format)"
+        self.put(data, key)
+        return data, None
+
+    def evict(self, keep: str = None):
+        """Remove least recently used images until the store fits in max_bytes"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for image_hash, size in self._conn.execute("SELECT hash, size FROM images ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            if image_hash == keep:
+                continue
+            try:
+                os.remove(self.path_for_hash(image_hash))
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM images WHERE hash=?", (image_hash,))
+            self._conn.execute("DELETE FROM keys WHERE hash=?", (image_hash,))
+            total -= size
+        self._conn.commit()
+
+cover_store = CoverStore(os.path.join(TEMP_DIRECTORY, "covers"), COVER_STORE_MAX_MB * 1024 * 1024, MISSING_TTL_HOURS * 3600)
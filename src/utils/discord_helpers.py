@@ -81,4 +81,57 @@ async def safe_send(interaction: discord.Interaction, content: str, **kwargs):
         content = content[:max_length-3] + "..."  # Truncate and add ellipsis
         print(f"Truncated message for {interaction.command.name} command")
     
-    await interaction.followup.send(content=content, **kwargs)
\ No newline at end of file
+    await interaction.followup.send(content=content, **kwargs)
+
+async def send_job_message(client: discord.Client, job: dict, interaction: Optional[discord.Interaction], content: str, **kwargs) -> Optional[discord.Message]:
+    """Send a message about a queued job, auto-truncated like safe_send().
+    Uses the interaction that queued the job if available, otherwise (job resumed after a restart,
+    or the 15 minute interaction token expired) the channel the job was queued from.
+
+    :return: the sent message, None if it couldn't be sent"""
+    max_length = 2000
+    if len(content) > max_length:
+        content = content[:max_length-3] + "..."  # Truncate and add ellipsis
+        print(f"Truncated message for job {job['id']}")
+
+    if interaction is not None:
+        try:
+            return await interaction.followup.send(content=content, wait=True, **kwargs)
+        except discord.HTTPException as e:
+            print(f"Interaction followup failed for job {job['id']}, falling back to channel: {e}")
+
+    if job.get("channel_id") is None:
+        print(f"No channel to report job {job['id']} to: {content}")
+        return None
+    kwargs.pop("ephemeral", None)   #only valid for interaction responses
+    if "file" in kwargs:
+        kwargs["file"].reset()  #file may have been partially read by the failed followup
+    try:
+        channel = client.get_channel(job["channel_id"]) or await client.fetch_channel(job["channel_id"])
+        return await channel.send(content=content, **kwargs)
+    except discord.HTTPException as e:
+        print(f"Failed to send message for job {job['id']}: {e}")
+        return None
+
+class JobStatusMessage:
+    """
+    One message showing the live status of a job, edited in place (see progress.ProgressTracker).
+    Sent on the first update; if editing it fails (eg: the interaction token expired after 15 minutes)
+    a new message is posted to the job's channel and edited from then on.
+    """
+    def __init__(self, client: discord.Client, job: dict, interaction: Optional[discord.Interaction]):
+        self.client = client
+        self.job = job
+        self.interaction = interaction
+        self.message = None
+
+    async def update(self, content: str):
+        content = content[:2000]
+        if self.message is not None:
+            try:
+                await self.message.edit(content=content)
+                return
+            except discord.HTTPException as e:
+                print(f"Editing status of job {self.job['id']} failed, posting a new one: {e}")
+                self.interaction = None
+        self.message = await send_job_message(self.client, self.job, self.interaction, content)
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from config.config_manager import config
+from utils.info_cache import cache_key_for_url
+from utils.library_index import library_index
+from typing import Optional
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+
+def source_ids(info: dict) -> list:
+    """Keys a video can be archived under: extractor + video ID (eg: youtube_{id}), and the key the library index
+    derives from the URL tag yt-dlp writes into the file (the same for YouTube, a URL hash for other sites)
+
+    :param info: yt-dlp info dict of a single video (eg: a playlist entry)
+    """
+    ids = []
+    if info.get("extractor_key") and info.get("id"):
+        ids.append(f"{info['extractor_key'].lower()}_{info['id']}")
+    url = info.get("webpage_url") or info.get("original_url")
+    if url:
+        key = cache_key_for_url(url)
+        if key not in ids:
+            ids.append(key)
+    return ids
+
+class DownloadArchive:
+    """
+    Which videos are already in the music library: source ID (see source_ids()) -> library file.
+    Downloads record what they wrote. Files the archive doesn't know about (downloaded before it existed, or moved)
+    are found through the library index, which reads the video URL yt-dlp tags every download with.
+    Paths are checked on lookup, so deleted files are never reused, and neither are files that were overwritten by
+    another video since (the path is recorded for the new video, and the index has the URL of the new video).
+
+    Downloads of one video also claim() it while in flight, so a second request for the same video waits for
+    the first one and then reuses its file instead of downloading it again.
+    """
+    def __init__(self, db_path: str, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS archive (
+                source_id TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                recorded_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS archive_path ON archive (path)")
+        self._conn.commit()
+        self._in_flight = {}    #source id -> asyncio.Event, set when that download finished
+
+    def _holds(self, path: str, ids: list) -> bool:
+        """:return: False if path is gone, or the index read the URL of a different video from it"""
+        if not os.path.isfile(path):
+            return False
+        indexed = self.index.get(path)
+        return not indexed or not indexed.get("source_id") or indexed["source_id"] in ids
+
+    def lookup(self, info: dict) -> Optional[str]:
+        """:return: full path of a library file downloaded from the video, None if there is none. Blocking"""
+        ids = source_ids(info)
+        for source_id in ids:
+            with self._lock:
+                row = self._conn.execute("SELECT path FROM archive WHERE source_id=?", (source_id,)).fetchone()
+            if row and self._holds(row[0], ids):
+                return row[0]
+        for source_id in ids:
+            for path in self.index.find_by_source(source_id):
+                if os.path.isfile(path):
+                    self.record(info, path)
+                    return path
+        return None
+
+    def lookup_entries(self, entries: list) -> dict:
+        """:return: {playlist position (1 based): path} of the playlist entries already in the library. Blocking"""
+        found = {}
+        for position, entry in enumerate(entries, 1):
+            path = self.lookup(entry) if entry else None
+            if path:
+                found[position] = path
+        return found
+
+    def record(self, info: dict, path: str):
+        """Remember that path holds the video described by info (and no longer any video recorded for it before)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM archive WHERE path=?", (path,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO archive (source_id, path, recorded_at) VALUES (?, ?, ?)",
+                [(source_id, path, now) for source_id in source_ids(info)]
+            )
+            self._conn.commit()
+
+    @asynccontextmanager
+    async def claim(self, info: dict):
+        """Hold while downloading a video. Waits for a download of the same video that is already in flight,
+        look it up again afterwards. No-op if info is None
+        """
+        ids = source_ids(info) if info else []
+        key = ids[0] if ids else None
+        while key in self._in_flight:
+            print(f"Waiting for the download of {key} that is already running")
+            await self._in_flight[key].wait()
+        if key is not None:
+            self._in_flight[key] = asyncio.Event()
+        try:
+            yield
+        finally:
+            if key is not None:
+                self._in_flight.pop(key).set()
+
+download_archive = DownloadArchive(os.path.join(TEMP_DIRECTORY, "download_archive.db"), library_index)
@@ -1,32 +1,24 @@
 import discord
 import asyncio
+import aiohttp
 import os
 import re
-import json
 import grp
 import sys
-import requests
 import shutil
+import stat
 import tempfile
 import subprocess
 from config.config_manager import config
+from utils.http_client import http_client
+from utils.library_index import library_index
+from utils.library_catalog import library_catalog
 from typing import Optional
 
 FILE_EXTENSION = config["download_settings"]["file_extension"]
 TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
 MUSIC_DIRECTORY = config["download_settings"]["music_directory"]
-
-def get_entries_from_json(filename) -> str:
-    """function to return all entries from a json file"""
-    if not os.path.exists(filename):
-        return "file doesn't exist"
-    
-    try:
-        with open(filename) as file:
-            data = json.load(file)
-        return data
-    except json.JSONDecodeError:
-        return "file exists but contains invalid JSON"
+RELEASE_DOWNLOAD_TIMEOUT = 600  #seconds, release assets are much larger than API responses
 
 def find_file_case_insensitive(directory, filename):
     """function to find files of the same name, with different casing, and return the file in use
@@ -37,21 +29,22 @@ def find_file_case_insensitive(directory, filename):
     fullPath = os.path.join(directory,filename)
     if os.path.exists(fullPath):
         return fullPath
+    #inside the library, use the index instead of listing the directory
+    if library_index.ready and library_index.ensure_fresh(directory):
+        indexed = library_index.lookup(fullPath)
+        if indexed and os.path.exists(indexed):
+            return indexed
+        return None
     #next check if same name, different casing exists
     for file in os.listdir(directory):
         if file.lower() == filename.lower():
             return os.path.join(directory, file)
     return None
 
-def apply_directory_permissions():
-    """
-    Applies consistent permissions to all files and directories in MUSIC_DIRECTORY
-    based on the configuration settings.
-
-    :return: False if failed, True if success
-    """
+def _permission_targets() -> Optional[tuple]:
+    """:return: (file mode, directory mode, gid) from the config, None if disabled or the group doesn't exist"""
     if not config["directory_settings"]["keep_perms_consistent"]:
-        return False
+        return None
     
     # Convert permissions to octal
     file_perms = int(str(config["directory_settings"]["music_file_perms"]), 8)
@@ -65,64 +58,96 @@ def apply_directory_permissions():
             gid = grp.getgrnam(target_group).gr_gid
         except KeyError:
             print(f"Group {target_group} not found")
+            return None
+    return file_perms, dir_perms, gid
+
+def _apply_permissions(path: str, file_perms: int, dir_perms: int, gid: int) -> bool:
+    """Set group and mode of one path, skipping the syscalls if they're already correct
+
+    :return: True if anything was changed
+    """
+    try:
+        st = os.lstat(path)
+        if stat.S_ISLNK(st.st_mode):
             return False
+        mode = dir_perms if stat.S_ISDIR(st.st_mode) else file_perms
+        changed = False
+        if st.st_gid != gid:
+            # Set group ownership first
+            os.chown(path, -1, gid)  # -1 preserves current UID
+            changed = True
+        if stat.S_IMODE(st.st_mode) != mode:
+            # Set permissions
+            os.chmod(path, mode)
+            changed = True
+        return changed
+    except FileNotFoundError:
+        return False
+    except PermissionError as e:
+        print(f"⚠️Permission denied on {path}: {e}")
+    except Exception as e:
+        print(f"⚠️Error processing {path}: {e}")
+    return False
+
+def apply_directory_permissions(paths: list = None, recursive: bool = True):
+    """
+    Applies consistent permissions to files and directories in MUSIC_DIRECTORY
+    based on the configuration settings. Paths that already have the right group and mode are skipped.
 
-    for root, dirs, files in os.walk(MUSIC_DIRECTORY):
-        for name in dirs + files:
-            path = os.path.join(root, name)
-            try:
-                # Set group ownership first
-                os.chown(path, -1, gid)  # -1 preserves current UID
-                
-                # Set permissions
-                mode = dir_perms if os.path.isdir(path) else file_perms
-                os.chmod(path, mode)
-                
-            except PermissionError as e:
-                print(f"⚠️Permission denied on {path}: {e}")
-            except Exception as e:
-                print(f"⚠️Error processing {path}: {e}")
-    print("✅Updated file permissions successfully\n")
+    :param paths: only these paths (eg: what a job created/modified). None: sweep the whole library
+    :param recursive: also apply to everything below directories in paths
+    :return: False if failed, True if success
+    """
+    targets = _permission_targets()
+    if targets is None:
+        return False
+
+    if paths is None:
+        paths = [MUSIC_DIRECTORY]
+        sweep = True
+    else:
+        sweep = False
+    changed = 0
+    for path in paths:
+        if path is None:
+            continue
+        if not sweep:   #the music directory itself is left alone
+            changed += _apply_permissions(path, *targets)
+        if recursive and os.path.isdir(path) and not os.path.islink(path):
+            for root, dirs, files in os.walk(path):
+                for name in dirs + files:
+                    changed += _apply_permissions(os.path.join(root, name), *targets)
+    if sweep or changed:
+        print(f"✅Updated file permissions successfully ({changed} changed)\n")
     return True
 
 def save_music_tree():
     """
-    Function to recursively build a tree of the given directory.
+    Function to write the tree of the music directory (see library_catalog).
     Excludes .txt files.
-    Saves as tree.txt in the temp directory (directory main is being ran from)
+    Saves as tree.txt in the temp directory (directory main is being ran from). Only rewritten if the library changed
 
     :return file: path/to/tree.txt
     
     """
-    def _build_and_format_tree(directory, indent=0):
-        lines = []
-        for entry in sorted(os.scandir(directory), key=lambda e: (not e.is_dir(), e.name.lower())):
-            if entry.is_dir():
-                lines.append('  ' * indent + f'{entry.name}/')
-                lines.extend(_build_and_format_tree(entry.path, indent + 1))
-            elif not entry.name.endswith('.txt'):
-                lines.append('  ' * indent + f'{entry.name}')
-        return lines
-
-    tree_lines = _build_and_format_tree(MUSIC_DIRECTORY)
-
-    file_path = os.path.join(TEMP_DIRECTORY,"tree.txt")
-
-    with open(file_path, 'w') as f:
-        f.write('\n'.join(tree_lines))
-
-    return file_path
+    return library_catalog.write_tree(os.path.join(TEMP_DIRECTORY,"tree.txt"))
 
 def update_files(update_self=config["directory_settings"]["auto_update"]):
-    """Function to run on start, and periodically"""
-
-    update_release("yt-dlp/yt-dlp","yt-dlp",config["download_settings"]["yt_dlp_path"])
+    """Function to run on start. Periodic updates are ran by the maintenance scheduler (maintenance.py)"""
+    async def _update():
+        try:
+            await update_release("yt-dlp/yt-dlp","yt-dlp",config["download_settings"]["yt_dlp_path"])
 
-    if update_self:
-        update_release("dcronauer1/musicdownloadbot","musicdownloadbot",restart_if_updated=True)
-    else:
-        #TODO prompt user to update IF there is an update (also send them the version changes)
-        pass
+            if update_self:
+                await update_release("dcronauer1/musicdownloadbot","musicdownloadbot",restart_if_updated=True)
+            else:
+                #TODO prompt user to update IF there is an update (also send them the version changes)
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"⚠️Update check failed, continuing with installed versions: {e}")
+        finally:
+            await http_client.close()   #session belongs to this temporary event loop
+    asyncio.run(_update())
     
     #check if ytdlp exists
     ytdlp_path = config["download_settings"]["yt_dlp_path"]
@@ -130,31 +155,36 @@ def update_files(update_self=config["directory_settings"]["auto_update"]):
         print(f"ERROR: yt-dlp does not exist: {ytdlp_path}")
         sys.exit(1)
 
-def update_release(repo: str, asset_name: str, output_path=None, restart_if_updated=False) -> bool:
-    """
-    Check if there is a new release for the given GitHub repo and asset,
-    and download it if it is newer than the last version.
-
-    Args:
-        repo: GitHub repository in the form 'owner/repo'
-        asset_name: Name of the asset file to download
-        output_path: Where the asset goes. MUST include /asset_name at the end. None for program_dir/asset_name
-
-    Returns:
-        True if the asset was updated, False otherwise
-    """
+def _release_paths(repo: str, asset_name: str, output_path=None) -> tuple[str, str]:
+    """:return: output_path, version_file for a release asset"""
     version_file = os.path.join(TEMP_DIRECTORY, f"{repo.replace('/', '_')}_version.txt")
 
     if output_path is None:
         # Determine output path depending on whether running from frozen executable
         program_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
         output_path = os.path.join(program_dir, asset_name)
+    return output_path, version_file
+
+def get_installed_version(repo: str) -> Optional[str]:
+    """:return: version recorded by the last update of repo, None if unknown"""
+    _, version_file = _release_paths(repo, "")
+    if not os.path.exists(version_file):
+        return None
+    with open(version_file, "r") as f:
+        return f.read().strip()
+
+async def fetch_release(repo: str, asset_name: str, output_path=None) -> tuple[Optional[str], str]:
+    """
+    Check if there is a new release for the given GitHub repo and asset, and download it next to output_path
+    if it is newer than the last version. Does not replace anything, see install_release()
+
+    :return: path of the downloaded temporary file (None if already up to date), latest version
+    """
+    output_path, version_file = _release_paths(repo, asset_name, output_path)
 
     # Get latest release info from GitHub API
     api_url = f"https://api.github.com/repos/{repo}/releases/latest"
-    response = requests.get(api_url)
-    response.raise_for_status()
-    release = response.json()
+    release = await http_client.get_json(api_url)
     latest_version = release["tag_name"]
 
     # Check if we already have this version
@@ -163,7 +193,7 @@ def update_release(repo: str, asset_name: str, output_path=None, restart_if_upda
             current_version = f.read().strip()
         if current_version == latest_version:
             print(f"{repo} is up to date ({latest_version})")
-            return False
+            return None, latest_version
 
     # Find the asset in the release
     asset = next((a for a in release["assets"] if a["name"] == asset_name), None)
@@ -173,18 +203,17 @@ def update_release(repo: str, asset_name: str, output_path=None, restart_if_upda
     # Download asset content
     download_url = asset["browser_download_url"]
     print(f"Downloading {asset_name} from {repo} version {latest_version}")
-    # stream the download to avoid partial-write execution problems and to conserve memory
-    r = requests.get(download_url, stream=True)
-    r.raise_for_status()
-
     # Save to a temporary file (so we don't overwrite the running binary)
     # Use same directory as output to keep move atomic on same FS when possible.
     tmp_dir = os.path.dirname(output_path) or "."
     with tempfile.NamedTemporaryFile(delete=False, dir=tmp_dir, prefix=asset_name + "_") as tmp_file:
-        # write in streaming chunks to avoid memory issues
-        for chunk in r.iter_content(chunk_size=8192):
-            if chunk:
-                tmp_file.write(chunk)
+        # stream the download to avoid partial-write execution problems and to conserve memory
+        try:
+            await http_client.download_to_file(download_url, tmp_file, timeout=RELEASE_DOWNLOAD_TIMEOUT)
+        except BaseException:
+            tmp_file.close()
+            os.remove(tmp_file.name)
+            raise
         # flush and sync to ensure the file is fully written to disk before we try to execute/move it
         tmp_file.flush()
         os.fsync(tmp_file.fileno())
@@ -197,23 +226,49 @@ def update_release(repo: str, asset_name: str, output_path=None, restart_if_upda
         # best-effort chmod; we'll attempt again after move if needed
         pass
 
-    # Update version file
+    print(f"{asset_name} downloaded to temporary path {tmp_path}")
+    return tmp_path, latest_version
+
+def install_release(repo: str, asset_name: str, tmp_path: str, version: str, output_path=None):
+    """Atomically replace output_path with a file downloaded by fetch_release(), then record the version"""
+    output_path, version_file = _release_paths(repo, asset_name, output_path)
+    # os.replace is atomic on the same FS; shutil.move handles cross-filesystem moves as well.
+    try:
+        os.replace(tmp_path, output_path)
+    except OSError:
+        shutil.move(tmp_path, output_path)
+    try:
+        os.chmod(output_path, 0o755)
+    except Exception:
+        pass
+
+    # Update version file only once the new file is in place
     with open(version_file, "w") as f:
-        f.write(latest_version)
+        f.write(version)
+    print(f"{asset_name} updated to {version} at {output_path}")
 
-    print(f"{asset_name} downloaded to temporary path {tmp_path}")
+async def update_release(repo: str, asset_name: str, output_path=None, restart_if_updated=False) -> bool:
+    """
+    Check if there is a new release for the given GitHub repo and asset,
+    and download it if it is newer than the last version.
+
+    Args:
+        repo: GitHub repository in the form 'owner/repo'
+        asset_name: Name of the asset file to download
+        output_path: Where the asset goes. MUST include /asset_name at the end. None for program_dir/asset_name
+
+    Returns:
+        True if the asset was updated, False otherwise
+    """
+    tmp_path, latest_version = await fetch_release(repo, asset_name, output_path)
+    if tmp_path is None:
+        return False
 
     if restart_if_updated:
         # Replace old binary with the downloaded one and then exit.
         # The service manager is expected to restart the program.
         try:
-            # Use shutil.move to handle cross-filesystem moves as well.
-            shutil.move(tmp_path, output_path)
-            try:
-                os.chmod(output_path, 0o755)
-            except Exception:
-                pass
-            print(f"{asset_name} updated to {latest_version} at {output_path}")
+            install_release(repo, asset_name, tmp_path, latest_version, output_path)
             print("Update applied; exiting so the service manager can restart the program.")
         except Exception as e:
             # If move fails, keep the tmp file (for debugging) and raise
@@ -222,11 +277,5 @@ def update_release(repo: str, asset_name: str, output_path=None, restart_if_upda
         # Exit as failure so service will restart it
         sys.exit(1)
 
-    # If not restarting immediately, replace in place
-    shutil.move(tmp_path, output_path)
-    try:
-        os.chmod(output_path, 0o755)
-    except Exception:
-        pass
-    print(f"{asset_name} updated to {latest_version} at {output_path}")
-    return True
\ No newline at end of file
+    install_release(repo, asset_name, tmp_path, latest_version, output_path)
+    return True
@@ -0,0 +1,135 @@
+import difflib
+import math
+import random
+import string
+import time
+from collections import Counter
+from typing import Optional
+
+GRAM_SIZE = 2
+
+def _gram_occurrences(word: str) -> list:
+    """:return: (bigram, n) for the nth occurrence of each bigram in word"""
+    seen = Counter()
+    occurrences = []
+    for i in range(len(word) - GRAM_SIZE + 1):
+        gram = word[i:i + GRAM_SIZE]
+        seen[gram] += 1
+        occurrences.append((gram, seen[gram]))
+    return occurrences
+
+class FuzzyIndex:
+    """
+    Case insensitive fuzzy lookup over a list of names (artists, tags), kept in memory and updated with add().
+    close_match() returns exactly what difflib.get_close_matches(word, lowercase names, n=1, cutoff) would,
+    but only scores names that can reach the cutoff:
+    * length: ratio >= cutoff needs the shorter string to be at least cutoff/(2-cutoff) of the longer one
+    * n-grams: SequenceMatcher's matching blocks are common substrings separated by at least one unmatched character,
+      so a pair with ratio >= c shares at least (1.5c - 1) * (len(a) + len(b)) - 1 bigrams.
+      Shared bigrams are counted from posting lists split by name length, names below the bound are skipped
+    """
+    def __init__(self, names=()):
+        self._names = {}    #lowercase -> stored name. Later duplicates replace earlier ones, like a dict comprehension
+        self._postings = {} #(bigram, nth occurrence) -> {length: set of lowercase}
+        self._by_length = {}    #length -> set of lowercase
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, word: str):
+        return word.lower() in self._names
+
+    def get(self, word: str) -> Optional[str]:
+        """:return: stored name with the same lowercase, None if not stored"""
+        return self._names.get(word.lower())
+
+    def add(self, name: str):
+        key = name.lower()
+        if key not in self._names:
+            for gram in _gram_occurrences(key):
+                self._postings.setdefault(gram, {}).setdefault(len(key), set()).add(key)
+            self._by_length.setdefault(len(key), set()).add(key)
+        self._names[key] = name
+
+    def _candidates(self, word: str, cutoff: float):
+        length = len(word)
+        factor = 1.5 * cutoff - 1
+        if factor <= 0 or length >= 200:
+            #no usable bound (or SequenceMatcher's autojunk changes the scoring), check everything
+            return self._names.keys()
+        #small margins so float rounding never drops a name that is exactly on the cutoff
+        min_len = cutoff / (2 - cutoff) * length - 1e-9
+        max_len = length / cutoff * (2 - cutoff) + 1e-9
+        lengths = range(max(0, math.ceil(min_len)), math.floor(max_len) + 1)
+        needed = {key_length: factor * (key_length + length) - 1 - 1e-9 for key_length in lengths}
+
+        #counting (bigram, nth occurrence) hits gives the multiset intersection of bigrams
+        shared = Counter()
+        for gram in _gram_occurrences(word):
+            by_length = self._postings.get(gram)
+            if by_length:
+                for key_length in lengths:
+                    shared.update(by_length.get(key_length, ()))
+        candidates = [key for key, common in shared.items() if common >= needed[len(key)]]
+        #names sharing no bigram can still reach the cutoff if both are very short
+        for key_length in lengths:
+            if needed[key_length] <= 0:
+                candidates.extend(key for key in self._by_length.get(key_length, ()) if key not in shared)
+        return candidates
+
+    def close_match(self, word: str, cutoff: float = 0.8) -> Optional[str]:
+        """Best fuzzy match for word (compared lowercase)
+
+        :return: stored name, None if nothing reaches cutoff
+        """
+        word = word.lower()
+        s = difflib.SequenceMatcher()
+        s.set_seq2(word)
+        best = None
+        for key in self._candidates(word, cutoff):
+            s.set_seq1(key)
+            if s.real_quick_ratio() >= cutoff and s.quick_ratio() >= cutoff:
+                ratio = s.ratio()
+                if ratio >= cutoff and (best is None or (ratio, key) > best):
+                    best = (ratio, key)
+        return self._names[best[1]] if best else None
+
+def benchmark(size: int = 100_000, queries: int = 200, seed: int = 0):
+    """Compare FuzzyIndex with difflib.get_close_matches on random names: results must match, prints timings"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_lowercase + "  "
+    def _name():
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(3, 20))).strip() or "x"
+    def _typo(name):
+        i = rng.randrange(len(name))
+        return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+
+    names = [_name() for _ in range(size)]
+    words = [_typo(rng.choice(names)) if i % 2 else _name() for i in range(queries)]
+    start = time.perf_counter()
+    index = FuzzyIndex(names)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [index.close_match(word) for word in words]
+    index_time = time.perf_counter() - start
+
+    lower_known = {name.lower(): name for name in names}
+    start = time.perf_counter()
+    expected = []
+    for word in words:
+        matches = difflib.get_close_matches(word.lower(), lower_known.keys(), n=1, cutoff=0.8)
+        expected.append(lower_known[matches[0]] if matches else None)
+    difflib_time = time.perf_counter() - start
+
+    mismatches = sum(a != b for a, b in zip(indexed, expected))
+    print(f"{size} names, {queries} lookups: index build {build_time:.2f}s")
+    print(f"FuzzyIndex: {index_time / queries * 1000:.2f}ms/lookup, difflib: {difflib_time / queries * 1000:.2f}ms/lookup "
+          f"({difflib_time / index_time:.0f}x)")
+    print(f"mismatches: {mismatches}")
+    return mismatches
+
+if __name__ == "__main__":
+    benchmark()
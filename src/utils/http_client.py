@@ -0,0 +1,92 @@
+import asyncio
+import time
+import aiohttp
+from config.config_manager import config
+from typing import Optional
+
+LIMIT_PER_HOST = config["http_settings"]["limit_per_host"]
+REQUEST_TIMEOUT = config["http_settings"]["request_timeout"]
+USER_AGENT = f"{config['musicbrainz']['app_name']}/1.0 ( {config['musicbrainz']['contact_email']} )"
+
+def deadline_in(seconds: float) -> float:
+    """Timeout budget shared by several requests, pass the result as deadline="""
+    return time.monotonic() + seconds
+
+class HttpClient:
+    """
+    Shared async HTTP client. All outbound HTTP goes through here so it never blocks the event loop.
+    * one keep-alive connection pool (aiohttp session), created lazily per event loop
+    * at most LIMIT_PER_HOST concurrent connections to a host
+    * every request has a timeout; several requests can share one budget with deadline=deadline_in(seconds)
+    """
+    def __init__(self, limit_per_host: int = LIMIT_PER_HOST, request_timeout: float = REQUEST_TIMEOUT):
+        self.limit_per_host = limit_per_host
+        self.request_timeout = request_timeout
+        self._session = None
+        self._session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+            self._session_loop = loop
+        return self._session
+
+    def _timeout(self, timeout: Optional[float], deadline: Optional[float]) -> aiohttp.ClientTimeout:
+        total = self.request_timeout if timeout is None else timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError("HTTP timeout budget exhausted")
+            total = min(total, remaining)
+        return aiohttp.ClientTimeout(total=total)
+
+    async def get_bytes(self, url: str, timeout: float = None, deadline: float = None) -> tuple[int, bytes]:
+        """:return: HTTP status, body"""
+        async with self._get_session().get(url, timeout=self._timeout(timeout, deadline)) as response:
+            return response.status, await response.read()
+
+    async def get_limited(self, url: str, max_bytes: int, accept: tuple = None, timeout: float = None,
+                          deadline: float = None) -> tuple[int, str, Optional[bytes]]:
+        """get_bytes() for untrusted URLs: stops reading once the body is larger than max_bytes (Content-Length is
+        checked first), and doesn't read bodies of other content types than accept
+
+        :param accept: content type prefixes, eg: ("image/",). None for any
+        :return: HTTP status, content type, body (None if it was too large or not accepted)
+        """
+        async with self._get_session().get(url, timeout=self._timeout(timeout, deadline)) as response:
+            content_type = response.content_type
+            if accept is not None and not content_type.startswith(accept):
+                return response.status, content_type, None
+            if response.content_length is not None and response.content_length > max_bytes:
+                return response.status, content_type, None
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(65536):
+                body += chunk
+                if len(body) > max_bytes:
+                    return response.status, content_type, None
+            return response.status, content_type, bytes(body)
+
+    async def get_json(self, url: str, timeout: float = None, deadline: float = None):
+        """:raises aiohttp.ClientResponseError: on non 2xx status"""
+        async with self._get_session().get(url, timeout=self._timeout(timeout, deadline)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def download_to_file(self, url: str, file_obj, timeout: float = None, chunk_size: int = 65536):
+        """Stream the body of url into an open binary file object
+
+        :raises aiohttp.ClientResponseError: on non 2xx status
+        """
+        async with self._get_session().get(url, timeout=self._timeout(timeout, None)) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                file_obj.write(chunk)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+http_client = HttpClient()
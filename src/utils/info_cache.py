@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import time
+from config.config_manager import config
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+INFO_TTL_MINUTES = config["cache_settings"]["info_ttl_minutes"]
+INFO_MAX_ENTRIES = config["cache_settings"]["info_max_entries"]
+
+_YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be")
+_YOUTUBE_ID = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def cache_key_for_url(url: str) -> str:
+    """Key used for the cache file of a link.
+    YouTube links are keyed by video/playlist ID so different link forms (youtu.be, share params, music.)
+    share one entry. Anything else is keyed by a hash of the URL.
+    Note: like yt-dlp, a watch link with a list= parameter is treated as the playlist.
+    """
+    try:
+        parsed = urlparse(url.strip())
+    except ValueError:
+        parsed = None
+    if parsed and parsed.hostname in _YOUTUBE_HOSTS:
+        query = parse_qs(parsed.query)
+        if "list" in query:
+            return f"youtubetab_{query['list'][0]}"
+        if parsed.hostname == "youtu.be":
+            video_id = parsed.path.strip("/")
+        elif "v" in query:
+            video_id = query["v"][0]
+        else:
+            #/shorts/ID, /live/ID, /embed/ID
+            video_id = parsed.path.rstrip("/").rsplit("/", 1)[-1]
+        if _YOUTUBE_ID.match(video_id):
+            return f"youtube_{video_id}"
+    return "url_" + hashlib.sha1(url.strip().encode()).hexdigest()
+
+class InfoCache:
+    """
+    On disk cache of full yt-dlp info JSON, one file per video/playlist.
+    Entries expire after ttl_seconds (stream URLs inside the info expire too), and the oldest entries are
+    evicted beyond max_entries.
+    Files are valid for yt-dlp --load-info-json, so the download stage doesn't extract the page again.
+    """
+    def __init__(self, directory: str, ttl_seconds: float, max_entries: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_for(self, url: str) -> str:
+        return os.path.join(self.directory, f"{cache_key_for_url(url)}.info.json")
+
+    def _is_fresh(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl_seconds
+        except OSError:
+            return False
+
+    def path(self, url: str) -> Optional[str]:
+        """:return: path to a fresh info json for url, or None"""
+        path = self._file_for(url)
+        if self._is_fresh(path):
+            return path
+        return None
+
+    def get(self, url: str) -> Optional[dict]:
+        """:return: cached info dict for url, or None if missing/expired"""
+        path = self.path(url)
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️Discarding unreadable info cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def put(self, url: str, info: dict) -> str:
+        """Store info for url (written to a temp file then renamed). :return: cache file path"""
+        path = self._file_for(url)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove expired entries, then the oldest ones beyond max_entries"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".info.json"):
+                continue
+            mtime = entry.stat().st_mtime
+            if time.time() - mtime >= self.ttl_seconds:
+                self._remove(entry.path)
+            else:
+                entries.append((mtime, entry.path))
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            self._remove(path)
+
+info_cache = InfoCache(os.path.join(TEMP_DIRECTORY, "info_cache"), INFO_TTL_MINUTES * 60, INFO_MAX_ENTRIES)
+info_cache.evict()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from config.config_manager import config
+from typing import Optional
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+MAX_WORKERS = config["queue_settings"]["max_workers"]
+KEEP_FINISHED_HOURS = config["queue_settings"]["keep_finished_hours"]
+
+JOB_TYPES = ["download", "thumbnail", "timestamps"]
+
+class JobQueue:
+    """
+    SQLite backed job queue stored in the temp directory.
+    Jobs survive restarts: anything left "running" when the bot stopped is put back to "queued" on load.
+
+    Job states: queued -> running -> done|failed
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                args TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                channel_id INTEGER,
+                user_id INTEGER,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        self._conn.commit()
+        self._wakeup = asyncio.Event()
+
+        #restart recovery and cleanup of old finished jobs
+        requeued = self._conn.execute("UPDATE jobs SET status='queued', started_at=NULL WHERE status='running'").rowcount
+        self._conn.execute("DELETE FROM jobs WHERE status IN ('done','failed') AND finished_at < ?",
+                           (time.time() - KEEP_FINISHED_HOURS * 3600,))
+        self._conn.commit()
+        if requeued:
+            print(f"Requeued {requeued} job(s) interrupted by restart")
+
+    def _row_to_job(self, row) -> dict:
+        job = dict(row)
+        job["args"] = json.loads(job["args"])
+        return job
+
+    def enqueue(self, job_type: str, args: dict, channel_id: int = None, user_id: int = None) -> int:
+        """Add a job to the queue.
+
+        :param job_type: one of JOB_TYPES
+        :param args: json serializable arguments passed to the job handler
+        :return: job id
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Invalid job type: {job_type}")
+        cur = self._conn.execute(
+            "INSERT INTO jobs (type, args, channel_id, user_id, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job_type, json.dumps(args), channel_id, user_id, time.time())
+        )
+        self._conn.commit()
+        self._wakeup.set()
+        return cur.lastrowid
+
+    def find_active(self, job_type: str, dedupe_key: str) -> Optional[int]:
+        """:return: id of a queued or running job of job_type submitted with dedupe_key, None if there is none"""
+        rows = self._conn.execute("SELECT id, args FROM jobs WHERE type=? AND status IN ('queued','running') ORDER BY id",
+                                  (job_type,)).fetchall()
+        for row in rows:
+            if json.loads(row["args"]).get("dedupe_key") == dedupe_key:
+                return row["id"]
+        return None
+
+    def position(self, job_id: int) -> int:
+        """:return: 1 based position in the queue, 0 if running or finished"""
+        row = self._conn.execute("SELECT status FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if row is None or row["status"] != "queued":
+            return 0
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued' AND id<=?", (job_id,)).fetchone()[0]
+
+    def claim(self) -> Optional[dict]:
+        """Mark the oldest queued job as running and return it. None if queue is empty"""
+        row = self._conn.execute("SELECT * FROM jobs WHERE status='queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE jobs SET status='running', started_at=? WHERE id=?", (time.time(), row["id"]))
+        self._conn.commit()
+        return self._row_to_job(row)
+
+    def finish(self, job_id: int, error: str = None):
+        """Mark a job as done (error=None) or failed"""
+        status = "done" if error is None else "failed"
+        self._conn.execute("UPDATE jobs SET status=?, error=?, finished_at=? WHERE id=?",
+                           (status, error, time.time(), job_id))
+        self._conn.commit()
+
+    def counts(self) -> dict:
+        """:return: {status: count}"""
+        return {row["status"]: row[1] for row in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")}
+
+    async def wait_for_job(self):
+        """Block until something is enqueued"""
+        await self._wakeup.wait()
+        self._wakeup.clear()
+
+class WorkerPool:
+    """
+    Fixed size pool of asyncio workers that drain a JobQueue.
+
+    Handlers are registered per job type: async def handler(job: dict, interaction) -> Optional[str]
+    and return an error string on failure. interaction is the live discord.Interaction that enqueued
+    the job, or None if the job was resumed after a restart (interactions can't be persisted).
+    """
+    def __init__(self, queue: JobQueue, max_workers: int = MAX_WORKERS):
+        self.queue = queue
+        self.max_workers = max(1, int(max_workers))
+        self.handlers = {}
+        self.interactions = {}  #job id -> interaction
+        self._tasks = []
+
+    def register(self, job_type: str, handler):
+        self.handlers[job_type] = handler
+
+    def submit(self, job_type: str, args: dict, interaction=None) -> tuple[int, int]:
+        """Enqueue a job, remembering the interaction so the handler can reply to it.
+
+        :return: job id, queue position
+        """
+        channel_id = interaction.channel_id if interaction else None
+        user_id = interaction.user.id if interaction else None
+        job_id = self.queue.enqueue(job_type, args, channel_id, user_id)
+        if interaction:
+            self.interactions[job_id] = interaction
+        return job_id, self.queue.position(job_id)
+
+    def start(self):
+        """Start workers. Must be called from inside the running event loop"""
+        if self._tasks:
+            return
+        for i in range(self.max_workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        print(f"Started {self.max_workers} job worker(s)")
+
+    async def _worker(self, worker_num: int):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                await self.queue.wait_for_job()
+                continue
+
+            interaction = self.interactions.pop(job["id"], None)
+            handler = self.handlers.get(job["type"])
+            print(f"Worker {worker_num} starting job {job['id']} ({job['type']})")
+            if handler is None:
+                error = f"No handler registered for job type {job['type']}"
+            else:
+                try:
+                    error = await handler(job, interaction)
+                except Exception as e:
+                    error = f"Job {job['id']} crashed: {str(e)}"
+            if error:
+                print(f"❗Job {job['id']} failed: {error}")
+            self.queue.finish(job["id"], error)
+
+job_queue = JobQueue(os.path.join(TEMP_DIRECTORY, "jobs.db"))
+worker_pool = WorkerPool(job_queue)
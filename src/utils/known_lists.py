@@ -0,0 +1,108 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+from typing import Optional
+from utils.fuzzy_index import FuzzyIndex
+
+SAVE_DELAY = 2  #seconds, additions within this window are written together
+
+class KnownListStore:
+    """
+    Known artists/tags, loaded from their JSON file once and kept in memory with a fuzzy index.
+    * additions go through add(), serialized by one lock, so concurrent commands can't lose each other's entries
+    * the file is only written when something was added, debounced by SAVE_DELAY,
+      written to a temp file and renamed over the old one (readers never see a partial file)
+    * anything not written yet is flushed on exit
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._names = None
+        self._index = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  #one writer for the file at a time
+        self._dirty = False
+        self._save_handle = None
+        atexit.register(self.flush)
+
+    def _load(self):
+        if self._names is None:
+            names = []
+            if os.path.exists(self.filename):
+                with open(self.filename, "r") as f:
+                    names = json.load(f)
+            self._names = names
+            self._index = FuzzyIndex(names)
+
+    def entries(self) -> list:
+        with self._lock:
+            self._load()
+            return list(self._names)
+
+    def get(self, name: str) -> Optional[str]:
+        """:return: stored entry with the same name (case insensitive), None if not known"""
+        with self._lock:
+            self._load()
+            return self._index.get(name)
+
+    def close_match(self, name: str, cutoff: float = 0.8) -> Optional[str]:
+        """:return: closest known entry (see FuzzyIndex.close_match()), None if nothing is close enough"""
+        with self._lock:
+            self._load()
+            return self._index.close_match(name, cutoff)
+
+    def add(self, *names: str) -> list:
+        """Add entries (ones already known, case insensitive, are skipped) and schedule a save
+
+        :return: the stored version of each name
+        """
+        stored = []
+        with self._lock:
+            self._load()
+            for name in names:
+                existing = self._index.get(name)
+                if existing is None:
+                    self._names.append(name)
+                    self._index.add(name)
+                    self._dirty = True
+                    existing = name
+                stored.append(existing)
+            dirty = self._dirty
+        if dirty:
+            self._schedule_save()
+        return stored
+
+    def _schedule_save(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()    #not in the event loop, nothing to batch with
+            return
+        if self._save_handle is None:
+            self._save_handle = loop.call_later(SAVE_DELAY, lambda: asyncio.create_task(self._save()))
+
+    async def _save(self):
+        self._save_handle = None
+        await asyncio.to_thread(self.flush)
+
+    def flush(self):
+        """Write the list now if anything was added since the last write. Blocking"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                names = list(self._names)
+                self._dirty = False
+            tmp_path = f"{self.filename}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(names, f, indent=4)
+                os.replace(tmp_path, self.filename)
+            except OSError as e:
+                print(f"⚠️Failed to save {self.filename}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+known_artists = KnownListStore("artists.json")
+known_tags = KnownListStore("tags.json")
@@ -0,0 +1,95 @@
+import os
+import threading
+from utils.library_index import library_index
+
+PAGE_SIZE = 25
+MAX_LINE_LENGTH = 70    #keeps a full page under discord's 2000 character limit
+
+class LibraryCatalog:
+    """
+    Listing of the music library (directories first, then files, .txt chapter files excluded), rendered from the
+    library index instead of scanning MUSIC_DIRECTORY. The rendered listing is cached and only rebuilt once the
+    index changed (library_index.version), so repeated /list music commands are cheap.
+    """
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = []  #(relative path, is_dir, tree line) in tree order
+        self._written = None    #(file path, version) of the last write_tree()
+
+    def _build(self) -> list:
+        children = {}   #parent -> [(name, is_dir)]
+        for path, is_dir in self.index.entries():
+            if not is_dir and path.endswith(".txt"):
+                continue
+            parent, name = os.path.split(path)
+            children.setdefault(parent, []).append((name, bool(is_dir)))
+        entries = []
+        def _walk(parent, depth):
+            for name, is_dir in sorted(children.get(parent, []), key=lambda e: (not e[1], e[0].lower())):
+                path = os.path.join(parent, name) if parent else name
+                entries.append((path, is_dir, '  ' * depth + (f'{name}/' if is_dir else name)))
+                if is_dir:
+                    _walk(path, depth + 1)
+        _walk("", 0)
+        return entries
+
+    def entries(self) -> list:
+        """:return: cached (relative path, is_dir, tree line) list, rebuilt if the library changed. Blocking"""
+        with self._lock:
+            version = self.index.version
+            if version != self._version:
+                self._entries = self._build()
+                self._version = version
+            return self._entries
+
+    def search(self, query: str = None, prefix: str = None) -> list:
+        """Filter the catalog. Case insensitive
+
+        :param query: text anywhere in the path
+        :param prefix: start of the path, eg: a playlist folder
+        :return: list of display lines. Tree lines if unfiltered, else paths relative to the music directory
+        """
+        entries = self.entries()
+        if not query and not prefix:
+            return [line for _, _, line in entries]
+        query = (query or "").lower()
+        prefix = (prefix or "").lower()
+        return [path + ("/" if is_dir else "") for path, is_dir, _ in entries
+                if path.lower().startswith(prefix) and query in path.lower()]
+
+    def page(self, query: str = None, prefix: str = None, page: int = 1, page_size: int = PAGE_SIZE) -> tuple:
+        """:return: lines of the page, page number (clamped to the valid range), page count, total matches"""
+        matches = self.search(query, prefix)
+        pages = max(1, -(-len(matches) // page_size))
+        page = min(max(1, page), pages)
+        start = (page - 1) * page_size
+        lines = [line if len(line) <= MAX_LINE_LENGTH else line[:MAX_LINE_LENGTH - 1] + "…"
+                 for line in matches[start:start + page_size]]
+        return lines, page, pages, len(matches)
+
+    def format_page(self, query: str = None, prefix: str = None, page: int = 1) -> str:
+        """Page of the catalog as a discord message"""
+        lines, page, pages, total = self.page(query, prefix, page)
+        if not lines:
+            return "❗No music found" + (" (library is still being indexed)" if not self.index.ready else "")
+        body = "\n".join(lines)
+        header = f"Page {page}/{pages} ({total} entries)"
+        if not self.index.ready:
+            header += ", library is still being indexed"
+        return f"{header}\n```\n{body}\n```"
+
+    def write_tree(self, file_path: str) -> str:
+        """Write the full listing to file_path, only if the library changed since it was last written
+
+        :return: file_path
+        """
+        entries = self.entries()
+        if self._written != (file_path, self._version) or not os.path.exists(file_path):
+            with open(file_path, 'w') as f:
+                f.write('\n'.join(line for _, _, line in entries))
+            self._written = (file_path, self._version)
+        return file_path
+
+library_catalog = LibraryCatalog(library_index)
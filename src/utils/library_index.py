@@ -0,0 +1,313 @@
+import os
+import sqlite3
+import threading
+from config.config_manager import config
+from mutagen import File
+from utils.info_cache import cache_key_for_url
+from typing import Optional
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+MUSIC_DIRECTORY = config["download_settings"]["music_directory"]
+
+COVER_KEYS = ("metadata_block_picture", "covr")
+TAG_KEYS = {    #field -> keys for (Vorbis comment, MP4, ID3)
+    "title": ("title", "\xa9nam", "TIT2"),
+    "artist": ("artist", "\xa9ART", "TPE1"),
+    "album": ("album", "\xa9alb", "TALB"),
+    "genre": ("genre", "\xa9gen", "TCON"),
+}
+SOURCE_KEYS = ("purl", "comment", "\xa9cmt", "COMM::eng", "COMM::XXX")   #yt-dlp --add-metadata writes the video URL here
+
+def _first_tag(tags, keys) -> Optional[str]:
+    for key in keys:
+        try:
+            value = tags.get(key)
+        except (KeyError, ValueError):
+            continue
+        if value:
+            value = value.text if hasattr(value, "text") else value
+            return str(value[0]) if isinstance(value, list) else str(value)
+    return None
+
+def read_library_entry(path: str) -> dict:
+    """Read the indexed fields of an audio file with mutagen. Blocking. Unreadable files only get their format
+
+    :return: {format, duration_ms, title, artist, album, genre, has_cover, chapters, source_id}
+    """
+    entry = {"format": os.path.splitext(path)[1].lower().lstrip(".") or None, "duration_ms": None, "title": None,
+             "artist": None, "album": None, "genre": None, "has_cover": 0, "chapters": 0, "source_id": None}
+    try:
+        f = File(path)
+    except Exception:
+        return entry
+    if f is None:
+        return entry
+    if getattr(f.info, "length", None):
+        entry["duration_ms"] = int(f.info.length * 1000)
+    tags = f.tags
+    if tags is None:
+        return entry
+    for field, keys in TAG_KEYS.items():
+        entry[field] = _first_tag(tags, keys)
+    keys = [key.lower() for key in tags.keys()]
+    entry["has_cover"] = int(bool(getattr(f, "pictures", None)) or any(key in COVER_KEYS or key.startswith("apic") for key in keys))
+    entry["chapters"] = sum(1 for key in keys if key.startswith("chapter") and key[7:].isdigit())
+    source_url = _first_tag(tags, SOURCE_KEYS)
+    if source_url and "://" in source_url:
+        entry["source_id"] = cache_key_for_url(source_url)
+    return entry
+
+class LibraryIndex:
+    """
+    Persistent (SQLite) index of MUSIC_DIRECTORY: one row per file/directory with its lowercase relative path as key,
+    so case insensitive lookups are a single indexed query instead of a directory listing.
+    Audio files also store format, duration, tags, cover presence, chapter count and source ID (eg: youtube_{id}).
+    refresh() updates the index incrementally: it still lists and stats every entry, but only files whose mtime/size
+    changed are read again. Lookups (ensure_fresh()) relist a single directory, and only when its mtime changed.
+    Paths are relative to the music directory ("" is the root).
+    Until the first full refresh() finished, `ready` is False and callers should fall back to listing directories.
+    `version` goes up whenever an entry is added, changed or removed, so views built from the index know when to rebuild.
+    """
+    def __init__(self, db_path: str, root: str):
+        self.root = root
+        self.ready = False
+        self.version = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                path TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                parent TEXT,
+                is_dir INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                format TEXT,
+                duration_ms INTEGER,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                genre TEXT,
+                has_cover INTEGER NOT NULL DEFAULT 0,
+                chapters INTEGER NOT NULL DEFAULT 0,
+                source_id TEXT
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_source ON entries (source_id)")
+        self._conn.commit()
+
+    def relpath(self, path: str) -> Optional[str]:
+        """:return: path relative to the library root, None if outside of it"""
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        if rel == ".":
+            return ""
+        if rel == ".." or rel.startswith(".." + os.sep):
+            return None
+        return rel
+
+    def abspath(self, rel: str) -> str:
+        return os.path.join(self.root, rel) if rel else self.root
+
+    def lookup(self, path: str) -> Optional[str]:
+        """Case insensitive lookup of a path in the library
+
+        :return: full path with the casing on disk, None if not indexed
+        """
+        rel = self.relpath(path)
+        if rel is None:
+            return None
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM entries WHERE key=?", (rel.lower(),)).fetchall()
+        for (found,) in rows:
+            if found == rel:    #prefer exact casing
+                return self.abspath(found)
+        return self.abspath(rows[0][0]) if rows else None
+
+    def get(self, path: str) -> Optional[dict]:
+        """:return: indexed row of a path as a dict, None if not indexed"""
+        rel = self.relpath(path)
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM entries WHERE path=?", (rel,))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def ensure_fresh(self, directory: str) -> bool:
+        """Refresh the direct entries of a directory if its mtime changed (a file was added, removed or renamed)
+
+        :return: False if the directory doesn't exist or is outside of the library
+        """
+        rel = self.relpath(directory)
+        if rel is None:
+            return False
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT mtime FROM entries WHERE path=?", (rel,)).fetchone()
+        if row is None or row[0] != mtime:
+            self.refresh(directory, recursive=False)
+        return True
+
+    def children(self, directory: str) -> list:
+        """Names of the entries in a directory, sorted. The directory is refreshed first if its mtime changed"""
+        if not self.ensure_fresh(directory):
+            return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        rel = self.relpath(directory)
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM entries WHERE parent=?", (rel,)).fetchall()
+        return sorted((os.path.basename(path) for (path,) in rows), key=str.lower)
+
+    def entries(self) -> list:
+        """:return: (relative path, is_dir) of every indexed entry, except the root"""
+        with self._lock:
+            return self._conn.execute("SELECT path, is_dir FROM entries WHERE path != ''").fetchall()
+
+    def find_by_source(self, source_id: str) -> list:
+        """:return: full paths of indexed files downloaded from source_id (see cache_key_for_url())"""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM entries WHERE source_id=?", (source_id,)).fetchall()
+        return [self.abspath(path) for (path,) in rows]
+
+    def _upsert(self, rel: str, is_dir: bool, st: os.stat_result, entry: dict = None, listed: bool = True):
+        """:param listed: False for a directory whose entries weren't indexed, stored with mtime 0 so ensure_fresh()
+            lists it the first time it is used
+        """
+        entry = entry or {}
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel, rel.lower(), os.path.dirname(rel) if rel else None, int(is_dir), st.st_mtime if listed else 0, st.st_size,
+             entry.get("format"), entry.get("duration_ms"), entry.get("title"), entry.get("artist"),
+             entry.get("album"), entry.get("genre"), entry.get("has_cover", 0), entry.get("chapters", 0),
+             entry.get("source_id"))
+        )
+
+    def _remove(self, rel: str):
+        self._conn.execute("DELETE FROM entries WHERE path=?", (rel,))
+        prefix = rel + os.sep
+        self._conn.execute("DELETE FROM entries WHERE substr(path, 1, ?)=?", (len(prefix), prefix))
+
+    def refresh_paths(self, paths) -> list:
+        """Update several files/directories at once (eg: a batch of filesystem events).
+        Paths inside another path of the batch are skipped, since directories are refreshed recursively
+
+        :return: full paths of the entries that changed
+        """
+        rels = sorted({rel for rel in (self.relpath(path) for path in paths) if rel is not None})
+        changed = []
+        covered = None
+        for rel in rels:
+            if covered is not None and (covered == "" or rel.startswith(covered + os.sep)):
+                continue
+            changed.extend(self.refresh_path(self.abspath(rel)))
+            if os.path.isdir(self.abspath(rel)):
+                covered = rel
+        return changed
+
+    def refresh_path(self, path: str) -> list:
+        """Update (or remove, if it no longer exists) one file or directory. Directories are refreshed recursively
+
+        :return: full paths of the entries that changed
+        """
+        rel = self.relpath(path)
+        if not rel:     #outside of the library, or the root itself
+            return self.refresh() if rel == "" else []
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self._lock:
+                found = self._conn.execute("SELECT 1 FROM entries WHERE path=?", (rel,)).fetchone()
+                if found:
+                    self._remove(rel)
+                    self._conn.commit()
+                    self.version += 1
+            return [path] if found else []
+        if os.path.isdir(path):
+            return self.refresh(path)
+        with self._lock:
+            known = self._conn.execute("SELECT mtime, size FROM entries WHERE path=?", (rel,)).fetchone()
+        if known == (st.st_mtime, st.st_size):
+            return []
+        entry = read_library_entry(path)
+        with self._lock:
+            self._upsert(rel, False, st, entry)
+            self._conn.commit()
+            self.version += 1
+        return [path]
+
+    def refresh(self, directory: str = None, recursive: bool = True) -> list:
+        """Incrementally sync a directory (default: whole library) with the index.
+        Every directory is listed and every entry stat'ed (retagging a file in place doesn't change its directory's
+        mtime, so directories can't be skipped); only new files and files whose mtime/size changed are read,
+        missing ones are removed. Blocking
+
+        :param recursive: False only syncs the direct entries (see ensure_fresh()), subdirectories aren't listed
+        :return: full paths of the entries that changed
+        """
+        directory = directory or self.root
+        base = self.relpath(directory)
+        if base is None:
+            return []
+        if not recursive:
+            query, params = "SELECT path, mtime, size FROM entries WHERE parent=?", (base,)
+        elif base:
+            prefix = base + os.sep
+            query, params = "SELECT path, mtime, size FROM entries WHERE substr(path, 1, ?)=?", (len(prefix), prefix)
+        else:
+            query, params = "SELECT path, mtime, size FROM entries", ()
+        with self._lock:
+            known = {path: (mtime, size) for path, mtime, size in self._conn.execute(query, params)}
+        seen = set()
+        changed = []    #(rel, is_dir, stat)
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                scan = list(os.scandir(current))
+            except OSError:
+                continue
+            for entry in scan:
+                try:
+                    is_dir = entry.is_dir()
+                    st = entry.stat()
+                except OSError:
+                    continue
+                rel = self.relpath(entry.path)
+                seen.add(rel)
+                if is_dir and not recursive:
+                    #not listed here: a known subdirectory keeps the mtime it was last listed at, a new one gets
+                    #mtime 0, so ensure_fresh() lists it instead of trusting its current mtime
+                    if rel not in known:
+                        changed.append((rel, is_dir, st))
+                    continue
+                if known.get(rel) != (st.st_mtime, st.st_size):
+                    changed.append((rel, is_dir, st))
+                if is_dir and recursive:
+                    stack.append(entry.path)
+
+        updates = [(rel, is_dir, st, None if is_dir else read_library_entry(self.abspath(rel)))
+                   for rel, is_dir, st in changed]
+        with self._lock:
+            for rel, is_dir, st, entry in updates:
+                self._upsert(rel, is_dir, st, entry, listed=recursive or not is_dir)
+            removed = known.keys() - seen - {base}
+            for rel in removed:
+                self._remove(rel)
+            base_is_new = self._conn.execute("SELECT 1 FROM entries WHERE path=?", (base,)).fetchone() is None
+            try:
+                self._upsert(base, True, os.stat(directory))
+            except OSError:
+                self._remove(base)
+            self._conn.commit()
+            if changed or removed or base_is_new:
+                self.version += 1
+        if base == "" and recursive:
+            self.ready = True
+        if changed or removed:
+            print(f"Library index: {len(changed)} entries updated, {len(removed)} removed under {directory}")
+        return [self.abspath(rel) for rel, _, _ in changed] + [self.abspath(rel) for rel in removed]
+
+library_index = LibraryIndex(os.path.join(TEMP_DIRECTORY, "library.db"), MUSIC_DIRECTORY)
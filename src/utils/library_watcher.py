@@ -0,0 +1,241 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+from config.config_manager import config
+from utils.library_index import library_index
+
+WATCHER_MODE = config["library_settings"]["watcher"]
+DEBOUNCE_SECONDS = config["library_settings"]["debounce_seconds"]
+POLL_INTERVAL_MINUTES = config["library_settings"]["poll_interval_minutes"]
+MAX_BATCH_DELAY = 30    #seconds, flush a batch even if events keep coming
+
+# inotify constants (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")    #wd, mask, cookie, len
+
+class Inotify:
+    """Minimal inotify binding (ctypes, no extra dependency). Watches directories recursively
+
+    :raises OSError: on init if inotify isn't available
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches = {}   #wd -> directory
+
+    def add_watch(self, directory: str):
+        """:raises OSError: eg: ENOSPC when fs.inotify.max_user_watches is reached"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch {directory}: {os.strerror(errno)}")
+        self.watches[wd] = directory
+
+    def add_tree(self, directory: str):
+        """Watch a directory and every directory below it. Blocking"""
+        self.add_watch(directory)
+        for root, dirs, _ in os.walk(directory):
+            for name in dirs:
+                self.add_watch(os.path.join(root, name))
+
+    def read_events(self) -> list:
+        """:return: list of (mask, full path) for pending events, [] if none"""
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((mask, None))
+                continue
+            directory = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            events.append((mask, os.path.join(directory, name) if name else directory))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class LibraryWatcher:
+    """
+    Keeps the library index (and anything registered with add_listener()) in sync with changes made to
+    MUSIC_DIRECTORY outside the bot (eg: FolderSync, manual edits), without rescanning the whole library.
+    * inotify: events are collected and applied as one debounced batch once the directory was quiet for
+      DEBOUNCE_SECONDS (at most MAX_BATCH_DELAY after the first event). Only the touched paths are refreshed
+    * polling fallback (inotify unavailable or out of watches): incremental index refresh every POLL_INTERVAL_MINUTES
+    Listeners are called with the list of changed paths after each batch was applied to the index.
+    The initial refresh on start is not reported (it lists every file the index didn't know yet, eg: the whole library
+    on first run), listeners that need a full pass on startup run their own.
+    """
+    def __init__(self, mode: str = WATCHER_MODE):
+        self.mode = mode
+        self._inotify = None
+        self._listeners = []
+        self._pending = set()
+        self._full_refresh = False
+        self._first_event = None
+        self._flush_handle = None
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._tasks = set()     #background tasks, referenced until done (the loop only keeps weak references)
+
+    def add_listener(self, func):
+        """:param func: called with a list of changed full paths. Keep it cheap, or return a coroutine: it is run
+            in the background by the watcher
+        """
+        self._listeners.append(func)
+
+    def start(self):
+        """Start watching. Must be called from inside the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._task_done)
+
+    def _spawn(self, coro):
+        """Run a coroutine in the background, failures are logged"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️Library watcher task failed: {task.exception()!r}")
+
+    async def _run(self):
+        if self.mode in ("auto", "inotify"):
+            try:
+                self._inotify = Inotify()
+                #watch before the initial refresh, so nothing changed in between is missed
+                await asyncio.to_thread(self._inotify.add_tree, library_index.root)
+                asyncio.get_running_loop().add_reader(self._inotify.fd, self._on_readable)
+                print(f"Watching {library_index.root} with inotify ({len(self._inotify.watches)} directories)")
+            except OSError as e:
+                print(f"⚠️inotify unavailable ({e}), polling {library_index.root} every {POLL_INTERVAL_MINUTES} minutes")
+                if self._inotify is not None:
+                    self._inotify.close()
+                    self._inotify = None
+        await asyncio.to_thread(library_index.refresh)  #not notified, see class docstring
+        if self._inotify is None and self.mode != "off":
+            await self._poll()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL_MINUTES * 60)
+            await self._apply(None)
+
+    def _on_readable(self):
+        for mask, path in self._inotify.read_events():
+            if path is None:    #queue overflowed, events were lost
+                self._full_refresh = True
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._spawn(self._watch_tree(path))
+            self._pending.add(path)
+        self._schedule_flush()
+
+    async def _watch_tree(self, path: str):
+        """Watch a directory that appeared (eg: an album moved in). Walked in a thread, trees can be large"""
+        inotify = self._inotify
+        try:
+            await asyncio.to_thread(inotify.add_tree, path)
+        except OSError as e:
+            if inotify is not self._inotify:
+                return  #already switched to polling
+            if e.errno == errno.ENOSPC:
+                self._fall_back_to_polling(e)
+            else:
+                print(f"⚠️Can't watch {path}: {e}")
+            return
+        #files created before the watches were in place have no events, refresh the tree again once watched
+        self._pending.add(path)
+        self._schedule_flush()
+
+    def _fall_back_to_polling(self, error: OSError):
+        """Out of inotify watches: parts of the library would go unwatched, so poll the whole library instead"""
+        print(f"⚠️inotify out of watches ({error}), polling {library_index.root} every {POLL_INTERVAL_MINUTES} minutes")
+        asyncio.get_running_loop().remove_reader(self._inotify.fd)
+        self._inotify.close()
+        self._inotify = None
+        self._full_refresh = True
+        self._schedule_flush()
+        self._spawn(self._poll())
+
+    def _schedule_flush(self):
+        if not self._pending and not self._full_refresh:
+            return
+        now = time.monotonic()
+        if self._first_event is None:
+            self._first_event = now
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        delay = min(DEBOUNCE_SECONDS, max(0, self._first_event + MAX_BATCH_DELAY - now))
+        self._flush_handle = asyncio.get_running_loop().call_later(delay, self._flush)
+
+    def _flush(self):
+        paths = None if self._full_refresh else self._pending
+        self._pending = set()
+        self._full_refresh = False
+        self._first_event = None
+        self._flush_handle = None
+        self._spawn(self._apply(paths))
+
+    async def _apply(self, paths):
+        """Apply a batch to the index. paths None means incremental refresh of the whole library"""
+        async with self._flush_lock:
+            try:
+                if paths is None:
+                    changed = await asyncio.to_thread(library_index.refresh)
+                else:
+                    changed = await asyncio.to_thread(library_index.refresh_paths, paths)
+            except Exception as e:
+                print(f"⚠️Library index update failed: {e}")
+                return
+        self._notify(changed)
+
+    def _notify(self, changed: list):
+        if not changed:
+            return
+        for func in self._listeners:
+            try:
+                result = func(changed)
+            except Exception as e:
+                print(f"⚠️Library listener failed: {e}")
+                continue
+            if asyncio.iscoroutine(result):
+                self._spawn(result)
+
+library_watcher = LibraryWatcher()
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+from config.config_manager import config
+from utils.file_handling import fetch_release, install_release, get_installed_version, apply_directory_permissions
+from utils.job_queue import job_queue
+
+YT_DLP_PATH = config["download_settings"]["yt_dlp_path"]
+AUTO_UPDATE = config["directory_settings"]["auto_update"]
+UPDATE_INTERVAL_HOURS = config["maintenance_settings"]["update_interval_hours"]
+SWAP_WAIT_MINUTES = config["maintenance_settings"]["swap_wait_minutes"]
+PERMISSIONS_SWEEP_HOURS = config["maintenance_settings"]["permissions_sweep_hours"]
+
+class ToolLock:
+    """
+    Shared/exclusive lock around an external tool.
+    Any number of jobs can use() the tool at once. exclusive() stops new users, waits for the current ones
+    to finish, then holds the tool alone (eg: while the binary is swapped).
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._users = 0
+        self._exclusive = False
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def use(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._exclusive)
+            self._users += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._users -= 1
+                self._cond.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self, timeout: float = None):
+        """:raises asyncio.TimeoutError: if current users didn't finish within timeout"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._exclusive)
+            self._exclusive = True
+            try:
+                await asyncio.wait_for(self._cond.wait_for(lambda: self._users == 0), timeout)
+            except BaseException:
+                self._exclusive = False
+                self._cond.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+ytdlp_lock = ToolLock("yt-dlp")
+
+class MaintenanceScheduler:
+    """Runs registered maintenance tasks periodically in the background. Failures are logged, not raised"""
+    def __init__(self):
+        self.tasks = {}  #name -> (interval seconds, async func)
+        self._running = []
+
+    def add_task(self, name: str, interval_seconds: float, func):
+        self.tasks[name] = (interval_seconds, func)
+
+    def start(self):
+        """Start all task loops. Must be called from inside the running event loop"""
+        if self._running:
+            return
+        for name in self.tasks:
+            self._running.append(asyncio.create_task(self._loop(name)))
+
+    async def run_now(self, name: str):
+        """Run a task once, logging errors"""
+        _, func = self.tasks[name]
+        try:
+            await func()
+        except Exception as e:
+            print(f"⚠️Maintenance task '{name}' failed: {e}")
+
+    async def _loop(self, name: str):
+        interval, _ = self.tasks[name]
+        while True:
+            await asyncio.sleep(interval)
+            await self.run_now(name)
+
+async def update_ytdlp():
+    """Download a new yt-dlp release (if any) in the background, then swap it in while no job is using it"""
+    repo = "yt-dlp/yt-dlp"
+    tmp_path, version = await fetch_release(repo, "yt-dlp", YT_DLP_PATH)
+    if tmp_path is None:
+        return
+    try:
+        async with ytdlp_lock.exclusive(timeout=SWAP_WAIT_MINUTES * 60):
+            install_release(repo, "yt-dlp", tmp_path, version, YT_DLP_PATH)
+    except asyncio.TimeoutError:
+        print(f"yt-dlp still in use after {SWAP_WAIT_MINUTES} minutes, update to {version} postponed")
+        os.remove(tmp_path)
+
+async def update_self():
+    """Update this program. Only applied while no jobs are running, since the service has to restart"""
+    if job_queue.counts().get("running", 0):
+        print("Jobs running, postponing self update")
+        return
+    repo = "dcronauer1/musicdownloadbot"
+    tmp_path, version = await fetch_release(repo, "musicdownloadbot")
+    if tmp_path is None:
+        return
+    if job_queue.counts().get("running", 0):    #a job may have started during the download
+        print("Jobs running, postponing self update")
+        os.remove(tmp_path)
+        return
+    install_release(repo, "musicdownloadbot", tmp_path, version)
+    print("Update applied; exiting so the service manager can restart the program.")
+    # Exit as failure so service will restart it. Queued jobs are kept in the job queue and resume after the restart
+    sys.exit(1)
+
+async def sweep_permissions():
+    """Full permissions pass over the library, catches anything the per job updates missed"""
+    await asyncio.to_thread(apply_directory_permissions)
+
+scheduler = MaintenanceScheduler()
+scheduler.add_task("yt-dlp update", UPDATE_INTERVAL_HOURS * 3600, update_ytdlp)
+scheduler.add_task("permissions sweep", PERMISSIONS_SWEEP_HOURS * 3600, sweep_permissions)
+if AUTO_UPDATE:
+    scheduler.add_task("self update", UPDATE_INTERVAL_HOURS * 3600, update_self)
+print(f"yt-dlp version: {get_installed_version('yt-dlp/yt-dlp') or 'unknown'}")
@@ -0,0 +1,72 @@
+import json
+import os
+import sqlite3
+import time
+from config.config_manager import config
+from typing import Optional
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+MB_TTL_DAYS = config["cache_settings"]["musicbrainz_ttl_days"]
+MB_NEGATIVE_TTL_HOURS = config["cache_settings"]["musicbrainz_negative_ttl_hours"]
+
+class MusicBrainzCache:
+    """
+    On disk (SQLite) cache of MusicBrainz search results, keyed by (search kind, artist, title, release_type, strict).
+    Stores the list of matching MBIDs in result order. Searches that found nothing are cached too ("negative" entries),
+    with their own, shorter TTL since MusicBrainz data gets added over time.
+    """
+    def __init__(self, db_path: str, ttl_seconds: float, negative_ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS searches (
+                kind TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                release_type TEXT NOT NULL,
+                strict INTEGER NOT NULL,
+                mbids TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (kind, artist, title, release_type, strict)
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(kind: str, artist: str, title: str, release_type: str, strict: bool) -> tuple:
+        #MusicBrainz search is case sensitive, so keys are kept as is
+        return (kind, artist or "", title or "", release_type or "", int(bool(strict)))
+
+    def get(self, kind: str, artist: str, title: str, release_type: str, strict: bool) -> Optional[list]:
+        """:return: cached MBIDs ([] for a cached "no result"), None if not cached or expired"""
+        row = self._conn.execute(
+            "SELECT mbids, stored_at FROM searches WHERE kind=? AND artist=? AND title=? AND release_type=? AND strict=?",
+            self._key(kind, artist, title, release_type, strict)
+        ).fetchone()
+        if row is None:
+            return None
+        mbids = json.loads(row[0])
+        ttl = self.ttl_seconds if mbids else self.negative_ttl_seconds
+        if time.time() - row[1] >= ttl:
+            return None
+        return mbids
+
+    def put(self, kind: str, artist: str, title: str, release_type: str, strict: bool, mbids: list):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._key(kind, artist, title, release_type, strict) + (json.dumps(mbids), time.time())
+        )
+        self._conn.commit()
+
+    def prune(self):
+        """Delete expired entries"""
+        now = time.time()
+        self._conn.execute(
+            "DELETE FROM searches WHERE (mbids != '[]' AND stored_at < ?) OR (mbids = '[]' AND stored_at < ?)",
+            (now - self.ttl_seconds, now - self.negative_ttl_seconds)
+        )
+        self._conn.commit()
+
+mb_cache = MusicBrainzCache(os.path.join(TEMP_DIRECTORY, "musicbrainz_cache.db"), MB_TTL_DAYS * 86400, MB_NEGATIVE_TTL_HOURS * 3600)
+mb_cache.prune()
@@ -0,0 +1,91 @@
+import asyncio
+import itertools
+import time
+import musicbrainzngs
+from config.config_manager import config
+
+REQUESTS_PER_SECOND = config["musicbrainz"]["requests_per_second"]
+BURST = config["musicbrainz"]["burst"]
+
+PRIORITY_INTERACTIVE = 0    #single song lookups a user is waiting on
+PRIORITY_BULK = 1           #playlist/library backfills
+
+class MusicBrainzScheduler:
+    """
+    Process wide scheduler for MusicBrainz requests. Every search goes through here instead of calling
+    musicbrainzngs directly (its own rate limiter sleeps inside the calling thread).
+    * token bucket: at most `rate` requests/second on average, `burst` back to back
+    * coalescing: identical searches already queued/in flight share one request
+    * priorities: queued interactive searches go before bulk ones
+    Requests are sent one at a time from a worker thread, so the event loop never blocks.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last_refill = time.monotonic()
+        self._queue = asyncio.PriorityQueue()   #(priority, seq, key)
+        self._seq = itertools.count()
+        self._pending = {}  #key -> [future, search_func, kwargs, queued priority]
+        self._dispatcher = None
+
+    @staticmethod
+    def _key(search_func, kwargs: dict) -> tuple:
+        return (search_func.__name__, tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+
+    async def search(self, search_func, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> dict:
+        """Run a musicbrainzngs search function, eg: await mb_scheduler.search(musicbrainzngs.search_releases, artist=..)
+
+        :raises: whatever the search raises (musicbrainzngs.WebServiceError, etc)
+        """
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        key = self._key(search_func, kwargs)
+        pending = self._pending.get(key)
+        if pending is None:
+            future = asyncio.get_running_loop().create_future()
+            #mark exceptions as retrieved, in case every waiter was cancelled
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._pending[key] = [future, search_func, kwargs, priority]
+            self._queue.put_nowait((priority, next(self._seq), key))
+        else:
+            future = pending[0]
+            if priority < pending[3]:
+                #already queued at a lower priority: queue again at this one, whichever comes out first runs it
+                pending[3] = priority
+                self._queue.put_nowait((priority, next(self._seq), key))
+        return await asyncio.shield(future)
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _dispatch(self):
+        while True:
+            _, _, key = await self._queue.get()
+            pending = self._pending.get(key)
+            if pending is None:
+                continue    #duplicate queue entry of a search that already ran
+            await self._take_token()
+            future, search_func, kwargs, _ = pending
+            try:
+                result = await asyncio.to_thread(search_func, **kwargs)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                del self._pending[key]
+
+# musicbrainzngs's own limiter is replaced by the scheduler
+musicbrainzngs.set_rate_limit(False)
+mb_scheduler = MusicBrainzScheduler(REQUESTS_PER_SECOND, BURST)
@@ -4,21 +4,33 @@ import os
 from config.config_manager import config
 import re
 from typing import Optional
-from utils.core import run_command
+from utils.process_scheduler import process_scheduler, REMUX, PROBE
 import sys
 import asyncio
 import musicbrainzngs
-import requests
 from mutagen import File
 from mutagen.oggopus import OggOpus
-from mutagen.flac import Picture
+from mutagen.flac import Picture, FLAC
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TCON, TRCK, ID3NoHeaderError
 import base64
+import shlex
 from utils.file_handling import find_file_case_insensitive
+from utils.library_index import library_index
+from utils.http_client import http_client, deadline_in
+from utils.mb_cache import mb_cache
+from utils.mb_scheduler import mb_scheduler, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from utils.cover_store import cover_store
+from utils.workspace import scratch_workspace, move_into_place
 
 FILE_EXTENSION = config["download_settings"]["file_extension"]
 DEFAULT_COVER_SIZE = config["download_settings"]["default_cover_size"]
 MUSIC_DIRECTORY = config["download_settings"]["music_directory"]
 TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+CAA_TIMEOUT_BUDGET = 30  #seconds for all Cover Art Archive attempts of one release
+TRACK_WORKERS = config["queue_settings"]["track_workers"]
+PROBE_TIMEOUT = 60  #seconds for an ffprobe call
+REMUX_TIMEOUT = 600 #seconds for an ffmpeg stream copy
 
 try:
     musicbrainzngs.set_useragent(
@@ -26,7 +38,6 @@ try:
         version="1.0",
         contact=config["musicbrainz"]["contact_email"]
     )
-    musicbrainzngs.set_rate_limit(limit_or_interval=1.0, new_requests=1)
 except KeyError as e:
     print(f"❌ MusicBrainz configuration missing: {str(e)}")
     print("Add these to your config.json under 'bot_settings':")
@@ -34,19 +45,27 @@ except KeyError as e:
     sys.exit(1)
 
 async def fetch_musicbrainz_data(artist: str, title: str, release_type: str = None, 
-                                 size: str = DEFAULT_COVER_SIZE, strict: bool = True) -> tuple:
-    """Fetch cover art with improved reliability and direct Cover Art Archive access"""
+                                 size: str = DEFAULT_COVER_SIZE, strict: bool = True, priority: int = PRIORITY_INTERACTIVE) -> tuple:
+    """Fetch cover art with improved reliability and direct Cover Art Archive access.
+    Search results (including empty ones) are cached in mb_cache, so repeated lookups skip the rate limited searches
+
+    :param priority: mb_scheduler priority, PRIORITY_BULK for playlists/backfills"""
     try:
         # Try release groups first with direct CAA access
-        rg_result = musicbrainzngs.search_release_groups(
-            artist=artist,
-            releasegroup=title,
-            limit=5,
-            strict=strict
-        )
+        rg_ids = mb_cache.get("release-group", artist, title, None, strict)
+        if rg_ids is None:
+            rg_result = await mb_scheduler.search(
+                musicbrainzngs.search_release_groups,
+                priority,
+                artist=artist,
+                releasegroup=title,
+                limit=5,
+                strict=strict
+            )
+            rg_ids = [rg['id'] for rg in rg_result.get('release-group-list', [])]
+            mb_cache.put("release-group", artist, title, None, strict, rg_ids)
         
-        for rg in rg_result.get('release-group-list', []):
-            rg_id = rg['id']
+        for rg_id in rg_ids:
             try:
                 # Direct Cover Art Archive access
                 cover_data = await fetch_from_coverartarchive(rg_id, size, "release-group")
@@ -55,14 +74,17 @@ async def fetch_musicbrainz_data(artist: str, title: str, release_type: str = No
                 print(f"RG Direct CAA failed {rg_id}: {str(e)}")
 
         # Then try individual releases with direct CAA access
-        search_params = {"artist": artist, "release": title, "limit": 10, "strict": strict}
-        if release_type:
-            search_params["type"] = release_type
-            
-        result = musicbrainzngs.search_releases(**search_params)
+        release_ids = mb_cache.get("release", artist, title, release_type, strict)
+        if release_ids is None:
+            search_params = {"artist": artist, "release": title, "limit": 10, "strict": strict}
+            if release_type:
+                search_params["type"] = release_type
+                
+            result = await mb_scheduler.search(musicbrainzngs.search_releases, priority, **search_params)
+            release_ids = [release['id'] for release in result.get('release-list', [])]
+            mb_cache.put("release", artist, title, release_type, strict, release_ids)
         
-        for release in result.get('release-list', []):
-            mbid = release['id']
+        for mbid in release_ids:
             try:
                 # Direct Cover Art Archive access
                 cover_data = await fetch_from_coverartarchive(mbid, size, "release")
@@ -85,134 +107,240 @@ async def fetch_from_coverartarchive(mbid: str, size: str, entity_type: str) ->
         "large": "1200"
     }
     size_str = size_map.get(size, "1200")  # Default to large
-    
+
+    # Covers are shared between tracks/albums, so check the cover store first
+    store_key = f"caa:{entity_type}:{mbid}:{size_str}"
+    content = cover_store.get(store_key)
+    if content is not None:
+        return content
+    if cover_store.is_known_missing(store_key):
+        raise Exception("Cover Art Archive has no artwork (cached)")
+    content = await _fetch_from_coverartarchive(mbid, size_str, entity_type)
+    if content is None:
+        cover_store.mark_missing(store_key)
+        raise Exception("Cover Art Archive has no artwork")
+    cover_store.put(content, store_key)
+    return content
+
+async def _fetch_from_coverartarchive(mbid: str, size_str: str, entity_type: str) -> Optional[bytes]:
+    """Cover Art Archive requests for fetch_from_coverartarchive(). :return: None if there is no artwork"""
+    deadline = deadline_in(CAA_TIMEOUT_BUDGET)    #all attempts share one timeout budget
+
     # First try with specific size
     url = f"https://coverartarchive.org/{entity_type}/{mbid}/front-{size_str}.jpg"
-    response = requests.get(url, timeout=10)
+    status, content = await http_client.get_bytes(url, deadline=deadline)
     
-    if response.status_code == 200:
-        return response.content
+    if status == 200:
+        return content
     
     # Then try without size parameter
     print("Trying without size parameter")
     url = f"https://coverartarchive.org/{entity_type}/{mbid}/front.jpg"
-    response = requests.get(url, timeout=10)
+    status, content = await http_client.get_bytes(url, deadline=deadline)
     
-    if response.status_code == 200:
-        return response.content
+    if status == 200:
+        return content
     
     # Try with different size if original failed
     if size_str != "1200":
         print("Trying size 1200 parameter")
         url = f"https://coverartarchive.org/{entity_type}/{mbid}/front-1200.jpg"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.content
+        status, content = await http_client.get_bytes(url, deadline=deadline)
+        if status == 200:
+            return content
     
-    raise Exception(f"Cover Art Archive error: HTTP {response.status_code}")
+    if status == 404:
+        return None
+    raise Exception(f"Cover Art Archive error: HTTP {status}")
+
+def _image_mime(image_data: bytes) -> str:
+    return "image/png" if image_data.startswith(b'\x89PNG') else "image/jpeg"
+
+def _front_cover_picture(image_data: bytes) -> Picture:
+    """FLAC-style picture metadata, used by FLAC and Ogg (METADATA_BLOCK_PICTURE)"""
+    pic = Picture()
+    pic.data = image_data
+    pic.type = 3    # Cover (front)
+    pic.mime = _image_mime(image_data)
+    pic.desc = "Cover art"
+    return pic
+
+# extension -> tag format mutagen can edit in place. Other formats fall back to an ffmpeg remux
+NATIVE_TAG_FORMATS = {
+    ".opus": "vorbis",
+    ".ogg": "vorbis",
+    ".flac": "vorbis",
+    ".m4a": "mp4",
+    ".mp4": "mp4",
+    ".mp3": "id3",
+}
+# formats whose chapters can be written in place (CHAPTERxxx Vorbis comments, which ffmpeg reads/writes too).
+# mutagen can't write MP4 chpl atoms, so other formats get their chapters from an ffmpeg remux
+NATIVE_CHAPTER_FORMATS = {"vorbis"}
+MP4_TAG_KEYS = {"title": "\xa9nam", "artist": "\xa9ART", "album": "\xa9alb", "genre": "\xa9gen"}
+ID3_TAG_FRAMES = {"title": TIT2, "artist": TPE1, "album": TALB, "genre": TCON, "tracknumber": TRCK}
+CHAPTER_COMMENT_PATTERN = re.compile(r"^chapter\d+(name|url)?$", re.IGNORECASE)
+
+def native_tag_format(audio_file: str) -> Optional[str]:
+    """:return: "vorbis", "mp4", "id3", or None if the file has to be remuxed with ffmpeg"""
+    return NATIVE_TAG_FORMATS.get(os.path.splitext(audio_file)[1].lower())
+
+def _format_chapter_time(ms: int) -> str:
+    """Milliseconds as HH:MM:SS.mmm (Vorbis comment chapter format)"""
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02}:{minutes:02}:{seconds:02}.{ms:03}"
+
+def _parse_chapter_time(value: str) -> Optional[int]:
+    """HH:MM:SS.mmm to milliseconds, None if invalid"""
+    match = re.match(r"^(\d+):(\d+):(\d+)(?:\.(\d+))?$", value.strip())
+    if not match:
+        return None
+    millis = int((match[4] or "0").ljust(3, "0")[:3])
+    return ((int(match[1]) * 60 + int(match[2])) * 60 + int(match[3])) * 1000 + millis
+
+def write_metadata_native(audio_file: str, tags: dict = None, image_data: bytes = None, chapters: list = None):
+    """Write tags, front cover and chapters to a file in place with mutagen, in a single save.
+    Blocking, run with asyncio.to_thread()
+
+    :param tags: {"title"|"artist"|"album"|"genre"|"tracknumber": value}
+    :param image_data: front cover, None to leave as is
+    :param chapters: list of (start in milliseconds, title). [] removes all chapters, None leaves them as is
+    :raises ValueError: if the format isn't in NATIVE_TAG_FORMATS, or chapters are given for a format
+        not in NATIVE_CHAPTER_FORMATS
+    """
+    tag_format = native_tag_format(audio_file)
+    if tag_format is None:
+        raise ValueError(f"No native tag writer for {audio_file}")
+    if chapters is not None and tag_format not in NATIVE_CHAPTER_FORMATS:
+        raise ValueError(f"Chapters can't be written in place for {audio_file}")
+    tags = tags or {}
+
+    if tag_format == "vorbis":
+        audio = File(audio_file)
+        for key, value in tags.items():
+            audio[key] = value
+        if image_data is not None:
+            if isinstance(audio, FLAC):
+                audio.clear_pictures()
+                audio.add_picture(_front_cover_picture(image_data))
+            else:
+                audio["METADATA_BLOCK_PICTURE"] = [base64.b64encode(_front_cover_picture(image_data).write()).decode()]
+        if chapters is not None:
+            for key in list(audio.keys()):
+                if CHAPTER_COMMENT_PATTERN.match(key):
+                    del audio[key]
+            for i, (start_time, title) in enumerate(chapters, 1):
+                audio[f"CHAPTER{i:03}"] = _format_chapter_time(start_time)
+                audio[f"CHAPTER{i:03}NAME"] = title
+        audio.save()
+
+    elif tag_format == "mp4":
+        audio = MP4(audio_file)
+        for key, value in tags.items():
+            if key == "tracknumber":
+                audio["trkn"] = [(int(value), 0)]
+            else:
+                audio[MP4_TAG_KEYS[key]] = [value]
+        if image_data is not None:
+            image_format = MP4Cover.FORMAT_PNG if _image_mime(image_data) == "image/png" else MP4Cover.FORMAT_JPEG
+            audio["covr"] = [MP4Cover(image_data, imageformat=image_format)]
+        audio.save()
+
+    elif tag_format == "id3":
+        try:
+            id3 = ID3(audio_file)
+        except ID3NoHeaderError:
+            id3 = ID3()
+        for key, value in tags.items():
+            id3.setall(ID3_TAG_FRAMES[key].__name__, [ID3_TAG_FRAMES[key](encoding=3, text=[value])])
+        if image_data is not None:
+            id3.delall("APIC")
+            id3.add(APIC(encoding=3, mime=_image_mime(image_data), type=3, desc="Cover art", data=image_data))
+        id3.save(audio_file)
+
+def read_chapters_native(audio_file: str) -> Optional[list]:
+    """Read CHAPTERxxx Vorbis comment chapters. Blocking
+
+    :return: list of (start in milliseconds, title), None if the format isn't in NATIVE_CHAPTER_FORMATS
+    """
+    if native_tag_format(audio_file) not in NATIVE_CHAPTER_FORMATS:
+        return None
+    audio = File(audio_file)
+    chapters = []
+    for key in audio.keys():
+        match = re.match(r"^chapter(\d+)$", key, re.IGNORECASE)
+        if not match:
+            continue
+        start_time = _parse_chapter_time(audio[key][0])
+        if start_time is None:
+            continue
+        title = audio.get(f"{key}NAME", [f"Chapter {int(match[1])}"])[0]
+        chapters.append((int(match[1]), start_time, title))
+    return [(start_time, title) for _, start_time, title in sorted(chapters)]
 
 async def apply_thumbnail_to_file(thumbnail_input: str | bytes, audio_file: str, isFile: bool = False):
-    """Apply a thumbnail to a file using either binary data or a URL.\n
+    """Apply a thumbnail to a file using either binary data or a URL.
+    Image bytes are written straight into the tags with mutagen (see NATIVE_TAG_FORMATS); other formats
+    are remuxed with ffmpeg. URLs go through the cover store, so they are only downloaded once.\n
     :param thumbnail_input: either URL, raw binary data, or (if isFile==True) the full file path.
-    :param isFile: skip writing image file, use thumbnail_input as the file
+    :param isFile: use thumbnail_input as the image file
     :return result: True on success, else error string"""    
     try:
+        cover_file = None
         if isFile:
             if os.path.exists(thumbnail_input):
-                temp_file = thumbnail_input
+                cover_file = thumbnail_input
+                with open(cover_file, "rb") as f:
+                    image_data = f.read()
             else:
                 return "isFile==True but thumbnail_input file does not exist"
-        else:
-            title = os.path.basename(audio_file)
-            temp_file = os.path.join(TEMP_DIRECTORY,f"{title}_cover.png")
-            # Handle different input types
-            if isinstance(thumbnail_input, bytes): #binary data
-                # Write binary data directly to temp file
-                with open(temp_file, "wb") as f:
-                    f.write(thumbnail_input)
-                print(f"Temp thumbnail downloaded using binary image data for: {audio_file}")
-            else: #URL
-                print(f"⚠️Downloading thumbnail from URL: {thumbnail_input}")
-                returncode, _, error = await run_command(f'wget -O "{temp_file}" "{thumbnail_input}"')
-                if returncode != 0:
-                    return f"❌Download failed: {error}"
-
-        # Common processing for both input types
-        if audio_file.endswith('.opus'):
-            # OPUS handling with mutagen
-            with open(temp_file, "rb") as f:
-                image_data = f.read()
-
-            # Create FLAC-style picture metadata
-            pic = Picture()
-            pic.data = image_data
-            pic.type = 3    # Cover (front)
-            pic.mime = "image/png" if image_data.startswith(b'\x89PNG') else "image/jpeg"
-            pic.desc = "Cover art"
-            
-            audio = OggOpus(audio_file)
-            audio["METADATA_BLOCK_PICTURE"] = [base64.b64encode(pic.write()).decode()]
-            audio.save()
-            print(f"✅Thumbnail updated (OPUS): {audio_file}")
+        elif isinstance(thumbnail_input, bytes): #binary data
+            image_data = thumbnail_input
+        else: #URL
+            print(f"⚠️Getting thumbnail from URL: {thumbnail_input}")
+            image_data, error = await cover_store.fetch_url(thumbnail_input)
+            if error:
+                return f"❌Download failed: {error}"
+
+        tag_format = native_tag_format(audio_file)
+        if tag_format:
+            await asyncio.to_thread(write_metadata_native, audio_file, image_data=image_data)
+            print(f"✅Thumbnail updated ({tag_format}): {audio_file}")
             return True
 
-        else:
-            # FFmpeg handling for other formats
-            ffmpeg_cmd = (
-                f'ffmpeg -y -i "{audio_file}" -i "{temp_file}" '
-                f'-map 0 -map 1 -c copy -disposition:v attached_pic "temp{FILE_EXTENSION}"'
-            )
-            returncode, _, error = await run_command(ffmpeg_cmd, True)
+        # FFmpeg handling for other formats, needs the image as a file
+        if cover_file is None:
+            cover_file = cover_store.put(image_data)
+        with scratch_workspace("cover") as workspace:
+            temp_file = workspace.file(f"cover{FILE_EXTENSION}")
+            ffmpeg_cmd = [
+                "ffmpeg", "-y", "-i", audio_file, "-i", cover_file,
+                "-map", "0", "-map", "1", "-c", "copy", "-disposition:v", "attached_pic", temp_file
+            ]
+            returncode, _, error = await process_scheduler.run(REMUX, ffmpeg_cmd, verbose=True, timeout=REMUX_TIMEOUT)
             
             if returncode == 0:
-                await run_command(f'mv "temp{FILE_EXTENSION}" "{audio_file}"')
+                await asyncio.to_thread(move_into_place, temp_file, audio_file)
                 print(f"✅Thumbnail updated (FFmpeg): {audio_file}")
                 return True
-            return f"❌FFmpeg failed: {error}"
+        return f"❌FFmpeg failed: {error}"
 
     except Exception as e:
         return f"❌apply_thumbnail_to_file() Error: {str(e)}"
-    finally:
-        if not isFile:
-            try: os.remove(temp_file)
-            except: pass
 
-async def apply_timestamps_to_file(timestamps: str, audio_file: str, canRemove: bool = False) ->tuple:
-    """Convert timestamps to FFmetadata and apply them to an audio file.
-    
-    :param timestamps: expected to be in the format of [min:sec]"title"
-    :param canRemove: if True, then timestamps can be wiped from the file.
-    
-    :return: bool for success/fail, err
+def parse_timestamps(timestamps: str) -> list:
+    """Parse user timestamps, expected to be in the format of [min:sec]"title" (optional .millis)
+
+    :return: list of (start in milliseconds, title). Invalid lines are skipped
     """
-    
-    if timestamps==None and canRemove:
-        # Special case: Remove existing chapters
-        ffmpeg_cmd = (
-            f'ffmpeg -i "{audio_file}" '
-            f'-map_metadata 0 '  # Preserve existing metadata
-            f'-map_chapters -1 '  # Remove all chapters
-            f'-c copy -y "{audio_file}.tmp.{FILE_EXTENSION}" '
-            f'&& mv "{audio_file}.tmp.{FILE_EXTENSION}" "{audio_file}"'
-        )
-        print(f"Removal command: {ffmpeg_cmd}")
-        returncode, _, error = await run_command(ffmpeg_cmd, verbose=True)
-        
-        if returncode != 0:
-            error = f"Chapter removal failed:\n{error}"
-            print(error)
-            return False, error
-        return True, None
-    
-    #not removing timestamps:
-    metadata = [";FFMETADATA1"]
-    timebase = 1000  # FFmetadata timebase in milliseconds
+    timebase = 1000  # milliseconds
     chapter_times = []
 
     # Improved regex to support optional milliseconds
     timestamp_pattern = re.compile(r"(\d+):(\d+)(?:\.(\d+))?\s+(.+)")  
 
-    # Parse timestamps
     for line in timestamps.strip().split("\n"):
         match = timestamp_pattern.match(line.strip())
         if match:
@@ -222,12 +350,66 @@ async def apply_timestamps_to_file(timestamps: str, audio_file: str, canRemove:
             chapter_times.append((start_time, title))
         else:
             print(f"Skipping invalid format: {line}")
+    return chapter_times
 
-    # Ensure at least one chapter exists
+async def apply_timestamps_to_file(timestamps: str, audio_file: str, canRemove: bool = False) ->tuple:
+    """Convert timestamps to chapters and apply them to an audio file.
+    Opus/Ogg/FLAC files are edited in place (Vorbis comments); other formats are remuxed with ffmpeg.
+    
+    :param timestamps: expected to be in the format of [min:sec]"title"
+    :param canRemove: if True, then timestamps can be wiped from the file.
+    
+    :return: bool for success/fail, err
+    """
+    if timestamps==None and canRemove:
+        # Special case: Remove existing chapters
+        chapter_times = []
+    else:
+        chapter_times = parse_timestamps(timestamps)
+        # Ensure at least one chapter exists
+        if not chapter_times:
+            error = "No valid timestamps found."
+            print(error)
+            return False, error
+
+    if native_tag_format(audio_file) in NATIVE_CHAPTER_FORMATS:
+        #no remux needed, Vorbis comment chapters only need start times
+        try:
+            await asyncio.to_thread(write_metadata_native, audio_file, chapters=chapter_times)
+        except Exception as e:
+            error = f"Writing chapters failed:\n{e}"
+            print(error)
+            return False, error
+        return True, None
+    return await _remux_chapters(audio_file, chapter_times)
+
+async def _remux_chapters(audio_file: str, chapter_times: list) -> tuple:
+    """Replace the chapters of a file with an ffmpeg remux, for formats mutagen can't write chapters to
+
+    :param chapter_times: list of (start in milliseconds, title), [] removes all chapters
+    :return: bool for success/fail, err
+    """
+    with scratch_workspace("chapters") as workspace:
+        return await _remux_chapters_in(workspace, audio_file, chapter_times)
+
+async def _remux_chapters_in(workspace, audio_file: str, chapter_times: list) -> tuple:
+    temp_file = workspace.file(f"remux{FILE_EXTENSION}")
     if not chapter_times:
-        error = "No valid timestamps found."
-        print(error)
-        return False, error
+        ffmpeg_cmd = [
+            "ffmpeg", "-i", audio_file,
+            "-map_metadata", "0",  # Preserve existing metadata
+            "-map_chapters", "-1",  # Remove all chapters
+            "-c", "copy", "-y", temp_file
+        ]
+        print(f"Removal command: {shlex.join(ffmpeg_cmd)}")
+        returncode, _, error = await process_scheduler.run(REMUX, ffmpeg_cmd, verbose=True, timeout=REMUX_TIMEOUT)
+        
+        if returncode != 0:
+            error = f"Chapter removal failed:\n{error}"
+            print(error)
+            return False, error
+        await asyncio.to_thread(move_into_place, temp_file, audio_file)
+        return True, None
 
     # Get total duration of audio file
     total_duration = await get_audio_duration(audio_file)
@@ -237,6 +419,7 @@ async def apply_timestamps_to_file(timestamps: str, audio_file: str, canRemove:
         return False, error
 
     # Assign END times correctly
+    metadata = [";FFMETADATA1"]
     for i, (start_time, title) in enumerate(chapter_times):
         metadata.append("[CHAPTER]")
         metadata.append("TIMEBASE=1/1000")
@@ -245,33 +428,28 @@ async def apply_timestamps_to_file(timestamps: str, audio_file: str, canRemove:
         # Set END to the start of the next chapter or the total duration for the last one
         end_time = chapter_times[i + 1][0] if i < len(chapter_times) - 1 else total_duration
         metadata.append(f"END={end_time}")
-        metadata.append(f"title={title.replace('\"', '\'')}")  # Escape quotes in titles
+        title = title.replace('"', "'")  # Escape quotes in titles
+        metadata.append(f"title={title}")
 
     # Write metadata to file
-    metadata_file = os.path.join(TEMP_DIRECTORY,"metadata.txt")
+    metadata_file = workspace.file("metadata.txt", in_ram=True)
     with open(metadata_file, "w") as f:
         f.write("\n".join(metadata))
 
     # Apply metadata with FFmpeg
-    ffmpeg_cmd = (
-        f'ffmpeg -i "{audio_file}" -i {metadata_file} '
-        f'-map_metadata 0 -map_chapters 1 '
-        f'-c copy -y "{audio_file}.tmp.{FILE_EXTENSION}" '
-        f'&& mv "{audio_file}.tmp.{FILE_EXTENSION}" "{audio_file}"'
-    )
-    print(f"ffmpeg_cmd = {ffmpeg_cmd}")
-    returncode, _, error = await run_command(ffmpeg_cmd, verbose=True)
-
-    # Cleanup metadata and temp.{FILE_EXTENSION} file
-    try:
-        os.remove(metadata_file)
-    except OSError as e:
-        print(f"Warning: Failed to delete temp metadata file: {e}")
+    ffmpeg_cmd = [
+        "ffmpeg", "-i", audio_file, "-i", metadata_file,
+        "-map_metadata", "0", "-map_chapters", "1",
+        "-c", "copy", "-y", temp_file
+    ]
+    print(f"ffmpeg_cmd = {shlex.join(ffmpeg_cmd)}")
+    returncode, _, error = await process_scheduler.run(REMUX, ffmpeg_cmd, verbose=True, timeout=REMUX_TIMEOUT)
 
     if returncode != 0:
         error = f"FFmpeg command failed:\n{error}"
         print(error)
         return False, error
+    await asyncio.to_thread(move_into_place, temp_file, audio_file)
     return True, None
 
 async def extract_chapters(audio_file: str) -> tuple:
@@ -280,30 +458,46 @@ async def extract_chapters(audio_file: str) -> tuple:
     :return: chapter_file,err    
     """
     chapter_file = audio_file.replace(f"{FILE_EXTENSION}", ".txt")
+    chapters, error_str = await read_chapters(audio_file)
+    #if chapters exist, then make file, else return nothing
+    if chapters:
+        return write_chapter_file(chapters, chapter_file)
+    return None,error_str
 
-    ffprobe_cmd = f'ffprobe -i "{audio_file}" -print_format json -show_chapters -loglevel error'
+async def read_chapters(audio_file: str) -> tuple:
+    """Read the chapters of an audio file. Vorbis comment chapters are read with mutagen, other formats with ffprobe
 
+    :return: list of (start in milliseconds, title) (None on error), err
+    """
     print("Extracting chapter data...")
-    returncode, output, error = await run_command(ffprobe_cmd,verbose=True)
-     
-    if returncode != 0:
-        error_msg = f"FFprobe error ({returncode}):\n{error}"
-        print(error_msg)
-        return None, error_msg
-
     try:
-        chapters = json.loads(output).get("chapters", [])
-    except json.JSONDecodeError:
-        error_msg = "Failed to parse FFprobe output"
-        print(error_msg)
-        return None, error_msg
-    #if chapters exist, then make file, else return nothing
-    if chapters:
-        return format_timestamps_for_musicolet(chapters, chapter_file)
-    else:
+        chapters = await asyncio.to_thread(read_chapters_native, audio_file)
+    except Exception as e:
+        print(f"Failed to read chapters with mutagen, falling back to ffprobe: {e}")
+        chapters = None
+
+    if chapters is None:
+        ffprobe_cmd = ["ffprobe", "-i", audio_file, "-print_format", "json", "-show_chapters", "-loglevel", "error"]
+        returncode, output, error = await process_scheduler.run(PROBE, ffprobe_cmd, timeout=PROBE_TIMEOUT, capture_stdout=True)
+        
+        if returncode != 0:
+            error_msg = f"FFprobe error ({returncode}):\n{error}"
+            print(error_msg)
+            return None, error_msg
+
+        try:
+            chapters = [(round(float(chapter["start_time"]) * 1000), chapter.get("tags", {}).get("title", "Unknown"))
+                        for chapter in json.loads(output).get("chapters", [])]
+        except (json.JSONDecodeError, KeyError, ValueError):
+            error_msg = "Failed to parse FFprobe output"
+            print(error_msg)
+            return None, error_msg
+
+    if not chapters:
         error_str = "No chapters found."
         print(error_str)
-        return None,error_str
+        return [], error_str
+    return chapters, None
 
 def format_timestamps_for_musicolet(chapters, chapter_file) -> tuple:
     """Converts json sorted timestamps into musicolet timestamps [mn:sc.ms]"""
@@ -323,8 +517,67 @@ def format_timestamps_for_musicolet(chapters, chapter_file) -> tuple:
         print(error_msg)
         return None, error_msg
 
+def write_chapter_file(chapters: list, chapter_file: str) -> tuple:
+    """Write (start in milliseconds, title) chapters as a musicolet .txt, without probing the audio file again
+
+    :return: chapter_file,err
+    """
+    return format_timestamps_for_musicolet(
+        [{"start_time": start_time / 1000, "tags": {"title": title}} for start_time, title in chapters], chapter_file)
+
+class MetadataPlan:
+    """
+    Every metadata change for one file (cover, chapters) made after the download, collected by the download steps and
+    written in one go with commit(). Tags are already written by yt-dlp. Formats in NATIVE_TAG_FORMATS are loaded and saved once by mutagen; ffmpeg is only used when
+    chapters have to be remuxed into a format mutagen can't write them to.
+    """
+    def __init__(self, audio_file: str):
+        self.audio_file = audio_file
+        self.image_data = None
+        self.chapters = None    #None: leave as is, []: remove all
+
+    def set_cover(self, image_data: bytes):
+        self.image_data = image_data
+
+    def set_chapters(self, chapters: list):
+        """:param chapters: list of (start in milliseconds, title), eg: from parse_timestamps()"""
+        self.chapters = chapters
+
+    def is_empty(self) -> bool:
+        return self.image_data is None and self.chapters is None
+
+    async def commit(self) -> tuple:
+        """Write everything planned to the file
+
+        :return: success,err
+        """
+        if self.is_empty():
+            return True, None
+        tag_format = native_tag_format(self.audio_file)
+        remux_chapters = self.chapters is not None and tag_format not in NATIVE_CHAPTER_FORMATS
+        try:
+            if tag_format:
+                await asyncio.to_thread(write_metadata_native, self.audio_file, None, self.image_data,
+                                        None if remux_chapters else self.chapters)
+            elif self.image_data is not None:
+                return False, f"Can't write a cover to {os.path.basename(self.audio_file)} in place"
+        except Exception as e:
+            error_msg = f"Error writing metadata to {self.audio_file}: {str(e)}"
+            print(error_msg)
+            return False, error_msg
+
+        if remux_chapters:
+            success, error = await _remux_chapters(self.audio_file, self.chapters)
+            if not success:
+                return False, error
+        print(f"✅Metadata written: {self.audio_file}")
+        return True, None
+
 async def get_audio_metadata(audio_file: str) -> dict:
-    """Get metadata from audio file using mutagen"""
+    """Get metadata from audio file using mutagen. File I/O runs in a worker thread"""
+    return await asyncio.to_thread(_read_audio_metadata, audio_file)
+
+def _read_audio_metadata(audio_file: str) -> dict:
     try:
         if audio_file.lower().endswith('.opus'):
             # Handle OPUS files specifically
@@ -356,24 +609,78 @@ async def get_audio_metadata(audio_file: str) -> dict:
             'genre': None
         }
 
-async def get_audio_duration(audio_file: str) -> Optional[int]:
-    """Get the duration of the audio file in milliseconds using ffprobe."""
-    cmd = f'ffprobe -i "{audio_file}" -show_entries format=duration -v quiet -of csv="p=0"'
-    returncode, duration_str, error = await run_command(cmd)
-
-    if returncode != 0 or not duration_str.strip():
-        print(f"Error getting duration for {audio_file}: {error or 'Empty duration output'}")
+def _probe_native(audio_file: str) -> Optional[dict]:
+    """Read duration/stream info from the container headers with mutagen. None if mutagen can't parse the file"""
+    try:
+        f = File(audio_file)
+    except Exception as e:
+        print(f"Native probe failed for {audio_file}: {e}")
         return None
+    if f is None or not getattr(f.info, "length", None):
+        return None
+    info = f.info
+    return {
+        'duration_ms': int(info.length * 1000),
+        'codec': getattr(info, 'codec', None) or type(f).__name__.lower(),
+        'sample_rate': getattr(info, 'sample_rate', None),
+        'channels': getattr(info, 'channels', None),
+        'bitrate': getattr(info, 'bitrate', None),
+    }
 
+async def _probe_ffprobe(audio_file: str) -> Optional[dict]:
+    """Fallback for _probe_native(), for containers mutagen doesn't handle"""
+    cmd = ["ffprobe", "-i", audio_file, "-v", "quiet", "-print_format", "json", "-select_streams", "a:0",
+           "-show_entries", "format=duration,bit_rate:stream=codec_name,sample_rate,channels"]
+    returncode, output, error = await process_scheduler.run(PROBE, cmd, timeout=PROBE_TIMEOUT, capture_stdout=True)
+    if returncode != 0:
+        print(f"Error probing {audio_file}: {error or 'ffprobe failed'}")
+        return None
     try:
-        return int(float(duration_str.strip()) * 1000)  # Convert seconds to milliseconds
-    except ValueError:
-        print(f"Failed to parse audio duration: {duration_str}")
+        data = json.loads(output)
+        stream = (data.get("streams") or [{}])[0]
+        return {
+            'duration_ms': int(float(data["format"]["duration"]) * 1000),
+            'codec': stream.get("codec_name"),
+            'sample_rate': int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+            'channels': stream.get("channels"),
+            'bitrate': int(data["format"]["bit_rate"]) if data["format"].get("bit_rate") else None,
+        }
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        print(f"Failed to parse ffprobe output for {audio_file}: {e}")
         return None
 
+async def probe_audio(audio_file: str) -> Optional[dict]:
+    """Get duration and stream info of an audio file. Reads headers in process, ffprobe only as a fallback
+
+    :return: {'duration_ms', 'codec', 'sample_rate', 'channels', 'bitrate'} or None on error
+    """
+    return (await probe_audio_batch([audio_file]))[0]
+
+async def probe_audio_batch(audio_files: list) -> list:
+    """probe_audio() for many files: one worker thread reads all headers, ffprobe runs only for files it couldn't read
+
+    :return: list of info dicts (or None), in the same order as audio_files
+    """
+    results = await asyncio.to_thread(lambda: [_probe_native(f) for f in audio_files])
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        fallback = await asyncio.gather(*(_probe_ffprobe(audio_files[i]) for i in missing))
+        for i, result in zip(missing, fallback):
+            results[i] = result
+    return results
+
+async def get_audio_duration(audio_file: str) -> Optional[int]:
+    """Get the duration of the audio file in milliseconds."""
+    info = await probe_audio(audio_file)
+    return info['duration_ms'] if info else None
+
+async def get_audio_durations(audio_files: list) -> list:
+    """Durations in milliseconds (None on error) for a list of files, in the same order"""
+    return [info['duration_ms'] if info else None for info in await probe_audio_batch(audio_files)]
+
 #replace_thumbnail(title,playlist=True,cover_URL=None, album=None, artist=None, strict=True, releasetype = None, size=None)
 async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=None, album:str=None, artist:str=None,
-        strict:bool=True, releasetype: str = None, size: str = DEFAULT_COVER_SIZE) -> tuple: 
+        strict:bool=True, releasetype: str = None, size: str = DEFAULT_COVER_SIZE, plan: MetadataPlan = None) -> tuple: 
     """
     Function to apply thumbnails to a music/video file, or an entire playlist\n
     Either title, album, or both must be provided:
@@ -393,43 +700,48 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
     :param releasetype: TODO check replace_thumbnail_command() in main.py. change this comment when that is finished
     
     :param size: Cover size. Valid values are 250, 500, or 1200. Other values default to largest size (not recommended)
+    :param plan: single file only. If given, the cover is set on the plan instead of written, the caller commits it
 
     :return: Tuple: output str, err str. if output None then error. 
             NOTE: can still return error str on success (failed database lookup) 
             NOTE: if sending outputs to user, use safe_send()!
     """
-    success_list = []
-    thumbnail_error = "" #dont stop execution on database errors, collect and continue
+    success_list = []   #(track order, line)
+    track_slots = asyncio.Semaphore(TRACK_WORKERS)  #limits concurrent file reads/writes
+    mb_priority = PRIORITY_BULK if playlist else PRIORITY_INTERACTIVE   #single songs skip ahead of playlist backfills
+    thumbnail_errors = []   #(track order, line). dont stop execution on database errors, collect and continue
     album_cover_found_str = "not "
-    async def _fetch_data(_artist,_title,_releasetype):
+    async def _fetch_data(_artist,_title,_releasetype,_order=-1):
         """Nested function to run fetch_musicbrainz_data() and handle errors
 
         :return _image_data: None on error"""
-        nonlocal thumbnail_error
-        _image_data, error = await fetch_musicbrainz_data(_artist, _title, _releasetype, size, strict)
+        _image_data, error = await fetch_musicbrainz_data(_artist, _title, _releasetype, size, strict, mb_priority)
         if error:
             #database error truncated
-            thumbnail_error += f"⚠️DB lookup failed for __{_title}__: {error[:80]}\n"
+            thumbnail_errors.append((_order, f"⚠️DB lookup failed for __{_title}__: {error[:80]}"))
             print(f"⚠️DB lookup failed for {_title}:\n{error}")
             return None    #keep checking other files, return this error later
         if not _image_data:
             temp_error = f"❌No artwork found for {_title}"
-            thumbnail_error += temp_error+"\n"
+            thumbnail_errors.append((_order, temp_error))
             print(temp_error)
             return None    #keep checking other files, return this error later
         return _image_data
-    async def _apply_thumbnail(_image,_audio_file,_title):
+    async def _apply_thumbnail(_image,_audio_file,_title,_order):
         """Nested function to run apply_thumbnail_to_file() and handle errors\n
         :param _image: either image_data or cover_URL
         :param _audio_file: full path of audio file
         :return result: True on success, else error"""
-        nonlocal thumbnail_error
-
-        result = await apply_thumbnail_to_file(_image, _audio_file)
+        if plan is not None:
+            plan.set_cover(_image)
+            result = True
+        else:
+            async with track_slots:
+                result = await apply_thumbnail_to_file(_image, _audio_file)
         if result == True:
-            success_list.append(f"- {_title}")
+            success_list.append((_order, f"- {_title}"))
         else:#error
-            thumbnail_error += f"❗Error applying thumbnail for __{_title}__:\n- {result[:40]}\n" #truncate error
+            thumbnail_errors.append((_order, f"❗Error applying thumbnail for __{_title}__:\n- {result[:40]}")) #truncate error
             print(f"❗Error applying thumbnail for {_title}:\n{result}")
         return result
     
@@ -446,12 +758,12 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
     subdir = os.path.join(MUSIC_DIRECTORY, f"{title}")
     if playlist:
         #get list of files in subdir (only file.ext, not full path)
-        subdir_list = [f for f in os.listdir(subdir) if not f.endswith('.txt')] 
+        subdir_list = [f for f in library_index.children(subdir) if not f.endswith('.txt')] 
     else:
         audio_file = find_file_case_insensitive(MUSIC_DIRECTORY, f"{title}{FILE_EXTENSION}")
         subdir_list=[audio_file] #this is the single track's *full directory* in list form
 
-    if subdir_list == [] or subdir_list == None:
+    if subdir_list == [] or subdir_list == None or subdir_list == [None]:
         error_str = "❗File/Playlist does not exist"
         print(error_str)
         return None, error_str
@@ -479,7 +791,7 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
             image_data_album = await _fetch_data(album_artist, album_metadata,"album")
             if image_data_album == None:
                 temp_error = f"⚠️No album cover found"
-                thumbnail_error += temp_error+"\n"
+                thumbnail_errors.append((-1, temp_error))
                 print(temp_error)
         if image_data_album:
             album_cover_found_str = ""
@@ -491,13 +803,14 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
         image_data_album = None
         print(f"Album not provided")
 
-    #TODO: make each iteration async
-    for audio_file in subdir_list:
+    async def _process_track(_order, audio_file):
+        """One track of the pipeline: metadata read -> MB search -> CAA fetch -> tag write.
+        All tracks run concurrently: file I/O is limited to TRACK_WORKERS at a time, MB searches go through mb_scheduler"""
         print(f"\nStarting download for {audio_file}")
+        track_title = title
         #add extensions to each file if playlist
         if audio_file.endswith(FILE_EXTENSION) and playlist:
-            title = audio_file
-            title = os.path.splitext(title)[0]
+            track_title = os.path.splitext(audio_file)[0]
             audio_file = os.path.join(subdir, audio_file)   #get full path of each playlist entry
         #title is already title for singles
         if cover_URL == None: #use database
@@ -505,7 +818,8 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
             if album and releasetype == "album": #album provided and releasetype is album, so only use album cover (even if None)
                 image_data = image_data_album
             else:
-                metadata = await get_audio_metadata(audio_file)
+                async with track_slots:
+                    metadata = await get_audio_metadata(audio_file)
 
                 if artist:
                     metadata_artist = artist
@@ -513,32 +827,44 @@ async def replace_thumbnail(title: str=None, playlist:bool=False, cover_URL:str=
                     metadata_artist = metadata.get('artist', None)
                 
                 if metadata_artist == None:  #check if there is an artist, throw warn if not
-                    temp_error = f"⚠️Unknown artist for __{title}__, please supply one manually"
-                    thumbnail_error += temp_error+"\n"
+                    temp_error = f"⚠️Unknown artist for __{track_title}__, please supply one manually"
+                    thumbnail_errors.append((_order, temp_error))
                     print(temp_error)
                 
                 metadata_title = metadata.get('title', None)
                 #get cover:
-                image_data = await _fetch_data(metadata_artist,metadata_title,releasetype)
-                if image_data == None and title != metadata_title:
+                image_data = await _fetch_data(metadata_artist,metadata_title,releasetype,_order)
+                if image_data == None and track_title != metadata_title:
                     #not same, try file title instead
                     print("Trying file title:")
-                    image_data = await _fetch_data(metadata_artist,title,releasetype)
+                    image_data = await _fetch_data(metadata_artist,track_title,releasetype,_order)
 
             if image_data == None:
                 if image_data_album:    #album cover was found, so use that as fallback
-                    await _apply_thumbnail(image_data_album,audio_file,title)
-                else:
-                    continue    #no image data, continue with other tracks
+                    await _apply_thumbnail(image_data_album,audio_file,track_title,_order)
+                #else no image data, continue with other tracks
             else:
-                await _apply_thumbnail(image_data,audio_file,title)
-        else: #cover_URL != None: (DONT use database)
-            await _apply_thumbnail(cover_URL,audio_file,title)
+                await _apply_thumbnail(image_data,audio_file,track_title,_order)
+        else: #cover_URL != None: (DONT use database). Already downloaded to bytes
+            await _apply_thumbnail(cover_URL,audio_file,track_title,_order)
+
+    if cover_URL != None:
+        #download once up front instead of once per concurrent track
+        image_data_url, error = await cover_store.fetch_url(cover_URL)
+        if error:
+            return None, f"❌Download failed: {error}"
+        cover_URL = image_data_url
+
+    await asyncio.gather(*(_process_track(i, audio_file) for i, audio_file in enumerate(subdir_list)))
 
+    #report in playlist order, album level messages first
+    success_list.sort(key=lambda x: x[0])
+    thumbnail_errors.sort(key=lambda x: x[0])
+    thumbnail_error = "".join(f"{line}\n" for _, line in thumbnail_errors)
     output = None
     error_str = None
     if(success_list != []): #updated in _apply_thumbnail
-        success_string = "\n".join(success_list)
+        success_string = "\n".join(line for _, line in success_list)
         output = f"🎊Thumbnails for:\n{success_string}\nupdated from MusicBrainz!"
     if(thumbnail_error != ""):
         error_str=f"Album cover was {album_cover_found_str}found:\n❗Error(s): check console for more detail:\n{thumbnail_error}"
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import shutil
+from contextlib import asynccontextmanager
+from config.config_manager import config
+from utils.core import run_process
+
+TRANSCODE = "transcode" #CPU heavy: yt-dlp downloads (audio extraction re-encodes)
+REMUX = "remux"         #I/O heavy: ffmpeg stream copies (concat, chapters, covers)
+PROBE = "probe"         #cheap: ffprobe, usually something a user is waiting on
+
+PROCESS_SETTINGS = config["process_settings"]
+
+def _cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))    #cores this process may actually use
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _default_slots(resource: str, cores: int) -> int:
+    if resource == TRANSCODE:
+        return cores
+    if resource == REMUX:
+        return max(2, cores // 2)
+    return cores * 2
+
+class ProcessScheduler:
+    """
+    Limits how many external processes of each class run at once, process wide. Each class has its own slots
+    (sized from the core count unless set in process_settings), so a pile of transcodes from concurrent playlist
+    downloads queues up instead of oversubscribing the CPU, while remuxes and probes never wait behind them.
+    Transcodes and remuxes are started with nice/ionice when available, so interactive work stays responsive.
+    """
+    def __init__(self):
+        cores = _cpu_count()
+        self.slots = {resource: PROCESS_SETTINGS[f"{resource}_slots"] or _default_slots(resource, cores)
+                      for resource in (TRANSCODE, REMUX, PROBE)}
+        self._semaphores = {}   #created on first use, inside the running event loop
+        self._waiting = {resource: 0 for resource in self.slots}
+        self._prefix = self._priority_prefix()
+
+    @staticmethod
+    def _priority_prefix() -> list:
+        prefix = []
+        niceness = PROCESS_SETTINGS["nice"]
+        if niceness and shutil.which("nice"):
+            prefix += ["nice", "-n", str(niceness)]
+        if PROCESS_SETTINGS["ionice"] and shutil.which("ionice"):
+            prefix += ["ionice", "-c", "2", "-n", "7"]    #best effort, lowest priority
+        return prefix
+
+    def _semaphore(self, resource: str) -> asyncio.Semaphore:
+        if resource not in self._semaphores:
+            self._semaphores[resource] = asyncio.Semaphore(self.slots[resource])
+        return self._semaphores[resource]
+
+    @asynccontextmanager
+    async def slot(self, resource: str):
+        """Hold one slot of a class, eg: around in-process work that starts ffmpeg itself (library engine)"""
+        semaphore = self._semaphore(resource)
+        if semaphore.locked():
+            print(f"Waiting for a free {resource} slot ({self._waiting[resource] + 1} waiting)")
+        self._waiting[resource] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[resource] -= 1
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def command(self, resource: str, argv: list) -> list:
+        """:return: argv with the class' nice/ionice prefix"""
+        if resource == PROBE:
+            return list(argv)
+        return self._prefix + list(argv)
+
+    async def run(self, resource: str, argv: list, **kwargs) -> tuple[int, str, str]:
+        """run_process() once a slot of the class is free. Timeouts count from the start of the process"""
+        async with self.slot(resource):
+            return await run_process(self.command(resource, argv), **kwargs)
+
+process_scheduler = ProcessScheduler()
@@ -0,0 +1,188 @@
+import asyncio
+import re
+import time
+from config.config_manager import config
+from typing import Optional
+
+STATUS_UPDATE_SECONDS = config["queue_settings"]["status_update_seconds"]
+
+# [download]  45.2% of ~  3.45MiB at    1.23MiB/s ETA 00:03 (frag 3/10)
+_YTDLP_PROGRESS = re.compile(
+    r"^\[download\]\s+(?P<percent>[\d.]+)%(?:\s+of\s+~?\s*(?P<size>\S+))?(?:\s+at\s+(?P<speed>\S+))?(?:\s+ETA\s+(?P<eta>\S+))?")
+# [download] Downloading item 3 of 12  (older versions: "Downloading video 3 of 12")
+_YTDLP_ITEM = re.compile(r"^\[download\] Downloading (?:item|video) (?P<index>\d+) of (?P<count>\d+)")
+# [download] Destination: /path/name.webm, [ExtractAudio] Destination: /path/name.opus
+_YTDLP_STAGE = re.compile(r"^\[(?P<stage>download|ExtractAudio|Metadata|EmbedThumbnail|FFmpegMetadata)\] (?P<detail>.*)")
+# size=    1234kB time=00:01:02.34 bitrate= 160.0kbits/s speed=12.3x
+_FFMPEG_PROGRESS = re.compile(r"time=\s*(?P<h>\d+):(?P<m>\d+):(?P<s>[\d.]+).*?speed=\s*(?P<speed>[\d.]+x|N/A)")
+
+STAGE_NAMES = {
+    "download": "Downloading",
+    "ExtractAudio": "Converting",
+    "Metadata": "Writing metadata",
+    "FFmpegMetadata": "Writing metadata",
+    "EmbedThumbnail": "Embedding thumbnail",
+}
+
+def parse_ytdlp_line(line: str) -> Optional[dict]:
+    """Parse a yt-dlp output line (run with --newline) into a progress event
+
+    :return: {"percent", "speed", "eta"}, {"index", "count"} or {"stage"}; None if the line isn't progress
+    """
+    match = _YTDLP_PROGRESS.match(line)
+    if match:
+        return {"stage": "Downloading", "percent": float(match["percent"]), "speed": match["speed"], "eta": match["eta"]}
+    match = _YTDLP_ITEM.match(line)
+    if match:
+        return {"index": int(match["index"]), "count": int(match["count"]), "percent": 0.0}
+    match = _YTDLP_STAGE.match(line)
+    if match and match["stage"] != "download":
+        return {"stage": STAGE_NAMES[match["stage"]], "percent": None, "speed": None, "eta": None}
+    return None
+
+def parse_ytdlp_hook(status: dict) -> Optional[dict]:
+    """Same events as parse_ytdlp_line(), from a yt_dlp progress hook dict (library engine)"""
+    if status.get("status") != "downloading":
+        return None
+    event = {"stage": "Downloading", "percent": None, "speed": None, "eta": None}
+    total = status.get("total_bytes") or status.get("total_bytes_estimate")
+    if total and status.get("downloaded_bytes") is not None:
+        event["percent"] = status["downloaded_bytes"] / total * 100
+    if status.get("speed"):
+        event["speed"] = f"{status['speed'] / 1048576:.2f}MiB/s"
+    if status.get("eta") is not None:
+        event["eta"] = f"{int(status['eta']) // 60:02}:{int(status['eta']) % 60:02}"
+    info = status.get("info_dict") or {}
+    if info.get("playlist_index") and info.get("n_entries"):
+        event["index"] = info["playlist_index"]
+        event["count"] = info["n_entries"]
+    return event
+
+def parse_ffmpeg_line(line: str, duration_ms: int = None) -> Optional[dict]:
+    """Parse an ffmpeg stats line. percent is only set if the output duration is known
+
+    :return: {"percent", "speed", "eta"}, None if the line isn't progress
+    """
+    match = _FFMPEG_PROGRESS.search(line)
+    if not match:
+        return None
+    position_ms = ((int(match["h"]) * 60 + int(match["m"])) * 60 + float(match["s"])) * 1000
+    event = {"percent": None, "speed": None if match["speed"] == "N/A" else match["speed"], "eta": None}
+    if duration_ms:
+        event["percent"] = min(100.0, position_ms / duration_ms * 100)
+        if event["speed"] and float(event["speed"][:-1]) > 0:
+            remaining = (duration_ms - position_ms) / 1000 / float(event["speed"][:-1])
+            event["eta"] = f"{int(remaining) // 60:02}:{int(remaining) % 60:02}"
+    return event
+
+class ShardProgress:
+    """
+    Progress of one part of a sharded playlist download, passed instead of the ProgressTracker.
+    yt-dlp numbers items within the part ("item 2 of 67"), they are reported as playlist positions ("track 4/200")
+    """
+    def __init__(self, tracker, items: list, total: int):
+        self.tracker = tracker
+        self.items = items
+        self.total = total
+
+    def ytdlp_line(self, line: str):
+        event = parse_ytdlp_line(line)
+        if event and event.get("index") and event["index"] <= len(self.items):
+            event = dict(event, index=self.items[event["index"] - 1], count=self.total)
+        self.tracker.handle(event)
+
+    def ytdlp_hook(self, status: dict):
+        #hooks carry the playlist position, but n_entries is the size of this part
+        event = parse_ytdlp_hook(status)
+        if event and event.get("index"):
+            event["count"] = self.total
+        self.tracker.handle_threadsafe(event)
+
+class ProgressTracker:
+    """
+    Collects progress events of one job and renders them into a single status line.
+    render_callback (async, receives the text) is called at most once every `interval` seconds with the
+    latest state, however many events come in, so chatty tools don't turn into Discord API calls.
+    """
+    def __init__(self, render_callback, title: str, interval: float = STATUS_UPDATE_SECONDS):
+        self.render_callback = render_callback
+        self.title = title
+        self.interval = interval
+        self.state = {"stage": "Starting", "percent": None, "speed": None, "eta": None, "index": None, "count": None}
+        self._duration_ms = None    #for ffmpeg stages
+        self._last_render = 0.0
+        self._pending = None    #render waiting for its turn
+        self._rendering = None  #render being sent
+        self._rendered = False  #a status line was (or is being) shown
+        self._loop = asyncio.get_running_loop()
+
+    def handle(self, event: Optional[dict]):
+        """Merge an event into the state and schedule a render. Must be called from the event loop"""
+        if not event:
+            return
+        self.state.update(event)
+        if self._pending is None:
+            self._pending = self._loop.create_task(self._render_later())
+
+    def handle_threadsafe(self, event: Optional[dict]):
+        """handle() from a worker thread (eg: yt_dlp progress hooks)"""
+        if event:
+            self._loop.call_soon_threadsafe(self.handle, event)
+
+    def ytdlp_line(self, line: str):
+        """run_process() line callback for yt-dlp"""
+        self.handle(parse_ytdlp_line(line))
+
+    def ytdlp_hook(self, status: dict):
+        """yt_dlp progress_hooks entry (library engine)"""
+        self.handle_threadsafe(parse_ytdlp_hook(status))
+
+    def ffmpeg_stage(self, stage: str, duration_ms: int = None):
+        """Start an ffmpeg stage (eg: "Combining"). duration_ms is the expected output duration, for percent/ETA"""
+        self._duration_ms = duration_ms
+        self.handle({"stage": stage, "percent": None, "speed": None, "eta": None})
+
+    def ffmpeg_line(self, line: str):
+        """run_process() line callback for ffmpeg"""
+        self.handle(parse_ffmpeg_line(line, self._duration_ms))
+
+    def render(self) -> str:
+        state = self.state
+        text = f"⏳{self.title}: {state['stage']}"
+        if state["index"] and state["count"]:
+            text += f" track {state['index']}/{state['count']}"
+        if state["percent"] is not None:
+            text += f" {state['percent']:.1f}%"
+        if state["speed"]:
+            text += f" at {state['speed']}"
+        if state["eta"]:
+            text += f", ETA {state['eta']}"
+        return text
+
+    async def _render_later(self):
+        await asyncio.sleep(max(0, self._last_render + self.interval - time.monotonic()))
+        self._pending = None
+        self._rendering = asyncio.current_task()
+        self._rendered = True
+        self._last_render = time.monotonic()
+        try:
+            await self.render_callback(self.render())
+        except Exception as e:
+            print(f"⚠️Progress update failed: {e}")
+        finally:
+            self._rendering = None
+
+    async def finish(self, text: str = None):
+        """Stop updating. If text is given and a status line was shown, text replaces it.
+        A render still being sent is waited for first, so it can't land after (and overwrite) the final text
+        """
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._rendering is not None:
+            await self._rendering
+        if text is not None and self._rendered:
+            try:
+                await self.render_callback(text)
+            except Exception as e:
+                print(f"⚠️Progress update failed: {e}")
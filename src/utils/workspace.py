@@ -0,0 +1,101 @@
+import errno
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from config.config_manager import config
+
+TEMP_DIRECTORY = config["directory_settings"]["temp_directory"]
+SCRATCH_DIRECTORY = config["directory_settings"]["scratch_directory"] or os.path.join(TEMP_DIRECTORY, "scratch")
+RAM_SCRATCH_DIRECTORY = config["directory_settings"]["ram_scratch_directory"]
+WORKSPACE_PREFIX = "musicbot-"  #roots like /dev/shm are shared, only directories with this prefix are ours
+
+def _ram_root() -> str:
+    if RAM_SCRATCH_DIRECTORY and os.path.isdir(RAM_SCRATCH_DIRECTORY) and os.access(RAM_SCRATCH_DIRECTORY, os.W_OK):
+        return RAM_SCRATCH_DIRECTORY
+    return SCRATCH_DIRECTORY
+
+class Workspace:
+    """
+    Private scratch directory of one job step. Audio sized files go to SCRATCH_DIRECTORY, small files
+    (ffmetadata, concat lists) can go to RAM_SCRATCH_DIRECTORY instead. Both are deleted by cleanup().
+    """
+    def __init__(self, label: str):
+        self.label = label
+        self.path = self._create(SCRATCH_DIRECTORY)
+        self._ram_path = None
+
+    def _create(self, root: str) -> str:
+        os.makedirs(root, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{os.getpid()}-{self.label}-", dir=root)
+
+    def file(self, name: str, in_ram: bool = False) -> str:
+        """:return: path for a scratch file. in_ram: small file, kept in RAM if a RAM root is available"""
+        if not in_ram:
+            return os.path.join(self.path, name)
+        if self._ram_path is None:
+            self._ram_path = self._create(_ram_root())
+        return os.path.join(self._ram_path, name)
+
+    def cleanup(self):
+        for path in (self.path, self._ram_path):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+
+@contextmanager
+def scratch_workspace(label: str):
+    """Workspace that is removed when the block exits, whatever happens inside it
+
+    :param label: shows up in the directory name, eg: "chapters"
+    """
+    workspace = Workspace(label)
+    try:
+        yield workspace
+    finally:
+        workspace.cleanup()
+
+def move_into_place(source: str, destination: str):
+    """Move a finished scratch file over its destination. Atomic when both are on one filesystem, otherwise copied
+    next to the destination under a hidden name first, so the destination never shows up half written
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    directory, name = os.path.split(destination)
+    partial = os.path.join(directory, f".{name}.partial")
+    try:
+        shutil.copy2(source, partial)
+        os.replace(partial, destination)
+    except OSError:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(source)
+
+def clear_stale_workspaces():
+    """Remove workspaces left behind by earlier runs (eg: after a crash). Call on startup, before jobs run"""
+    for root in {SCRATCH_DIRECTORY, _ram_root()}:
+        try:
+            names = os.listdir(root)
+        except OSError:
+            continue
+        for name in names:
+            if not name.startswith(WORKSPACE_PREFIX):
+                continue
+            pid = name[len(WORKSPACE_PREFIX):].split("-", 1)[0]
+            #pid of this process: an earlier run that had the same pid (eg: pid 1 in a container)
+            if pid.isdigit() and (int(pid) == os.getpid() or not _pid_alive(int(pid))):
+                print(f"Removing stale scratch workspace {os.path.join(root, name)}")
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True #exists, owned by someone else
+    return True
@@ -0,0 +1,128 @@
+import asyncio
+import shlex
+import threading
+from config.config_manager import config
+from utils.info_cache import info_cache
+from utils.process_scheduler import process_scheduler, TRANSCODE
+from typing import Optional
+
+try:
+    import yt_dlp
+    from yt_dlp.postprocessor.metadataparser import MetadataParserPP
+except ImportError:
+    yt_dlp = None
+
+ENGINE = config["download_settings"]["engine"]
+FILE_TYPE = config["download_settings"]["file_type"]
+
+class YtDlpEngine:
+    """
+    Drives yt-dlp as an in-process library instead of spawning the yt_dlp_path binary.
+
+    One long-lived YoutubeDL instance is kept for info extraction so extractors are only loaded once.
+    Info dicts from extract_info() are stored in the info cache, so the following download() reuses them
+    instead of extracting the page again.
+    """
+    def __init__(self):
+        self._extractor = yt_dlp.YoutubeDL({
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+            "skip_download": True,
+        })
+        self._extractor_lock = threading.Lock()    #YoutubeDL instances are not thread safe
+
+    def _extract(self, url: str) -> dict:
+        with self._extractor_lock:
+            info = self._extractor.extract_info(url, download=False)
+            return self._extractor.sanitize_info(info)
+
+    async def extract_info(self, url: str) -> tuple[Optional[dict], Optional[str]]:
+        """Extract the full info dict for a video/playlist without downloading. Served from the info cache when fresh
+
+        :return: info dict (None on error), error str (None on success)
+        """
+        info = info_cache.get(url)
+        if info is not None:
+            return info, None
+        try:
+            info = await asyncio.to_thread(self._extract, url)
+        except Exception as e:
+            return None, str(e)
+        info_cache.put(url, info)
+        return info, None
+
+    def _build_params(self, options: dict, progress_hook=None) -> dict:
+        """Translate download options (see build_download_options() in ytdownloader.py) into YoutubeDL params"""
+        postprocessors = []
+        if options.get("track_numbers"):
+            postprocessors.append({
+                "key": "MetadataParser",
+                "actions": [(MetadataParserPP.Actions.INTERPRET, "playlist_index", "%(track_number)s")],
+                "when": "pre_process",
+            })
+        postprocessors.append({"key": "FFmpegExtractAudio", "preferredcodec": options["audio_format"]})
+        postprocessors.append({
+            "key": "FFmpegMetadata",
+            "add_metadata": True,
+            "add_chapters": options["embed_chapters"],
+        })
+        if options["embed_thumbnail"]:
+            postprocessors.append({"key": "EmbedThumbnail"})
+
+        params = {
+            "format": "bestaudio/best",
+            "outtmpl": {"default": options["outtmpl"]},
+            "paths": options.get("paths", {}),
+            "overwrites": options["force_overwrites"],
+            "playlist_items": options.get("playlist_items"),
+            "writethumbnail": options["embed_thumbnail"],
+            "postprocessors": postprocessors,
+            "quiet": True,
+            "no_warnings": True,
+            "noprogress": True,
+        }
+        if options.get("postprocessor_args"):
+            params["postprocessor_args"] = {"default": shlex.split(options["postprocessor_args"])}
+        if progress_hook:
+            params["progress_hooks"] = [progress_hook]
+        if options.get("print_to_file"):
+            params["print_to_file"] = {"after_move": [options["print_to_file"]]}
+        return params
+
+    def _download(self, url: str, info: Optional[dict], params: dict):
+        with yt_dlp.YoutubeDL(params) as ydl:
+            if info is not None:
+                #same path as --load-info-json: skip extraction, select formats and download
+                ydl.process_ie_result(info, download=True)
+            else:
+                ydl.download([url])
+
+    async def download(self, url: str, options: dict, progress_hook=None, info: dict = None) -> tuple[int, str]:
+        """Download using already extracted info when available.
+
+        :param options: download options dict, see build_download_options() in ytdownloader.py
+        :param progress_hook: optional callable receiving yt-dlp progress dicts (called from a worker thread)
+        :param info: already loaded info of url, loaded from the info cache if None
+        :return: returncode (0 on success), error str. Mirrors run_process()
+        """
+        if info is None:
+            info = await asyncio.to_thread(info_cache.get, url)
+        try:
+            params = self._build_params(options, progress_hook)
+            async with process_scheduler.slot(TRANSCODE):   #yt-dlp starts ffmpeg from inside this download
+                await asyncio.to_thread(self._download, url, info, params)
+        except Exception as e:
+            return 1, str(e)
+        return 0, ""
+
+def _load_engine() -> Optional[YtDlpEngine]:
+    if ENGINE != "library":
+        return None
+    if yt_dlp is None:
+        print("⚠️download_settings.engine is \"library\" but the yt_dlp python package is not installed. Using the binary instead")
+        return None
+    print("Using in-process yt-dlp engine")
+    return YtDlpEngine()
+
+engine = _load_engine()
@@ -1,12 +1,23 @@
 import os
 import json
-import difflib
+import asyncio
 import re
+import shlex
 import shutil
+from typing import Optional
 from config.config_manager import config
-from utils.core import run_command
+from utils.core import run_process
+from utils.process_scheduler import process_scheduler, TRANSCODE, REMUX
+from utils.ytdlp_engine import engine
+from utils.info_cache import info_cache, cache_key_for_url
+from utils.download_archive import download_archive
+from utils.maintenance import ytdlp_lock
 from utils.discord_helpers import ask_confirmation
-from utils.metadata import get_audio_duration,apply_thumbnail_to_file,get_audio_metadata,fetch_musicbrainz_data,replace_thumbnail
+from utils.known_lists import known_artists, known_tags
+from utils.progress import ProgressTracker, ShardProgress
+from utils.workspace import scratch_workspace, move_into_place
+from utils.metadata import get_audio_durations,apply_thumbnail_to_file,get_audio_metadata,fetch_musicbrainz_data,replace_thumbnail
+from utils.metadata import native_tag_format,write_metadata_native
 from mutagen import File
 from mutagen.mp4 import MP4
 
@@ -15,41 +26,25 @@ YT_DLP_PATH = config["download_settings"]["yt_dlp_path"]
 MUSIC_DIRECTORY = config["download_settings"]["music_directory"]
 FILE_TYPE = config["download_settings"]["file_type"]
 FILE_EXTENSION = config["download_settings"]["file_extension"]
+DOWNLOAD_TIMEOUT = config["download_settings"]["download_timeout_minutes"] * 60
+INFO_TIMEOUT = 300  #seconds
+PLAYLIST_WORKERS = config["queue_settings"]["playlist_workers"]
+USE_DOWNLOAD_ARCHIVE = config["download_settings"]["use_download_archive"]
 
 
-def load_known_list(filename):
-    """Load a JSON list from a file, or return an empty list if file does not exist."""
-    if not os.path.exists(filename):
-        return []
-    with open(filename, "r") as f:
-        return json.load(f)
-
-def save_known_list(filename, lst):
-    """Save the list as JSON to a file."""
-    with open(filename, "w") as f:
-        json.dump(lst, f, indent=4)
-
 async def check_and_update_artist(artist: str, interaction) -> str:
     """
     Check if the artist is known (case-insensitive). If a close match exists,
     suggest it (and automatically use it), otherwise add the new artist to the list.
     """
-    filename = "artists.json"
-    known_artists = load_known_list(filename)
-
-    # lowercase for easier matching
-    lower_artist = artist.lower()
-    lower_known = {a.lower(): a for a in known_artists}
-    
     #check for direct match
-    for index,items in enumerate(lower_known):
-        if lower_artist == items:
-            return known_artists[index] #match found, so return the stored version
+    match = known_artists.get(artist)
+    if match is not None:
+        return match #match found, so return the stored version
         
     # Use fuzzy matching to look for close matches.
-    matches = difflib.get_close_matches(lower_artist, lower_known.keys(), n=1, cutoff=0.8)
-    if matches:
-        suggestion = lower_known[matches[0]]
+    suggestion = known_artists.close_match(artist, cutoff=0.8)
+    if suggestion:
         print(f"Artist '{artist}' not found. Did you mean '{suggestion}'? Using '{suggestion}'.")
         return suggestion
     else:
@@ -58,104 +53,110 @@ async def check_and_update_artist(artist: str, interaction) -> str:
         if (await ask_confirmation(interaction, user_output)) == False: #confirm if user wants to add artist to list
             return False
 
-        known_artists.append(artist)
-        save_known_list(filename, known_artists)
-        return artist
+        #another command may have added it while waiting for confirmation, use the stored version if so
+        return known_artists.add(artist)[0]
 
 async def check_and_update_tags(tags: str, interaction) -> list:
     """
     Check each tag against the known list. Each tag is converted to Title Case.
     If a close match exists, use that suggestion; otherwise, add the new tag.
     """
-    filename = "tags.json"
-    known_tags = load_known_list(filename)
     updated_tags = []
-    lower_known = {tag.lower(): tag for tag in known_tags}
+    new_tags = []
     user_output = ""
-    trying_to_gen_new_tag = False
     for tag in tags:
         # Convert tag to Title Case.
         tag_normalized = tag.strip().title()
-        lower_tag = tag_normalized.lower()
-        if lower_tag in lower_known:
-            updated_tags.append(lower_known[lower_tag])
+        match = known_tags.get(tag_normalized)
+        if match is not None:
+            updated_tags.append(match)
         else:
-            matches = difflib.get_close_matches(lower_tag, lower_known.keys(), n=1, cutoff=0.8)
-            if matches:
-                suggestion = lower_known[matches[0]]
+            suggestion = known_tags.close_match(tag_normalized, cutoff=0.8)
+            if suggestion:
                 print(f"Tag '{tag_normalized}' not found. Did you mean '{suggestion}'? Using '{suggestion}'.")
                 user_output += (f"Tag '{tag_normalized}' not found. Did you mean '{suggestion}'? Using '{suggestion}'.\n") #output this to user
                 updated_tags.append(suggestion)
             else: 
                 #if here, then user must confirm the addition of new tag(s)
-                trying_to_gen_new_tag=True
-                
                 print(f"Tag '{tag_normalized}' is new. Add it to the known list?")
                 user_output += (f"Tag '{tag_normalized}' is new. Add it to the known list?\n") #output this to user
-                known_tags.append(tag_normalized)
+                new_tags.append(tag_normalized)
                 updated_tags.append(tag_normalized)
-    if trying_to_gen_new_tag:
+    if new_tags:
         if (await ask_confirmation(interaction, user_output)) == False:
             return False
-    save_known_list(filename, known_tags)
+        stored = dict(zip(new_tags, known_tags.add(*new_tags)))
+        updated_tags = [stored.get(tag, tag) for tag in updated_tags]
     return updated_tags
 
 async def get_video_info(video_url: str) -> tuple[dict,str]:
-    """Fetch video info (as JSON) using yt-dlp and return the parsed dictionary. Used for defaulting parameters
+    """Fetch video info (as JSON) using yt-dlp and return the parsed dictionary. Used for defaulting parameters.
+    The full info is kept in the info cache, so retries and the download itself don't extract the page again.
 
     :return dict: desired info from video (title, uploader, upload_date)
     :return error_str: None if no error, string containing error if error
 
     """
-    yt_dlp_info_cmd = (
-        f"{YT_DLP_PATH} --print 'title' --print 'uploader' --print 'upload_date' {video_url}"
-    )
-    returncode, output, stderr = await run_command(yt_dlp_info_cmd, verbose=True)
-
-    if returncode == 0:
+    if engine:
+        info, error = await engine.extract_info(video_url)
+        if error:
+            error_str=f"Error: Failed to fetch video info.\n{error}"
+            print(error_str)
+            return {},error_str
+        return {
+            "title": info.get("title"),
+            "uploader": info.get("uploader"),
+            "upload_date": info.get("upload_date"),
+        }, None
+
+    info = await asyncio.to_thread(info_cache.get, video_url)
+    if info is None:
+        #dump the full info once; the download stage loads it with --load-info-json instead of extracting again
+        yt_dlp_info_cmd = [YT_DLP_PATH, "-J", video_url]
+        async with ytdlp_lock.use():
+            returncode, output, stderr = await run_process(yt_dlp_info_cmd, timeout=INFO_TIMEOUT, capture_stdout=True)
+        if returncode != 0:
+            error_str=f"Error: Failed to fetch video info.\nStderr:\n{stderr}"
+            print(error_str)
+            return {},error_str
         try:
-            title, uploader, upload_date = output.strip().split("\n", 2)
-            return {
-                "title": title,
-                "uploader": uploader,
-                "upload_date": upload_date,
-            }, None
-        except ValueError:
-            error_str = f"Error: Unexpected output format.\nRaw output:\n{output}"
+            info = json.loads(output)
+        except json.JSONDecodeError:
+            error_str = f"Error: Unexpected output format.\nRaw output:\n{output[:1000]}"
             print(error_str)
             return {},error_str
-    error_str=f"Error: Failed to fetch video info.\nStderr:\n{stderr}"
-    print(error_str)
-    return {},error_str
+        info_cache.put(video_url, info)
 
-async def download_audio(interaction, video_url: str, type: str, output_name: str = None, artist_name: str = None, tags: list = None,
-                        album: str = None, addtimestamps: bool = None,usedatabase: bool=False, excludetracknumsforplaylist: bool = False) -> tuple:
+    return {
+        "title": info.get("title"),
+        "uploader": info.get("uploader"),
+        "upload_date": info.get("upload_date"),
+    }, None
+
+async def prepare_download(interaction, video_url: str, type: str, output_name: str = None, artist_name: str = None, tags: str = None,
+                        album: str = None) -> tuple:
     """
-    Downloads a YouTube video as FILE_EXTENSION audio with embedded metadata.
-    
+    Interactive part of a download: defaults parameters from the video, checks artist/tags against the known lists,
+    and asks the user to confirm. Runs in the command handler before the job is queued.
+
     If output_name or artist_name is not provided, uses video title and uploader respectively.
     Tags (if provided) are checked against known tags and added as a comma-separated metadata field.
-    
+
     :param video_url: URL of the YouTube video.
     :param type: song, album_playlist, or playlist. album_playlist downloads a playlist as one file
     :param output_name: Base name for the output file. Defaults to video title.
     :param artist_name: Artist name to embed in metadata. Defaults to video uploader.
     :param tags: tags in a string.
     :param album: album name. Must be supplied when type=playlist to get track numbers
-    :param addtimestamps: if False, then chapters are not embedded
-    :param usedatabase: for cover(s)
-    :param excludetracknumsforplaylist: applies when type=playlist: if True: dont add track numbers. Default=False
 
-    :return audio_file: The path to the downloaded "{audio file}{FILE_EXTENSION}" or None if error.
+    :return download_args: dict of resolved arguments for download_audio(), None if error
     :return error_str: None if no error, string containing error if error
-    :return output_name: either same as pass in, or title from get_video_info()
     """
-
     type = type.lower()
     if type not in ["song", "album_playlist", "playlist"]:
         error_str = f'❗"{type}" is not a valid type. Valid types are either song, album_playlist, or playlist'
         print(error_str)
-        return None, error_str, None
+        return None, error_str
 
     # Get video info to set defaults if needed
     info = {}
@@ -163,10 +164,7 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
         info,error_str = await get_video_info(video_url)
         if error_str != None:
             print(error_str)
-            return None,error_str, None
-    
-    #usedatabase initialization
-    embed_thumbnail = '--embed-thumbnail' if usedatabase is False else ''
+            return None,error_str
 
     if not output_name:
         output_name = info.get("title", "Untitled")
@@ -176,7 +174,7 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
     # Check against known lists. (authors and tags)
     artist_name = await check_and_update_artist(artist_name, interaction)
     if artist_name == False:  #user did not confirm addition of new author
-        return None,"User did not confirm addition of new author", None
+        return None,"User did not confirm addition of new author"
     if tags:
         # Split the tags by commas and semicolons, and strip extra spaces
         tags_list = [tag.strip() for tag in re.split(r"[,;]", tags) if tag.strip()]
@@ -184,7 +182,7 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
         # Process and update tags list
         tags_list = await check_and_update_tags(tags_list, interaction)
         if tags_list == False:  #user did not confirm addition of new tags
-            return None,"User did not confirm addition of new tags", None
+            return None,"User did not confirm addition of new tags"
 
         # Join them back into a properly formatted string
         #TODO: need to change this if other file types are expected
@@ -192,65 +190,329 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
     else:
         tags_str = None
 
-    # Construct the output file template; yt-dlp will append the proper extension.
-    output_file_template = os.path.join(MUSIC_DIRECTORY, f"{output_name}.%(ext)s")
-
-    # Build the metadata postprocessor args for single/playlist mode:
-    # NOTE: we will override title only for final combined file in album_playlist.
-    meta_args = f"-metadata artist='{artist_name}'"
-    if tags_str:
-        meta_args += f" -metadata genre='{tags_str}'"
-    if album:
-        meta_args += f" -metadata album='{album}'"
-    # For song or playlist (individual downloads), we include title override:
-    #   song: title = output_name
-    #   playlist: title override per-file is handled by yt-dlp --add-metadata (it embeds per-video metadata).
-    # But for album_playlist, we do NOT override title for individual tracks.
+    meta_args = _build_meta_args(artist_name, tags_str, album)
 
     #does the song already exist?
+    overwrite = True
     if os.path.exists(os.path.join(MUSIC_DIRECTORY, f"{output_name}{FILE_EXTENSION}")):
         confirmation_str = f'⚠️"{output_name}{FILE_EXTENSION}" already exists, continue anyways?\nArguments: {meta_args}'
     elif os.path.exists(os.path.join(MUSIC_DIRECTORY, f"{output_name}")):
         confirmation_str = f'⚠️"{output_name}" already exists, continue anyways?\nArguments: {meta_args}'
     else:
         confirmation_str = f'Arguments: {meta_args}'
+        overwrite = False
     # confirm selection
     if (await ask_confirmation(interaction, confirmation_str)) == False:
-        return None, "User did not confirm", None
+        return None, "User did not confirm"
+
+    return {
+        "video_url": video_url,
+        "type": type,
+        "output_name": output_name,
+        "artist_name": artist_name,
+        "tags_str": tags_str,
+        "album": album,
+        "overwrite": overwrite,  #confirmed replacing what exists: download again instead of reusing archived files
+    }, None
+
+def _metadata_arg(key: str, value: str) -> str:
+    """:return: one ffmpeg -metadata argument pair, quoted for --postprocessor-args"""
+    return f"-metadata {shlex.quote(f'{key}={value}')}"
+
+def _build_meta_args(artist_name: str, tags_str: str = None, album: str = None) -> str:
+    """Build the metadata postprocessor args for single/playlist mode.
+    yt-dlp splits them with shlex, so every value is shell quoted (names with apostrophes, eg: Guns N' Roses)
+    """
+    # NOTE: we will override title only for final combined file in album_playlist.
+    meta_args = _metadata_arg("artist", artist_name)
+    if tags_str:
+        meta_args += " " + _metadata_arg("genre", tags_str)
+    if album:
+        meta_args += " " + _metadata_arg("album", album)
+    # For song or playlist (individual downloads), we include title override:
+    #   song: title = output_name
+    #   playlist: title override per-file is handled by yt-dlp --add-metadata (it embeds per-video metadata).
+    # But for album_playlist, we do NOT override title for individual tracks.
+    return meta_args
 
-    #Update yt-dlp
-    print("Updating yt-dlp...")
-    update_command = f"{YT_DLP_PATH} -U"
-    returncode, _, stderr = await run_command(update_command, True)
-    
-    if returncode != 0:
-        error_str = f"Error updating yt-dlp: {stderr}"
-        print(error_str)
-        return None, error_str, None
+def build_download_options(outtmpl: str, meta_args: str, embed_thumbnail: bool, embed_chapters: bool,
+                           track_numbers: bool = False) -> dict:
+    """Download options shared by both engines (binary command line and in-process library)
 
-    # if user doesn't want chapters, don't include flag.
-    if addtimestamps == False or type == "album_playlist":
-        chapter_flag = "--no-embed-chapters"
+    :param outtmpl: yt-dlp output template
+    :param meta_args: ffmpeg -metadata args passed as --postprocessor-args
+    :param track_numbers: use playlist_index as track_number
+    """
+    return {
+        "audio_format": FILE_TYPE,
+        "outtmpl": outtmpl,
+        "postprocessor_args": meta_args,
+        "embed_thumbnail": embed_thumbnail,
+        "embed_chapters": embed_chapters,
+        "track_numbers": track_numbers,
+        "force_overwrites": True,
+    }
+
+def _ytdlp_command(video_url: str, options: dict) -> list:
+    """Render download options as yt-dlp arguments (one list item per argument, no shell quoting)"""
+    cmd = [YT_DLP_PATH, "-x", "--audio-format", options["audio_format"], "--newline"]
+    if options["embed_thumbnail"]:
+        cmd.append("--embed-thumbnail")
+    cmd.append("--add-metadata")
+    if options["track_numbers"]:
+        cmd += ["--parse-metadata", "playlist_index:%(track_number)s"]
+    cmd.append("--embed-chapters" if options["embed_chapters"] else "--no-embed-chapters")
+    if options["force_overwrites"]:
+        cmd.append("--force-overwrites")
+    if options.get("playlist_items"):
+        cmd += ["--playlist-items", options["playlist_items"]]
+    if options.get("print_to_file"):
+        template, path = options["print_to_file"]
+        cmd += ["--print-to-file", f"after_move:{template}", path, "--no-simulate"]
+    for path_type, path in options.get("paths", {}).items():
+        cmd += ["-P", f"{path_type}:{path}"]
+    #yt-dlp splits the postprocessor args itself, so they stay one argument
+    cmd += ["--postprocessor-args", options["postprocessor_args"], "-o", options["outtmpl"]]
+    if options.get("info_json"):
+        cmd += ["--load-info-json", options["info_json"]]
     else:
-        chapter_flag = "--embed-chapters"
+        cmd.append(video_url)
+    return cmd
+
+async def run_ytdlp_download(video_url: str, options: dict, progress: ProgressTracker = None,
+                             info: dict = None) -> tuple[int, str]:
+    """Run a download with the configured engine
+
+    :param progress: receives download progress events
+    :param info: already loaded info of video_url (library engine), loaded from the info cache if None
+    :return: returncode, stderr/error str
+    """
+    with scratch_workspace("download") as workspace:
+        #partial downloads and unconverted audio stay in the workspace, yt-dlp only moves finished files to home.
+        #(yt-dlp ignores the temp path if the output template is absolute)
+        home, filename = os.path.split(options["outtmpl"])
+        options = dict(options, outtmpl=filename, paths={"home": home, "temp": workspace.path})
+        if engine:
+            return await engine.download(video_url, options, progress.ytdlp_hook if progress else None, info)
+        options["info_json"] = info_cache.path(video_url)
+        yt_dlp_cmd = _ytdlp_command(video_url, options)
+        print(f"Full command: {shlex.join(yt_dlp_cmd)}")
+        #slot first: downloads still queued for a slot don't hold up yt-dlp updates, only running ones do
+        async with process_scheduler.slot(TRANSCODE), ytdlp_lock.use():
+            returncode, _, stderr = await run_process(process_scheduler.command(TRANSCODE, yt_dlp_cmd), verbose=True,
+                                                      timeout=DOWNLOAD_TIMEOUT,
+                                                      on_line=progress.ytdlp_line if progress else None)
+        return returncode, stderr
+
+def download_dedupe_key(download_args: dict) -> str:
+    """Identical download requests (same video/playlist, however it was linked, and same options) share one job"""
+    args = {key: value for key, value in download_args.items() if key not in ("video_url", "dedupe_key")}
+    return json.dumps([cache_key_for_url(download_args["video_url"]), args], sort_keys=True)
+
+async def _load_info(video_url: str) -> Optional[dict]:
+    """Full info of a video/playlist, from the info already extracted for the confirmation, so a playlist is only
+    listed once. Loaded in a thread (a playlist dump can be megabytes), callers pass it on instead of loading it again
+
+    :return: info dict, None if it can't be extracted
+    """
+    info = await asyncio.to_thread(info_cache.get, video_url)
+    if info is None:
+        await get_video_info(video_url)    #fills the info cache
+        info = await asyncio.to_thread(info_cache.get, video_url)
+    return info
+
+def _playlist_shards(items: list, shards: int) -> list:
+    """Split playlist positions into interleaved parts (1,4,7.. 2,5,8.. 3,6,9..), so long and short parts of the
+    playlist spread over all of them
+
+    :return: list of playlist position lists
+    """
+    shards = max(1, min(shards, len(items)))
+    return [items[start::shards] for start in range(shards)]
+
+def _record_written(entries: list, written_files: list):
+    """Record the files a playlist download wrote (see run_playlist_download(record=True)) in the download archive. Blocking
+
+    :param written_files: files of "playlist index<TAB>file path" lines
+    """
+    for written_file in written_files:
+        try:
+            with open(written_file, "r") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue    #the part didn't write anything
+        for line in lines:
+            index, _, path = line.partition("\t")
+            if index.isdigit() and 0 < int(index) <= len(entries) and entries[int(index) - 1] and os.path.isfile(path):
+                download_archive.record(entries[int(index) - 1], path)
+
+async def run_playlist_download(video_url: str, options: dict, progress: ProgressTracker = None, items: list = None,
+                                info: dict = None, record: bool = False) -> tuple[int, str]:
+    """run_ytdlp_download() for playlists, split across PLAYLIST_WORKERS concurrent downloads with --playlist-items.
+    Files keep their playlist_index (track numbers, album_playlist order) whichever part downloaded them
+
+    :param items: playlist positions (1 based) to download, None for all
+    :param info: playlist info (see _load_info()), None downloads video_url in one go
+    :param record: record the written files in the download archive (files that stay in the library)
+    :return: returncode, stderr/error str (of every part that failed)
+    """
+    if info is None:
+        return await run_ytdlp_download(video_url, options, progress)
+    entries = info.get("entries") or []
+    total = len(entries)
+    if items is None:
+        items = list(range(1, total + 1))
+    if not items:
+        print("Every playlist entry is already in the library, nothing to download")
+        return 0, ""
+    shards = _playlist_shards(items, PLAYLIST_WORKERS)
+    if len(shards) > 1:
+        print(f"Downloading {len(items)} playlist entries in {len(shards)} parts")
+
+    with scratch_workspace("playlist") as workspace:
+        written_files = [workspace.file(f"written-{number}.txt", in_ram=True) for number in range(len(shards))]
+        def shard_options(number, shard):
+            shard_options = dict(options)
+            if len(shard) < total:
+                shard_options["playlist_items"] = ",".join(map(str, shard))
+            if record:
+                #yt-dlp appends "index<TAB>path" of every file once it is in place
+                shard_options["print_to_file"] = ("%(playlist_index)s\t%(filepath)s", written_files[number])
+            return shard_options
+        def shard_progress(shard):
+            if progress is None or len(shards) == 1:
+                return progress
+            return ShardProgress(progress, shard, total)
+        results = await asyncio.gather(*(
+            run_ytdlp_download(video_url, shard_options(number, shard), shard_progress(shard), info)
+            for number, shard in enumerate(shards)
+        ))
+        if record:  #also after a failed part, whatever was written is in the library
+            await asyncio.to_thread(_record_written, entries, written_files)
+    failed = [(returncode, stderr) for returncode, stderr in results if returncode != 0]
+    if failed:
+        return failed[0][0], "\n".join(stderr for _, stderr in failed)
+    return 0, ""
+
+def _put_archived(existing: str, destination: str, tags: dict = None) -> bool:
+    """Put a file that is already in the library at destination instead of downloading the video again. Blocking
+    Files that get this download's tags are copied (a hardlink would retag the original too), others are hardlinked
+
+    :param tags: tags to write (see write_metadata_native()), None to keep the file as is
+    :return: True if the file is in place, False if it has to be downloaded
+    """
+    if not existing.endswith(FILE_EXTENSION) or (tags and native_tag_format(existing) is None):
+        return False
+    if os.path.exists(destination) and os.path.samefile(existing, destination):
+        if tags:
+            write_metadata_native(destination, tags=tags)
+        return True
+    directory, name = os.path.split(destination)
+    partial = os.path.join(directory, f".partial-{name}")   #hidden until complete, keeps the extension for mutagen
+    try:
+        if tags:
+            shutil.copy2(existing, partial)
+            write_metadata_native(partial, tags=tags)
+        else:
+            try:
+                os.link(existing, partial)
+            except OSError:
+                shutil.copy2(existing, partial)   #other filesystem
+        os.replace(partial, destination)
+    except Exception as e:
+        print(f"⚠️Failed to reuse {existing}, downloading it again: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
+        return False
+    print(f"Reused {existing} for {destination}")
+    return True
+
+async def _reuse_playlist_entries(info: dict, destination_for, tags_for=None) -> Optional[list]:
+    """Put playlist entries that are already in the library in place, so only the rest is downloaded
+
+    :param info: playlist info, None if there is nothing to reuse (not a playlist, archive off, overwrite)
+    :param destination_for: (playlist position, library file) -> destination path
+    :param tags_for: playlist position -> tags to write, None to hardlink files as they are
+    :return: playlist positions that still have to be downloaded, None to download the whole playlist
+    """
+    if info is None:
+        return None
+    entries = info.get("entries") or []
+    found = await asyncio.to_thread(download_archive.lookup_entries, entries)
+    reused = set()
+    for position, existing in found.items():
+        tags = tags_for(position) if tags_for else None
+        if await asyncio.to_thread(_put_archived, existing, destination_for(position, existing), tags):
+            reused.add(position)
+    if reused:
+        print(f"{len(reused)}/{len(entries)} playlist entries are already in the library, not downloading them again")
+    return [position for position in range(1, len(entries) + 1) if position not in reused]
+
+async def download_audio(video_url: str, type: str, output_name: str, artist_name: str, tags_str: str = None,
+                        album: str = None, addtimestamps: bool = None,usedatabase: bool=False, excludetracknumsforplaylist: bool = False,
+                        progress: ProgressTracker = None, overwrite: bool = False) -> tuple:
+    """
+    Downloads a YouTube video as FILE_EXTENSION audio with embedded metadata.
+    Non-interactive: expects arguments already resolved by prepare_download(). Ran by the job queue workers.
+    
+    :param video_url: URL of the YouTube video.
+    :param type: song, album_playlist, or playlist. album_playlist downloads a playlist as one file
+    :param output_name: Base name for the output file.
+    :param artist_name: Artist name to embed in metadata.
+    :param tags_str: tags joined with "; ", or None
+    :param album: album name. Must be supplied when type=playlist to get track numbers
+    :param addtimestamps: if False, then chapters are not embedded
+    :param usedatabase: for cover(s)
+    :param excludetracknumsforplaylist: applies when type=playlist: if True: dont add track numbers. Default=False
+    :param progress: optional, receives progress events of the download (and album_playlist combining)
+    :param overwrite: the user confirmed replacing an existing file/folder: download again, even if the videos
+        are in the download archive
+
+    :return audio_file: The path to the downloaded "{audio file}{FILE_EXTENSION}" or None if error.
+    :return error_str: None if no error, string containing error if error
+    :return output_name: same as passed in
+    """
+    #usedatabase initialization
+    embed_thumbnail = usedatabase is False
+
+    # Construct the output file template; yt-dlp will append the proper extension.
+    output_file_template = os.path.join(MUSIC_DIRECTORY, f"{output_name}.%(ext)s")
+    meta_args = _build_meta_args(artist_name, tags_str, album)
+
+    # if user doesn't want chapters, don't embed them.
+    embed_chapters = not (addtimestamps == False or type == "album_playlist")
+
+    info = await _load_info(video_url)
+    playlist_info = info if info and info.get("_type") == "playlist" else None
+    reuse = USE_DOWNLOAD_ARCHIVE and not overwrite
 
     #Download video
     print("Download starting...")
     if type == "song":
         # Download single song, override title to output_name
-        meta_args_song = meta_args + f" -metadata title='{output_name}'"
-        yt_dlp_cmd = (
-            f"{YT_DLP_PATH} -x --audio-format {FILE_TYPE} {embed_thumbnail} --add-metadata "
-            f"{chapter_flag} --force-overwrites --postprocessor-args \"{meta_args_song}\" -o \"{output_file_template}\" {video_url}"
-        )
-        print(f"Full command: {yt_dlp_cmd}")
-        returncode, _, stderr = await run_command(yt_dlp_cmd, True)
-        if returncode != 0:
-            error_str = f"Error downloading: {stderr}"
-            print(error_str)
-            return None, error_str, None
-        else:
-            audio_file = os.path.join(MUSIC_DIRECTORY, f"{output_name}{FILE_EXTENSION}")
+        meta_args_song = meta_args + " " + _metadata_arg("title", output_name)
+        options = build_download_options(output_file_template, meta_args_song, embed_thumbnail, embed_chapters)
+        audio_file = os.path.join(MUSIC_DIRECTORY, f"{output_name}{FILE_EXTENSION}")
+        song_info = info if USE_DOWNLOAD_ARCHIVE and info and info.get("_type", "video") == "video" else None
+        #a request for the same video that is already downloading finishes first, then its file is reused
+        async with download_archive.claim(song_info):
+            existing = await asyncio.to_thread(download_archive.lookup, song_info) if song_info and reuse else None
+            song_tags = {"title": output_name, "artist": artist_name}
+            if tags_str:
+                song_tags["genre"] = tags_str
+            if album:
+                song_tags["album"] = album
+            if existing and await asyncio.to_thread(_put_archived, existing, audio_file, song_tags):
+                print("Song already in the library, not downloading it again")
+                return audio_file, None, output_name
+
+            returncode, stderr = await run_ytdlp_download(video_url, options, progress, info)
+            if returncode != 0:
+                error_str = f"Error downloading: {stderr}"
+                print(error_str)
+                return None, error_str, None
+            if song_info:
+                await asyncio.to_thread(download_archive.record, song_info, audio_file)
             print("Song Download complete.")
             return audio_file, None, output_name
 
@@ -258,18 +520,23 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
         # Download each track individually into subfolder; let yt-dlp embed per-video title via --add-metadata.
         subdir = os.path.join(MUSIC_DIRECTORY, f"{output_name}")
         os.makedirs(subdir, exist_ok=True)
-        if excludetracknumsforplaylist:
-            track_nums_arg=''
-        else:
-            track_nums_arg=f'--parse-metadata "playlist_index:%(track_number)s" '
         # Use meta_args + no title override, since yt-dlp's --add-metadata embeds each video’s title automatically.
-        yt_dlp_cmd = (
-            f"{YT_DLP_PATH} -x --audio-format {FILE_TYPE} {embed_thumbnail} --add-metadata "
-            f"{track_nums_arg}"
-            f"{chapter_flag} --force-overwrites --postprocessor-args \"{meta_args}\" "
-            f"-o \"{os.path.join(subdir, '%(title)s.' + FILE_TYPE)}\" {video_url}"
-        )
-        returncode, _, stderr = await run_command(yt_dlp_cmd, True)
+        options = build_download_options(os.path.join(subdir, '%(title)s.' + FILE_TYPE), meta_args, embed_thumbnail,
+                                         embed_chapters, track_numbers=not excludetracknumsforplaylist)
+        def playlist_tags(position):
+            tags = {"artist": artist_name}
+            if tags_str:
+                tags["genre"] = tags_str
+            if album:
+                tags["album"] = album
+            if not excludetracknumsforplaylist:
+                tags["tracknumber"] = str(position)
+            return tags
+        items = await _reuse_playlist_entries(playlist_info if reuse else None,
+                                              lambda position, existing: os.path.join(subdir, os.path.basename(existing)),
+                                              playlist_tags)
+        returncode, stderr = await run_playlist_download(video_url, options, progress, items, playlist_info,
+                                                         record=USE_DOWNLOAD_ARCHIVE)
         if returncode != 0:
             error_str = f"Playlist download failed: {stderr}"
             print(error_str)
@@ -282,152 +549,151 @@ async def download_audio(interaction, video_url: str, type: str, output_name: st
         # Key: do NOT override title per track here; let --add-metadata embed actual track title.
         # Later, for the combined file, we will override title to output_name.
 
-        # 1. Create temporary directory
-        temp_dir = os.path.join(MUSIC_DIRECTORY, f"temp_{output_name}")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # 2. Download individual tracks with metadata into temp_dir
-        # No title override; use meta_args only (so yt-dlp --add-metadata embeds per-video metadata).
-        track_template = os.path.join(temp_dir, f"%(playlist_index)s_%(title)s.{FILE_TYPE}")
-        yt_dlp_cmd = (
-            f"{YT_DLP_PATH} -x --audio-format {FILE_TYPE} --add-metadata "
-            f"--no-embed-chapters --force-overwrites --postprocessor-args \"{meta_args}\" "
-            f"-o \"{track_template}\" {video_url}"
-        )
-        returncode, _, stderr = await run_command(yt_dlp_cmd, True)
-        if returncode != 0:
-            error_str = f"Playlist download failed: {stderr}"
-            print(error_str)
-            return None, error_str, None
-
-        # 3. Collect and sort track files by playlist index prefix
-        track_files = sorted(
-            [
-                os.path.join(temp_dir, f)
-                for f in os.listdir(temp_dir)
-                if f.endswith(FILE_EXTENSION)
-            ],
-            key=lambda x: int(os.path.basename(x).split('_', 1)[0])
-        )
-
-        # 4. Sanitize filenames: remove apostrophes from filenames so ffmpeg concat won't break.
-        sanitized_track_files = []
-        for track_path in track_files:
-            dirname, basename = os.path.split(track_path)
-            if "'" in basename:
-                # New filename without apostrophes
-                new_basename = basename.replace("'", "")
-                new_path = os.path.join(dirname, new_basename)
+        with scratch_workspace("album") as workspace:
+            # 1. Tracks are downloaded and combined in a scratch workspace (removed however this ends),
+            #    so FolderSync never sees them
+            temp_dir = workspace.path
+
+            # 2. Download individual tracks with metadata into temp_dir
+            # No title override; use meta_args only (so yt-dlp --add-metadata embeds per-video metadata).
+            track_template = os.path.join(temp_dir, f"%(playlist_index)s_%(title)s.{FILE_TYPE}")
+            options = build_download_options(track_template, meta_args, False, False)
+            #tracks already in the library are linked in (only read for combining, so no retagging)
+            #(tracks downloaded here aren't recorded: they only live in the workspace, the combined file is kept)
+            items = await _reuse_playlist_entries(
+                playlist_info if reuse else None,
+                lambda position, existing: os.path.join(temp_dir, f"{position}_{os.path.basename(existing)}"))
+            returncode, stderr = await run_playlist_download(video_url, options, progress, items, playlist_info)
+            if returncode != 0:
+                error_str = f"Playlist download failed: {stderr}"
+                print(error_str)
+                return None, error_str, None
+
+            # 3. Collect and sort track files by playlist index prefix
+            track_files = sorted(
+                [
+                    os.path.join(temp_dir, f)
+                    for f in os.listdir(temp_dir)
+                    if f.endswith(FILE_EXTENSION)
+                ],
+                key=lambda x: int(os.path.basename(x).split('_', 1)[0])
+            )
+
+            # 4. Sanitize filenames: remove apostrophes from filenames so ffmpeg concat won't break.
+            sanitized_track_files = []
+            for track_path in track_files:
+                dirname, basename = os.path.split(track_path)
+                if "'" in basename:
+                    # New filename without apostrophes
+                    new_basename = basename.replace("'", "")
+                    new_path = os.path.join(dirname, new_basename)
+                    try:
+                        os.replace(track_path, new_path)
+                    except Exception:
+                        os.rename(track_path, new_path)
+                    sanitized_track_files.append(new_path)
+                else:
+                    sanitized_track_files.append(track_path)
+            # Use sanitized list for next steps
+            track_files = sanitized_track_files
+
+            # 5. (Optional) Get album name from first track metadata if not provided
+            if not album and track_files:
                 try:
-                    os.replace(track_path, new_path)
-                except Exception:
-                    os.rename(track_path, new_path)
-                sanitized_track_files.append(new_path)
-            else:
-                sanitized_track_files.append(track_path)
-        # Use sanitized list for next steps
-        track_files = sanitized_track_files
-
-        # 5. (Optional) Get album name from first track metadata if not provided
-        if not album and track_files:
-            try:
-                first_track = track_files[0]
-                audio = MP4(first_track)
-                if '\xa9alb' in audio.tags:
-                    album = audio.tags['\xa9alb'][0]
-                    # Update meta_args for final combined file
-                    # (we'll apply in meta_args_combined below)
-            except Exception as e:
-                print(f"Error reading track metadata: {str(e)}")
-
-        # 6. Build chapters metadata using embedded metadata titles (so apostrophes preserved in display)
-        chapters = []
-        current_start = 0
-        for track in track_files:
-            # Get duration from file in milliseconds
-            duration = await get_audio_duration(track)
-            if duration is None:
-                duration = 0
-
-            # Get the title from embedded metadata, falling back to filename if missing
-            metadata = await get_audio_metadata(track)
-            title_meta = metadata.get('title') or ""
-            if title_meta:
-                chapter_title = title_meta
-            else:
-                # Fallback: extract from filename after index_
-                basename = os.path.basename(track)
-                try:
-                    title_part = basename.split('_', 1)[1]
-                except IndexError:
-                    title_part = os.path.splitext(basename)[0]
-                chapter_title = os.path.splitext(title_part)[0]
-            # Escape single quotes in chapter title for FFmetadata syntax:
-            chapter_title_escaped = chapter_title.replace("'", r"\'")
-
-            chapters.append({
-                'start': current_start,
-                'end': current_start + duration,
-                'title': chapter_title_escaped
-            })
-            current_start += duration
-
-        # Generate FFmetadata file
-        metadata_lines = [";FFMETADATA1"]
-        for chapter in chapters:
-            metadata_lines.extend([
-                "[CHAPTER]",
-                "TIMEBASE=1/1000",
-                f"START={chapter['start']}",
-                f"END={chapter['end']}",
-                f"title={chapter['title']}"
-            ])
-        metadata_file = os.path.join(temp_dir, "chapters.txt")
-        with open(metadata_file, 'w') as f:
-            f.write('\n'.join(metadata_lines))
-
-        # 7. Generate concat.list now that filenames have no apostrophes
-        concat_file = os.path.join(temp_dir, "concat.list")
-        with open(concat_file, 'w') as f:
-            for track in track_files:
-                abs_path = os.path.abspath(track)
-                # Surround with single quotes so ffmpeg sees: file '/path/name.opus'
-                f.write(f"file '{abs_path}'\n")
-
-        # 8. Combine tracks with metadata for final file
-        # Build meta_args for combined file: include artist, album (if any), and override title to output_name
-        meta_args_combined = f"-metadata artist='{artist_name}'"
-        if tags_str:
-            meta_args_combined += f" -metadata genre='{tags_str}'"
-        if album:
-            meta_args_combined += f" -metadata album='{album}'"
-        meta_args_combined += f" -metadata title='{output_name}'"
-
-        combined_file = os.path.join(MUSIC_DIRECTORY, f"{output_name}_combined{FILE_EXTENSION}")
-        ffmpeg_cmd = (
-            f"ffmpeg -f concat -safe 0 -i \"{concat_file}\" "
-            f"-i \"{metadata_file}\" -map_metadata 0 -map 0:a -map_chapters 1 "
-            f"-c copy {meta_args_combined} \"{combined_file}\""
-        )
-        returncode, _, error = await run_command(ffmpeg_cmd, True)
-
-        # 9. Cleanup temp files
-        shutil.rmtree(temp_dir, ignore_errors=True)
-
-        if returncode != 0:
-            error_str = f"Combination failed: {error}"
-            print(error_str)
-            return None, error_str, None
-
-        # 10. Rename/move final file to desired name.ext
-        final_file = os.path.join(MUSIC_DIRECTORY, f"{output_name}{FILE_EXTENSION}")
-        try:
-            os.replace(combined_file, final_file)
-        except Exception:
-            os.rename(combined_file, final_file)
-
-        print("Album playlist download complete")
-        return final_file, None, output_name
+                    first_track = track_files[0]
+                    audio = MP4(first_track)
+                    if '\xa9alb' in audio.tags:
+                        album = audio.tags['\xa9alb'][0]
+                        # Update meta_args for final combined file
+                        # (we'll apply in meta_args_combined below)
+                except Exception as e:
+                    print(f"Error reading track metadata: {str(e)}")
+
+            # 6. Build chapters metadata using embedded metadata titles (so apostrophes preserved in display)
+            chapters = []
+            current_start = 0
+            # Get durations (milliseconds) and metadata for all tracks at once
+            durations = await get_audio_durations(track_files)
+            metadatas = await asyncio.gather(*(get_audio_metadata(track) for track in track_files))
+            for track, duration, metadata in zip(track_files, durations, metadatas):
+                if duration is None:
+                    duration = 0
+
+                # Get the title from embedded metadata, falling back to filename if missing
+                title_meta = metadata.get('title') or ""
+                if title_meta:
+                    chapter_title = title_meta
+                else:
+                    # Fallback: extract from filename after index_
+                    basename = os.path.basename(track)
+                    try:
+                        title_part = basename.split('_', 1)[1]
+                    except IndexError:
+                        title_part = os.path.splitext(basename)[0]
+                    chapter_title = os.path.splitext(title_part)[0]
+                # Escape single quotes in chapter title for FFmetadata syntax:
+                chapter_title_escaped = chapter_title.replace("'", r"\'")
+
+                chapters.append({
+                    'start': current_start,
+                    'end': current_start + duration,
+                    'title': chapter_title_escaped
+                })
+                current_start += duration
+
+            # Generate FFmetadata file
+            metadata_lines = [";FFMETADATA1"]
+            for chapter in chapters:
+                metadata_lines.extend([
+                    "[CHAPTER]",
+                    "TIMEBASE=1/1000",
+                    f"START={chapter['start']}",
+                    f"END={chapter['end']}",
+                    f"title={chapter['title']}"
+                ])
+            metadata_file = workspace.file("chapters.txt", in_ram=True)
+            with open(metadata_file, 'w') as f:
+                f.write('\n'.join(metadata_lines))
+
+            # 7. Generate concat.list now that filenames have no apostrophes
+            concat_file = workspace.file("concat.list", in_ram=True)
+            with open(concat_file, 'w') as f:
+                for track in track_files:
+                    abs_path = os.path.abspath(track)
+                    # Surround with single quotes so ffmpeg sees: file '/path/name.opus'
+                    f.write(f"file '{abs_path}'\n")
+
+            # 8. Combine tracks with metadata for final file
+            # Build meta_args for combined file: include artist, album (if any), and override title to output_name
+            meta_args_combined = ["-metadata", f"artist={artist_name}"]
+            if tags_str:
+                meta_args_combined += ["-metadata", f"genre={tags_str}"]
+            if album:
+                meta_args_combined += ["-metadata", f"album={album}"]
+            meta_args_combined += ["-metadata", f"title={output_name}"]
+
+            combined_file = workspace.file(f"combined{FILE_EXTENSION}")
+            ffmpeg_cmd = [
+                "ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_file,
+                "-i", metadata_file, "-map_metadata", "0", "-map", "0:a", "-map_chapters", "1",
+                "-c", "copy", *meta_args_combined, combined_file
+            ]
+            if progress:
+                progress.ffmpeg_stage("Combining", current_start)
+            returncode, _, error = await process_scheduler.run(REMUX, ffmpeg_cmd, verbose=True, timeout=DOWNLOAD_TIMEOUT,
+                                                               on_line=progress.ffmpeg_line if progress else None)
+
+            if returncode != 0:
+                error_str = f"Combination failed: {error}"
+                print(error_str)
+                return None, error_str, None
+
+            # 9. Move final file to desired name.ext
+            final_file = os.path.join(MUSIC_DIRECTORY, f"{output_name}{FILE_EXTENSION}")
+            await asyncio.to_thread(move_into_place, combined_file, final_file)
+
+            print("Album playlist download complete")
+            return final_file, None, output_name
 
     else:
         return None, f"Invalid type provided: {type}", None
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("mutagen")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    #config_manager needs a filled out config.json, only the settings read on import are set here
+    music = tmp_path / "music"
+    temp = tmp_path / "temp"
+    music.mkdir()
+    temp.mkdir()
+    config_module = types.ModuleType("config.config_manager")
+    config_module.config = {"directory_settings": {"temp_directory": str(temp)},
+                            "download_settings": {"music_directory": str(music)},
+                            "cache_settings": {"info_ttl_minutes": 60, "info_max_entries": 10}}
+    monkeypatch.setitem(sys.modules, "config.config_manager", config_module)
+    for module in ("utils.info_cache", "utils.library_index"):
+        monkeypatch.delitem(sys.modules, module, raising=False)
+    from utils.library_index import LibraryIndex
+    return LibraryIndex(str(temp / "test_library.db"), str(music))
+
+def test_children_of_directory_created_after_full_refresh(index):
+    index.refresh()
+    album = os.path.join(index.root, "Album")
+    os.mkdir(album)
+    for name in ("a.opus", "b.opus"):
+        open(os.path.join(album, name), "w").close()
+
+    #the lookup refreshes the root without listing Album
+    assert index.ensure_fresh(index.root)
+    assert index.lookup(os.path.join(index.root, "album")) == album
+    assert index.children(album) == ["a.opus", "b.opus"]
+
+def test_children_of_known_directory_changed_before_parent_refresh(index):
+    album = os.path.join(index.root, "Album")
+    os.mkdir(album)
+    open(os.path.join(album, "a.opus"), "w").close()
+    index.refresh()
+    open(os.path.join(album, "b.opus"), "w").close()
+    open(os.path.join(index.root, "song.opus"), "w").close()
+
+    index.ensure_fresh(index.root)
+    assert index.children(album) == ["a.opus", "b.opus"]